@@ -4,15 +4,50 @@ import streamlit as st
 import plotly.express as px
 import plotly.graph_objects as go
 from io import BytesIO
-import openpyxl
-from openpyxl.styles import PatternFill, Font, Alignment
-from openpyxl.utils.dataframe import dataframe_to_rows
 import hashlib
 import re
 import random
 import json
 from datetime import datetime, timedelta
 import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from processamento_planilhas import (
+    MEDIA_APROVACAO,
+    TODAS_AS_ABAS,
+    FAIXAS_FREQUENCIA,
+    FORMATOS_EXPORTACAO,
+    PARQUET_AVAILABLE,
+    CuboIndicadores,
+    HierarquiaOpcoes,
+    IdentidadeEstudantesCenso,
+    MotorFiltros,
+    PlanilhaNaoReconhecida,
+    _bytes_do_arquivo,
+    _serie_bimestre,
+    alunos_em_varias_turmas,
+    atualizar_base_incremental,
+    calcula_indicadores,
+    carregar_todas_abas,
+    carregar_varias_planilhas,
+    classificar_frequencia_faixa,
+    descrever_faixas_frequencia,
+    escrever_arrow,
+    escrever_csv,
+    escrever_excel,
+    escrever_parquet,
+    frequencia_alunos_turma,
+    frequencia_por_aluno,
+    identificar_alunos_por_nome,
+    chave_conteudo_planilha,
+    gravar_cache_planilha,
+    ler_cabecalhos_planilha,
+    ler_cache_planilha,
+    processar_planilha,
+    tabela_frequencia_alunos,
+)
 
 
 def _style_apply_cells(df_or_styler, func, subset=None):
@@ -26,6 +61,43 @@ def _style_apply_cells(df_or_styler, func, subset=None):
     return styler.applymap(func, subset=subset)
 
 
+def _decorador_fragmento():
+    """Seções reexecutáveis isoladamente: st.fragment (>=1.37), st.experimental_fragment (1.33-1.36);
+    em versões mais antigas a seção roda junto com o script inteiro, como antes."""
+    return getattr(st, "fragment", None) or getattr(st, "experimental_fragment", None) or (lambda func: func)
+
+
+fragmento = _decorador_fragmento()
+
+
+def _fragmento_periodico(segundos):
+    """Fragmento que se reexecuta sozinho a cada `segundos` (acompanhamento de tarefas em segundo plano);
+    None em versões do Streamlit sem fragmentos."""
+    decorador = getattr(st, "fragment", None) or getattr(st, "experimental_fragment", None)
+    return decorador(run_every=segundos) if decorador else None
+
+
+def _abas_sob_demanda(rotulos, key):
+    """st.tabs que reexecuta ao trocar de aba, para só a aba aberta calcular o conteúdo (veja _aberto)."""
+    try:
+        return st.tabs(rotulos, key=key, on_change="rerun")
+    except TypeError:
+        return st.tabs(rotulos)  # Streamlit sem estado de abas: todas rodam, como antes
+
+
+def _expander_sob_demanda(rotulo, key, expanded=False):
+    """st.expander que reexecuta ao abrir/fechar, para o conteúdo só ser calculado quando aberto."""
+    try:
+        return st.expander(rotulo, expanded=expanded, key=key, on_change="rerun")
+    except TypeError:
+        return st.expander(rotulo, expanded=expanded)
+
+
+def _aberto(container):
+    """Aba/expander aberto; sem estado (versões antigas do Streamlit), considera sempre aberto."""
+    return getattr(container, "open", None) is not False
+
+
 # Carregar variáveis de ambiente
 try:
     from dotenv import load_dotenv
@@ -369,10 +441,10 @@ def tela_instrucoes():
         """)
     
     with col2:
-        st.markdown("""
+        st.markdown(f"""
         **Interpretação dos Resultados:**
         - Notas abaixo de 6 indicam necessidade de atenção
-        - Frequência abaixo de 75% é preocupante
+        - Frequência abaixo de {FAIXAS_FREQUENCIA['limites'][0]:g}% é preocupante
         - Alunos em "Corda Bamba" precisam de acompanhamento
         """)
     
@@ -704,49 +776,12 @@ def tela_alterar_senha():
 def gerar_relatorio_excel(df, tipo_relatorio="completo", filtros=None):
     """Gera relatório em Excel com os dados filtrados"""
     try:
-        # Criar novo workbook
-        wb = openpyxl.Workbook()
-        ws = wb.active
-        ws.title = "Relatório SGE"
-        
-        # Adicionar cabeçalho
-        ws['A1'] = "RELATÓRIO SGE - SISTEMA DE GESTÃO ESCOLAR"
-        ws['A1'].font = Font(bold=True, size=16)
-        ws['A2'] = f"Gerado em: {datetime.now().strftime('%d/%m/%Y %H:%M')}"
-        ws['A2'].font = Font(size=12)
-        ws['A3'] = f"Usuário: {st.session_state.usuario['nome']}"
-        ws['A3'].font = Font(size=12)
-        
-        # Adicionar dados
-        if not df.empty:
-            # Converter DataFrame para Excel
-            for r in dataframe_to_rows(df, index=False, header=True):
-                ws.append(r)
-            
-            # Formatar cabeçalho
-            for cell in ws[4]:  # Linha do cabeçalho
-                cell.font = Font(bold=True)
-                cell.fill = PatternFill(start_color="CCCCCC", end_color="CCCCCC", fill_type="solid")
-            
-            # Ajustar largura das colunas
-            for column in ws.columns:
-                max_length = 0
-                column_letter = column[0].column_letter
-                for cell in column:
-                    try:
-                        if len(str(cell.value)) > max_length:
-                            max_length = len(str(cell.value))
-                    except:
-                        pass
-                adjusted_width = min(max_length + 2, 50)
-                ws.column_dimensions[column_letter].width = adjusted_width
-        
-        # Salvar em BytesIO
-        output = BytesIO()
-        wb.save(output)
-        output.seek(0)
-        
-        return output.getvalue()
+        titulos = [
+            "RELATÓRIO SGE - SISTEMA DE GESTÃO ESCOLAR",
+            f"Gerado em: {datetime.now().strftime('%d/%m/%Y %H:%M')}",
+            f"Usuário: {st.session_state.usuario['nome']}",
+        ]
+        return escrever_excel({"Relatório SGE": df}, titulos={"Relatório SGE": titulos})
     except Exception as e:
         st.error(f"Erro ao gerar relatório: {str(e)}")
         return None
@@ -879,325 +914,281 @@ def enviar_email_simulado(destinatario, assunto, corpo, anexo=None):
 # -----------------------------
 st.set_page_config(page_title="Painel SGE – Notas e Alertas", layout="wide")
 
-MEDIA_APROVACAO = 6.0
-MEDIA_FINAL_ALVO = 6.0   # média final desejada após 4 bimestres
-SOMA_FINAL_ALVO = MEDIA_FINAL_ALVO * 4  # 24 pontos no ano
-
 # -----------------------------
 # Utilidades
 # -----------------------------
-def detectar_tipo_planilha(df):
-    """
-    Detecta automaticamente o tipo de planilha baseado nas colunas disponíveis
-    Retorna: 'notas_frequencia', 'conteudo_aplicado' ou 'censo_escolar'
-    """
-    colunas = [col.lower().strip() for col in df.columns]
-
-    # Verificar se é planilha de censo escolar
-    censo_indicators = [
-        'código', 'superv', 'convên', 'entidade', 'inep', 'situação', 'classific',
-        'nome', 'endereço', 'bairro', 'distrito', 'cep', 'cnpj', 'telefone', 'email',
-        'nível de', 'categoria', 'tipo de estrutura', 'etapas', 'ano letivo', 'calendário',
-        'curso', 'avaliação', 'conceito', 'servidor', 'turno', 'horário', 'tempo',
-        'média', 'salário', 'língua', 'professor', 'área de cargo', 'data na', 'cpf'
-    ]
+@st.cache_data(show_spinner=False)
+def carregar_dados(arquivo, sheet=None):
+    conteudo = _bytes_do_arquivo(arquivo)
+    if sheet == TODAS_AS_ABAS:
+        with st.spinner("Lendo todas as abas em paralelo..."):
+            return carregar_todas_abas(conteudo)
+    chave = chave_conteudo_planilha(conteudo, sheet)
+    df = ler_cache_planilha(chave)
+    if df is None:
+        origem = "dados.xlsx" if arquivo is None else BytesIO(conteudo)
+        barra = []
+
+        def _progresso(linhas_lidas, total_linhas):
+            if not barra:
+                barra.append(st.progress(0.0))
+            fracao = min(linhas_lidas / total_linhas, 1.0) if total_linhas else 0.0
+            barra[0].progress(fracao, text=f"Lendo planilha em blocos... {linhas_lidas:,} linhas".replace(",", "."))
+
+        df = processar_planilha(origem, sheet, len(conteudo) / (1024 * 1024), _progresso)
+        if barra:
+            barra[0].empty()
+        gravar_cache_planilha(chave, df)
+    df.attrs['chave_dataset'] = chave
+    return df
 
-    # Verificar se é planilha de conteúdo aplicado
-    conteudo_indicators = [
-        'componente curricu', 'atividade/conteúdo', 'situação', 'data', 'horário'
-    ]
 
-    # Verificar se é planilha de notas/frequência
-    notas_indicators = [
-        'aluno', 'nota', 'frequencia', 'turma', 'escola', 'disciplina', 'periodo'
-    ]
+@st.cache_data(show_spinner=False)
+def listar_abas(arquivo):
+    """Nomes das abas da planilha enviada (lê só a primeira linha de cada uma)."""
+    return list(ler_cabecalhos_planilha(BytesIO(_bytes_do_arquivo(arquivo))))
 
-    censo_score = sum(1 for indicator in censo_indicators
-                      if any(indicator in col for col in colunas))
-    conteudo_score = sum(1 for indicator in conteudo_indicators
-                         if any(indicator in col for col in colunas))
-    notas_score = sum(1 for indicator in notas_indicators
-                      if any(indicator in col for col in colunas))
-
-    # Se tem mais indicadores de censo escolar, é esse tipo
-    if censo_score >= 8:
-        return 'censo_escolar'
-    elif conteudo_score >= 3:
-        return 'conteudo_aplicado'
-    elif notas_score >= 3:
-        return 'notas_frequencia'
-    else:
-        # Se não conseguir detectar claramente, assume notas/frequência como padrão
-        return 'notas_frequencia'
 
 @st.cache_data(show_spinner=False)
-def carregar_dados(arquivo, sheet=None):
-    if arquivo is None:
-        # Tenta ler o padrão local "dados.xlsx"
-        df = pd.read_excel("dados.xlsx", sheet_name=sheet) if sheet else pd.read_excel("dados.xlsx")
-    else:
-        df = pd.read_excel(arquivo, sheet_name=sheet) if sheet else pd.read_excel(arquivo)
+def atualizar_base_do_usuario(nome_base, chave_dataset, _df_novo):
+    """Envio incremental: junta a exportação à base guardada do usuário (uma vez por arquivo)."""
+    with st.spinner("Atualizando a base com as linhas novas ou alteradas..."):
+        return atualizar_base_incremental(nome_base, _df_novo, calcula_indicadores)
+
+
+@st.cache_resource(show_spinner=False, max_entries=4)
+def cubo_indicadores(chave_dataset, _df, _indicadores=None):
+    """Cubo de indicadores do dataset (um por arquivo/base); os filtros só recortam."""
+    with st.spinner("Calculando indicadores..."):
+        return CuboIndicadores(_df, _indicadores)
+
+
+@st.cache_resource(show_spinner=False, max_entries=4)
+def identidade_censo(chave_dataset, _df):
+    """Identidade dos estudantes do censo (CPF / INEP / nome + nascimento), resolvida uma vez por dataset."""
+    with st.spinner("Identificando estudantes..."):
+        return IdentidadeEstudantesCenso(_df)
+
+
+@st.cache_data(show_spinner=False, max_entries=16)
+def duplicatas_censo(chave_dataset, filtros, _identidade, _linhas):
+    """Duplicatas do recorte filtrado; a tela e o download usam o mesmo resultado."""
+    return _identidade.duplicatas(_linhas)
+
+
+@st.cache_data(show_spinner=False, max_entries=16)
+def relatorio_duplicatas_censo(chave_dataset, filtros, _duplicatas):
+    """Excel com uma aba por tipo de duplicata e o resumo (gerado uma vez por recorte)."""
+    estudantes = _duplicatas["estudantes"]
+    qtd_escolas = _duplicatas["qtd_multiplas_escolas"]
+    qtd_turmas = _duplicatas["qtd_multiplas_turmas"]
+    abas = {}
+    if qtd_escolas > 0:
+        abas['Múltiplas_Escolas'] = _duplicatas["multiplas_escolas"]
+    if qtd_turmas > 0:
+        abas['Múltiplas_Turmas'] = _duplicatas["multiplas_turmas"]
+    abas['Resumo'] = pd.DataFrame({
+        'Tipo_Duplicata': ['Múltiplas Escolas', 'Múltiplas Turmas', 'Total'],
+        'Quantidade': [qtd_escolas, qtd_turmas, qtd_escolas + qtd_turmas],
+        'Percentual': [
+            f"{qtd / estudantes * 100:.1f}%" if estudantes > 0 else "0%"
+            for qtd in (qtd_escolas, qtd_turmas, qtd_escolas + qtd_turmas)
+        ],
+    })
+    return escrever_excel(abas)
+
+
+@st.cache_resource(show_spinner=False, max_entries=8)
+def motor_filtros(chave_dataset, dimensoes, _df):
+    """Índices dos filtros da barra lateral (um por dataset e conjunto de colunas filtráveis)."""
+    return MotorFiltros(_df, dimensoes)
+
+
+@st.cache_resource(show_spinner=False, max_entries=4)
+def hierarquia_opcoes(chave_dataset, coluna_aluno, _df):
+    """Opções pré-ordenadas da barra lateral (Escola → Status → turma/disciplina/aluno)."""
+    return HierarquiaOpcoes(_df, coluna_aluno)
 
-    # Normalizar nomes de colunas
-    df.columns = [c.strip() for c in df.columns]
-    
-    # Detectar tipo de planilha
-    tipo_planilha = detectar_tipo_planilha(df)
-    
-    if tipo_planilha == 'conteudo_aplicado':
-        # Processar planilha de conteúdo aplicado
-        return processar_conteudo_aplicado(df)
-    elif tipo_planilha == 'censo_escolar':
-        # Processar planilha do censo escolar
-        return processar_censo_escolar(df)
-    else:
-        # Processar planilha de notas/frequência (padrão atual)
-        return processar_notas_frequencia(df)
 
-def processar_conteudo_aplicado(df):
-    """Processa planilha de conteúdo aplicado"""
-    # Mapear colunas para nomes padronizados
-    mapeamento_colunas = {}
-    
-    for col in df.columns:
-        col_lower = col.lower().strip()
-        if 'componente curricu' in col_lower:
-            mapeamento_colunas[col] = 'Disciplina'
-        elif 'atividade/conteúdo' in col_lower or 'atividade' in col_lower:
-            mapeamento_colunas[col] = 'Atividade'
-        elif 'situação' in col_lower:
-            mapeamento_colunas[col] = 'Status'
-        elif 'data' in col_lower:
-            mapeamento_colunas[col] = 'Data'
-        elif 'horário' in col_lower:
-            mapeamento_colunas[col] = 'Horario'
-    
-    df = df.rename(columns=mapeamento_colunas)
-    
-    # Converter Data para datetime se possível
-    if 'Data' in df.columns:
-        # Tentar diferentes formatos de data
-        df['Data'] = pd.to_datetime(df['Data'], format='%d/%m/%Y', errors='coerce')
-        # Se não funcionar, tentar formato automático
-        if df['Data'].isna().all():
-            df['Data'] = pd.to_datetime(df['Data'], errors='coerce')
-    
-    # Padronizar texto dos campos principais
-    for col in ['Disciplina', 'Atividade', 'Status']:
-        if col in df.columns:
-            df[col] = df[col].astype(str).str.strip()
-    
-    # Adicionar tipo de planilha para identificação
-    df.attrs['tipo_planilha'] = 'conteudo_aplicado'
-    
-    return df
+@st.cache_data(show_spinner=False)
+def carregar_varios_arquivos(arquivos):
+    """Várias exportações do SGE (ex.: todas as escolas da regional) em um único DataFrame."""
+    with st.spinner(f"Processando {len(arquivos)} planilhas em paralelo..."):
+        return carregar_varias_planilhas([_bytes_do_arquivo(a) for a in arquivos])
+
+
+@st.cache_data(show_spinner=False, max_entries=16)
+def frequencia_dos_alunos(chave_dataset, filtros, col_aluno, _df_filt):
+    """
+    Tabela de frequência por aluno/turma (anual, bimestres, faixas e faltas) calculada uma vez
+    por dataset e estado dos filtros; usada por todas as seções de frequência.
+    """
+    return tabela_frequencia_alunos(_df_filt, col_aluno)
 
-def processar_notas_frequencia(df):
-    """Processa planilha de notas/frequência (processamento atual)"""
-    # Garantir colunas esperadas (flexível aos nomes encontrados)
-    # Esperados: Escola, Turma, Turno, Aluno, Periodo, Disciplina, Nota, Falta, Frequência, Frequência Anual
-    # Algumas planilhas têm "Período" com acento; vamos padronizar para "Periodo"
-    if "Período" in df.columns and "Periodo" not in df.columns:
-        df = df.rename(columns={"Período": "Periodo"})
-    if "Frequência" in df.columns and "Frequencia" not in df.columns:
-        df = df.rename(columns={"Frequência": "Frequencia"})
-    if "Frequência Anual" in df.columns and "Frequencia Anual" not in df.columns:
-        df = df.rename(columns={"Frequência Anual": "Frequencia Anual"})
-    
-    # Detectar se é planilha do tipo "AtaMapa" (tem coluna "Estudante" e "Composicao")
-    # Para este tipo de planilha, filtrar apenas primeiro e segundo bimestre
-    is_atamapa = "Estudante" in df.columns and "Composicao" in df.columns
-    
-    if is_atamapa and "Periodo" in df.columns:
-        # Normalizar valores de período para comparação (já feito acima, mas garantir)
-        df["Periodo"] = df["Periodo"].astype(str).str.strip()
-        # Filtrar apenas primeiro e segundo bimestre usando a mesma lógica de mapear_bimestre
-        def is_bimestre_1_ou_2(periodo):
-            """Verifica se o período é primeiro ou segundo bimestre"""
-            if not isinstance(periodo, str):
-                return False
-            p = periodo.lower()
-            return ("primeiro" in p or "1º" in p or "1o" in p) or ("segundo" in p or "2º" in p or "2o" in p)
-        
-        df = df[df["Periodo"].apply(is_bimestre_1_ou_2)].copy()
-
-    # Converter Nota (vírgula -> ponto, texto -> float)
-    if "Nota" in df.columns:
-        df["Nota"] = (
-            df["Nota"]
-            .astype(str)
-            .str.replace(",", ".", regex=False)
-            .str.replace(" ", "", regex=False)
-        )
-        df["Nota"] = pd.to_numeric(df["Nota"], errors="coerce")
-
-    # Falta -> numérico
-    if "Falta" in df.columns:
-        df["Falta"] = pd.to_numeric(df["Falta"], errors="coerce").fillna(0).astype(int)
-
-    # Frequências -> numérico
-    if "Frequencia" in df.columns:
-        df["Frequencia"] = pd.to_numeric(df["Frequencia"], errors="coerce")
-    if "Frequencia Anual" in df.columns:
-        df["Frequencia Anual"] = pd.to_numeric(df["Frequencia Anual"], errors="coerce")
-
-    # Padronizar texto dos campos principais (evita diferenças por espaços)
-    for col in ["Escola", "Turma", "Turno", "Status", "Periodo", "Disciplina"]:
-        if col in df.columns:
-            df[col] = df[col].astype(str).str.strip()
-    
-    # Detectar coluna de aluno/estudante
-    coluna_aluno = None
-    for col in ["Aluno", "Nome_Estudante", "Estudante"]:
-        if col in df.columns:
-            coluna_aluno = col
-            break
-    
-    if coluna_aluno:
-        df[coluna_aluno] = df[coluna_aluno].astype(str).str.strip()
-    
-    # Adicionar tipo de planilha para identificação
-    df.attrs['tipo_planilha'] = 'notas_frequencia'
-    
-    return df
 
+@st.cache_resource(show_spinner=False, max_entries=4)
+def identidade_alunos(chave_dataset, coluna_aluno, _df):
+    """StudentID de cada linha (grafias do mesmo nome agrupadas), calculado uma vez por dataset."""
+    with st.spinner("Identificando alunos..."):
+        return identificar_alunos_por_nome(_df[coluna_aluno]).to_numpy()
 
-def agregar_faltas_por_bimestre_aluno_turma(df, col_aluno):
+
+@st.cache_data(show_spinner=False, max_entries=16)
+def alunos_duplicados_filtrados(chave_dataset, filtros, col_aluno, _df_filt):
     """
-    Soma faltas (coluna Falta) por aluno e turma no 1º e 2º bimestre, conforme Periodo,
-    e o total dos dois bimestres. Uma linha da planilha = uma disciplina no período.
+    Alunos em mais de uma turma (Turma_1..Turma_k) calculados uma vez por dataset e estado
+    dos filtros; usados pela seção de duplicados e pela aba do "Baixar Tudo".
     """
-    if not col_aluno or "Falta" not in df.columns or "Periodo" not in df.columns:
-        return None
-    need = [col_aluno, "Turma", "Periodo", "Falta"]
-    if not all(c in df.columns for c in need):
-        return None
-    work = df[need].copy()
-    work["Falta"] = pd.to_numeric(work["Falta"], errors="coerce").fillna(0)
-    per = work["Periodo"].astype(str)
-    is_b1 = per.str.contains("Primeiro", case=False, na=False) | per.str.contains(
-        "1º", case=False, na=False
-    ) | per.str.contains("1o", case=False, na=False)
-    is_b2 = per.str.contains("Segundo", case=False, na=False) | per.str.contains(
-        "2º", case=False, na=False
-    ) | per.str.contains("2o", case=False, na=False)
-    g1 = (
-        work.loc[is_b1]
-        .groupby([col_aluno, "Turma"], as_index=False)["Falta"]
-        .sum()
-        .rename(columns={"Falta": "Faltas_1_Bimestre"})
-    )
-    g2 = (
-        work.loc[is_b2]
-        .groupby([col_aluno, "Turma"], as_index=False)["Falta"]
-        .sum()
-        .rename(columns={"Falta": "Faltas_2_Bimestre"})
-    )
-    out = g1.merge(g2, on=[col_aluno, "Turma"], how="outer")
-    out["Faltas_1_Bimestre"] = out["Faltas_1_Bimestre"].fillna(0).astype(int)
-    out["Faltas_2_Bimestre"] = out["Faltas_2_Bimestre"].fillna(0).astype(int)
-    out["Faltas_Total_1e2_Bim"] = out["Faltas_1_Bimestre"] + out["Faltas_2_Bimestre"]
-    return out
-
-
-def classificar_frequencia_faixa(freq):
-    if pd.isna(freq):
-        return "Sem dados"
-    if freq < 75:
-        return "Reprovado"
-    if freq < 80:
-        return "Alto Risco"
-    if freq < 90:
-        return "Risco Moderado"
-    if freq < 95:
-        return "Ponto de Atenção"
-    return "Meta Favorável"
-
-
-# Nome usado em gráficos e exportação (mesma lógica de classificar_frequencia_faixa)
-classificar_frequencia_geral = classificar_frequencia_faixa
-
-
-def _mascara_periodo_bimestre(serie_periodo, bimestre):
-    per = serie_periodo.astype(str)
-    if bimestre == 1:
-        return per.str.contains("Primeiro", case=False, na=False) | per.str.contains(
-            "1º", case=False, na=False
-        ) | per.str.contains("1o", case=False, na=False)
-    return per.str.contains("Segundo", case=False, na=False) | per.str.contains(
-        "2º", case=False, na=False
-    ) | per.str.contains("2o", case=False, na=False)
-
-
-def contagem_frequencia_por_faixa(df, col_aluno, tipo="anual"):
+    col_id = "StudentID" if "StudentID" in _df_filt.columns else None
+    return alunos_em_varias_turmas(_df_filt, col_aluno, col_id)
+
+
+def _formatar_notas(tabela):
+    """N1, N2, Media12 e ReqMediaProx2 com 1 casa decimal, removendo .0 desnecessário (altera a tabela)."""
+    for c in ["N1", "N2", "Media12", "ReqMediaProx2"]:
+        if c in tabela.columns:
+            tabela[c] = tabela[c].round(1)
+            tabela[c] = tabela[c].apply(lambda x: f"{x:.1f}".rstrip('0').rstrip('.') if pd.notna(x) else x)
+    return tabela
+
+
+@st.cache_data(show_spinner=False, max_entries=4)
+def contagens_visao_geral(chave_dataset, coluna_aluno, _df):
+    """Contagens do topo da página, calculadas uma vez por dataset: aparecem antes de qualquer seção pesada."""
+    def _distintos(coluna):
+        return int(_df[coluna].nunique()) if coluna and coluna in _df.columns else 0
+
+    return {
+        "Registros": len(_df),
+        "Escolas": _distintos("Escola"),
+        "Turmas": _distintos("Turma"),
+        "Disciplinas": _distintos("Disciplina"),
+        "Status": _distintos("Status"),
+        "Estudantes": _distintos(coluna_aluno),
+    }
+
+
+@st.cache_data(show_spinner=False, max_entries=16)
+def tabela_alerta_formatada(chave_dataset, filtros, col_aluno, _indic):
+    """Alunos-disciplinas em alerta (sem os "Incompleto", que têm seção própria), ordenados e formatados."""
+    alerta = _indic[_indic["Alerta"] & (_indic["Classificacao"] != "Incompleto")]
+    return _formatar_notas(alerta.sort_values(["Turma", col_aluno, "Disciplina"]))
+
+
+@st.cache_data(show_spinner=False, max_entries=16)
+def panorama_formatado(chave_dataset, filtros, _indic):
+    """Panorama geral de notas formatado (tela e "Baixar Tudo")."""
+    return _formatar_notas(_indic.copy())
+
+
+@st.cache_resource(show_spinner=False)
+def executor_secoes():
+    """Threads dos cálculos pesados das seções, compartilhadas entre sessões."""
+    return ThreadPoolExecutor(max_workers=min(4, os.cpu_count() or 1), thread_name_prefix="painel-secoes")
+
+
+def _aguardar(futuro, mensagem):
+    """Resultado de um cálculo em segundo plano; até ele terminar, um spinner ocupa o lugar da seção."""
+    if not futuro.done():
+        with st.spinner(mensagem):
+            return futuro.result()
+    return futuro.result()
+
+
+@st.cache_data(show_spinner=False, max_entries=16)
+def frequencia_detalhada(chave_dataset, filtros, col_aluno, tipo, _tabela_freq):
+    """Tabela de uma aba da Análise Detalhada de Frequência, montada quando a aba é aberta."""
+    return montar_freq_detalhada_aluno_turma(_tabela_freq, col_aluno, tipo)
+
+
+@st.cache_data(show_spinner=False, max_entries=16)
+def tabela_incompletos(chave_dataset, filtros, col_aluno, aba, _incompletos):
+    """Incompletos de uma aba ("geral", "bim1", "bim2") ordenados e com notas formatadas, montados quando a aba é aberta."""
+    tabela = _formatar_notas(_incompletos.sort_values(["Turma", col_aluno, "Disciplina"]))
+    # Qual bimestre falta (o 1º quando não há N1)
+    tabela["Falta"] = np.where(tabela["N1"].isna(), "1º Bimestre", "2º Bimestre")
+    return tabela
+
+
+def contagem_frequencia_por_faixa(tabela_freq, tipo="anual"):
     """
     Conta alunos únicos por faixa de frequência.
     tipo: 'anual' (Frequencia Anual), 'bim1' ou 'bim2' (média da coluna Frequencia no período).
     """
-    if not col_aluno or col_aluno not in df.columns:
+    if tabela_freq is None:
         return None
-    if tipo == "anual":
-        if "Frequencia Anual" in df.columns:
-            freq = df.groupby(col_aluno)["Frequencia Anual"].last().reset_index()
-            freq = freq.rename(columns={"Frequencia Anual": "Frequencia"})
-        elif "Frequencia" in df.columns:
-            freq = df.groupby(col_aluno)["Frequencia"].last().reset_index()
-        else:
-            return None
-    else:
-        if "Frequencia" not in df.columns or "Periodo" not in df.columns:
-            return None
-        bim = 1 if tipo == "bim1" else 2
-        subset = df.loc[_mascara_periodo_bimestre(df["Periodo"], bim)]
-        if subset.empty:
-            return None
-        freq = subset.groupby(col_aluno)["Frequencia"].mean().reset_index()
-    freq["Classificacao_Freq"] = freq["Frequencia"].apply(classificar_frequencia_faixa)
-    contagem = freq["Classificacao_Freq"].value_counts()
-    contagem = contagem.drop(labels=["Sem dados"], errors="ignore")
+    freq = frequencia_por_aluno(tabela_freq, tipo)
+    if freq is None:
+        return None
+    contagem = classificar_frequencia_faixa(freq).value_counts()
+    contagem = contagem[contagem > 0].drop(labels=[FAIXAS_FREQUENCIA["sem_dados"]], errors="ignore")
     return contagem if contagem.sum() > 0 else None
 
 
-def montar_freq_detalhada_aluno_turma(df, col_aluno, tipo="anual"):
+def montar_freq_detalhada_aluno_turma(tabela_freq, col_aluno, tipo="anual"):
     """
-    Tabela por aluno/turma: anual (Frequencia Anual) ou média de Frequencia no bimestre.
-    tipo: 'anual', 'bim1', 'bim2'
+    Tabela por aluno/turma: anual (Frequencia Anual) ou média de Frequencia no bimestre,
+    com as faltas do 1º/2º bimestre. tipo: 'anual', 'bim1', 'bim2'
     """
-    if not col_aluno or col_aluno not in df.columns or "Turma" not in df.columns:
+    if tabela_freq is None:
         return None
-    if tipo == "anual":
-        if "Frequencia Anual" in df.columns:
-            freq = df.groupby([col_aluno, "Turma"])["Frequencia Anual"].last().reset_index()
-            freq = freq.rename(columns={"Frequencia Anual": "Frequencia"})
-        elif "Frequencia" in df.columns:
-            freq = df.groupby([col_aluno, "Turma"])["Frequencia"].last().reset_index()
-        else:
-            return None
+    freq = frequencia_alunos_turma(tabela_freq, tipo)
+    if freq is None:
+        return None
+    return freq.sort_values(["Frequencia", col_aluno], ascending=[True, True])
+
+
+def _posicao_cor_faixa(rotulo, qtd_cores):
+    """Posição na paleta (da pior para a melhor) da faixa de frequência; None se não for uma faixa."""
+    rotulos = FAIXAS_FREQUENCIA["rotulos"]
+    if rotulo not in rotulos:
+        return None
+    if len(rotulos) == 1:
+        return qtd_cores - 1
+    return round(rotulos.index(rotulo) * (qtd_cores - 1) / (len(rotulos) - 1))
+
+
+# Cores da classificação de notas (tabelas de alerta, incompletos, panorama e cruzamento)
+def color_classification(val):
+    if val == "Verde":
+        return "background-color: #10b981; color: white; font-weight: bold;"  # Verde forte
+    elif val == "Vermelho Duplo":
+        return "background-color: #dc2626; color: white; font-weight: bold;"  # Vermelho forte
+    elif val == "Queda p/ Vermelho":
+        return "background-color: #f59e0b; color: white; font-weight: bold;"  # Laranja forte
+    elif val == "Recuperou":
+        return "background-color: #3b82f6; color: white; font-weight: bold;"  # Azul forte
+    elif val == "Incompleto":
+        return "background-color: #6b7280; color: white; font-weight: bold;"  # Cinza forte
     else:
-        if "Frequencia" not in df.columns or "Periodo" not in df.columns:
-            return None
-        bim = 1 if tipo == "bim1" else 2
-        subset = df.loc[_mascara_periodo_bimestre(df["Periodo"], bim)]
-        if subset.empty:
-            return None
-        freq = subset.groupby([col_aluno, "Turma"])["Frequencia"].mean().reset_index()
-    freq["Classificacao_Freq"] = freq["Frequencia"].apply(classificar_frequencia_faixa)
-    freq = freq.sort_values(["Frequencia", col_aluno], ascending=[True, True])
-    return freq
+        return ""
 
 
 def _estilo_classificacao_frequencia(val):
-    if val == "Reprovado":
-        return "background-color: #f8d7da; color: #721c24"
-    if val == "Alto Risco":
-        return "background-color: #f5c6cb; color: #721c24"
-    if val == "Risco Moderado":
-        return "background-color: #fff3cd; color: #856404"
-    if val == "Ponto de Atenção":
-        return "background-color: #ffeaa7; color: #856404"
-    if val == "Meta Favorável":
-        return "background-color: #d4edda; color: #155724"
-    return "background-color: #e2e3e5; color: #383d41"
+    estilos = [
+        "background-color: #f8d7da; color: #721c24",
+        "background-color: #f5c6cb; color: #721c24",
+        "background-color: #fff3cd; color: #856404",
+        "background-color: #ffeaa7; color: #856404",
+        "background-color: #d4edda; color: #155724",
+    ]
+    posicao = _posicao_cor_faixa(val, len(estilos))
+    return estilos[posicao] if posicao is not None else "background-color: #e2e3e5; color: #383d41"
+
+
+def formatos_classificacao_excel():
+    """
+    Legenda de cores das classificações de notas e de frequência, a mesma da tela, no formato de
+    escrever_excel(formatos=...): vira regras de formatação condicional nas planilhas exportadas.
+    """
+    rotulos_freq = list(FAIXAS_FREQUENCIA["rotulos"]) + [FAIXAS_FREQUENCIA["sem_dados"]]
+    return {
+        "Classificacao": {
+            rotulo: color_classification(rotulo)
+            for rotulo in ("Verde", "Vermelho Duplo", "Queda p/ Vermelho", "Recuperou", "Incompleto")
+        },
+        "Classificacao_Freq": {rotulo: _estilo_classificacao_frequencia(rotulo) for rotulo in rotulos_freq},
+    }
 
 
 def render_tabela_frequencia_detalhada(
@@ -1232,27 +1223,24 @@ def render_tabela_frequencia_detalhada(
     col_export, _ = st.columns([1, 4])
     with col_export:
         if st.button("📊 Exportar", key=export_key, help=f"Baixar planilha — {titulo}"):
-            excel_data = criar_excel_formatado(freq_detalhada[cols_freq_view], "Analise_Frequencia")
-            st.download_button(
-                label="Baixar Excel",
-                data=excel_data,
-                file_name=export_filename,
-                mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-                key=f"{export_key}_dl",
-            )
+            botoes_download(freq_detalhada[cols_freq_view], "Analise_Frequencia", export_filename, key=f"{export_key}_dl")
 
 
 def render_cards_resumo_frequencia(contagem_freq):
-    """Exibe as 5 faixas de frequencia em colunas (contagem + %)."""
+    """Exibe as faixas de frequencia em colunas (contagem + %)."""
+    cores = [
+        ("#dbeafe", "#bfdbfe", "#3b82f6", "#1e40af"),
+        ("#e0f2fe", "#b3e5fc", "#0ea5e9", "#0c4a6e"),
+        ("#f0f9ff", "#dbeafe", "#1e40af", "#1e40af"),
+        ("#eff6ff", "#dbeafe", "#3b82f6", "#1e40af"),
+        ("#dbeafe", "#bfdbfe", "#3b82f6", "#1e40af"),
+    ]
     faixas = [
-        ("Reprovado", "< 75% (Reprovado)", "#dbeafe", "#bfdbfe", "#3b82f6", "#1e40af"),
-        ("Alto Risco", "< 80% (Alto Risco)", "#e0f2fe", "#b3e5fc", "#0ea5e9", "#0c4a6e"),
-        ("Risco Moderado", "< 90% (Risco Moderado)", "#f0f9ff", "#dbeafe", "#1e40af", "#1e40af"),
-        ("Ponto de Atenção", "< 95% (Ponto Atenção)", "#eff6ff", "#dbeafe", "#3b82f6", "#1e40af"),
-        ("Meta Favorável", "≥ 95% (Meta Favorável)", "#dbeafe", "#bfdbfe", "#3b82f6", "#1e40af"),
+        (chave, f"{intervalo} ({chave})", *cores[_posicao_cor_faixa(chave, len(cores))])
+        for chave, intervalo in descrever_faixas_frequencia()
     ]
     total = contagem_freq.sum()
-    cols = st.columns(5)
+    cols = st.columns(len(faixas))
     for col, (chave, rotulo, g1, g2, borda, texto) in zip(cols, faixas):
         valor = int(contagem_freq.get(chave, 0))
         pct = (valor / total * 100) if total > 0 else 0
@@ -1272,92 +1260,30 @@ def render_cards_resumo_frequencia(contagem_freq):
 
 
 
-def processar_censo_escolar(df):
-    """
-    Processa dados do Censo Escolar - Lista de Estudantes
-    """
-    # Normalizar nomes das colunas
-    df.columns = df.columns.str.strip()
-    
-    # Mapear colunas específicas da planilha ListaDeEstudantes_TurmaEscolarização
-    colunas_mapeadas = {}
-    for col in df.columns:
-        col_lower = col.lower()
-        if col == 'Nome':
-            colunas_mapeadas[col] = 'Nome_Estudante'
-        elif col == 'Escola':
-            colunas_mapeadas[col] = 'Escola'
-        elif col == 'CPF':
-            colunas_mapeadas[col] = 'CPF'
-        elif col == 'INEP':
-            colunas_mapeadas[col] = 'Codigo_Estudante'
-        elif col == 'Situação da Matrícula':
-            colunas_mapeadas[col] = 'Situacao'
-        elif col == 'Turno':
-            colunas_mapeadas[col] = 'Turno'
-        elif col == 'Data Nascimento':
-            colunas_mapeadas[col] = 'Data_Nascimento'
-        elif col == 'Nível de Ensino':
-            colunas_mapeadas[col] = 'Nivel_Educacao'
-        elif col == 'Ano/Série':
-            colunas_mapeadas[col] = 'Ano_Serie'
-        elif col == 'Descrição Turma':
-            colunas_mapeadas[col] = 'Turma'
-        elif col == 'Entidade Conveniada':
-            colunas_mapeadas[col] = 'Entidade'
-        elif col == 'Superintendência Regional':
-            colunas_mapeadas[col] = 'Supervisao'
-        elif col == 'Convênio':
-            colunas_mapeadas[col] = 'Convenio'
-        elif col == 'INEP da Escola':
-            colunas_mapeadas[col] = 'INEP_Escola'
-        elif col == 'Classificação da Escola':
-            colunas_mapeadas[col] = 'Classificacao'
-        elif col == 'Endereço':
-            colunas_mapeadas[col] = 'Endereco'
-        elif col == 'Bairro':
-            colunas_mapeadas[col] = 'Bairro'
-        elif col == 'Distrito':
-            colunas_mapeadas[col] = 'Distrito'
-        elif col == 'Cep':
-            colunas_mapeadas[col] = 'CEP'
-        elif col == 'Telefone Principal':
-            colunas_mapeadas[col] = 'Telefone'
-        elif col == 'E-mail':
-            colunas_mapeadas[col] = 'Email'
-        elif col == 'CNPJ':
-            colunas_mapeadas[col] = 'CNPJ'
-        elif col == 'Carga Horária':
-            colunas_mapeadas[col] = 'Carga_Horaria'
-        elif col == 'Entrada':
-            colunas_mapeadas[col] = 'Data_Entrada'
-        elif col == 'Data de saída':
-            colunas_mapeadas[col] = 'Data_Saida'
-        elif col == 'Cor/Raça':
-            colunas_mapeadas[col] = 'Cor_Raca'
-    
-    # Renomear colunas
-    df = df.rename(columns=colunas_mapeadas)
-    
-    # Converter tipos de dados
-    if 'Data_Nascimento' in df.columns:
-        df['Data_Nascimento'] = pd.to_datetime(df['Data_Nascimento'], dayfirst=True, errors='coerce')
-    
-    if 'Data_Entrada' in df.columns:
-        df['Data_Entrada'] = pd.to_datetime(df['Data_Entrada'], dayfirst=True, errors='coerce')
-    
-    if 'Data_Saida' in df.columns:
-        df['Data_Saida'] = pd.to_datetime(df['Data_Saida'], dayfirst=True, errors='coerce')
-    
-    # Padronizar texto dos campos principais
-    for col in ['Nome_Estudante', 'Escola', 'Situacao', 'Turno', 'Nivel_Educacao', 'Ano_Serie', 'Turma']:
-        if col in df.columns:
-            df[col] = df[col].astype(str).str.strip()
-    
-    # Marcar tipo de planilha
-    df.attrs['tipo_planilha'] = 'censo_escolar'
-    
-    return df
+def render_relatorio_qualidade(qualidade):
+    """Resumo dos problemas de dados encontrados na conversão da planilha (fica no cache junto com ela)."""
+    if not qualidade:
+        return
+    verificacoes = [
+        ("Notas que não são número", qualidade.get("notas_invalidas", 0)),
+        ("Notas fora de 0–10", qualidade.get("notas_fora_0_10", 0)),
+        ("Frequências fora de 0–100%", qualidade.get("frequencias_fora_0_100", 0)),
+        ("Linhas repetidas (aluno, disciplina, período)", qualidade.get("linhas_duplicadas", 0)),
+        ("Linhas sem período", qualidade.get("periodos_vazios", 0)),
+    ]
+    problemas = sum(qtd for _, qtd in verificacoes)
+    titulo = "🧪 Qualidade dos dados: " + (
+        f"{problemas:,} ocorrências".replace(",", ".") if problemas else "nenhum problema encontrado"
+    )
+    with st.expander(titulo, expanded=False):
+        st.dataframe(
+            pd.DataFrame(verificacoes, columns=["Verificação", "Linhas"]),
+            use_container_width=True,
+        )
+        exemplos = qualidade.get("exemplos_notas_invalidas") or []
+        if exemplos:
+            st.caption("Exemplos de notas não numéricas: " + ", ".join(f"`{v}`" for v in exemplos))
+
 
 def criar_interface_censo_escolar(df):
     """Cria interface específica para análise do Censo Escolar"""
@@ -1387,9 +1313,9 @@ def criar_interface_censo_escolar(df):
         escolas_unicas = df['Escola'].nunique() if 'Escola' in df.columns else 0
         st.metric("Escolas", escolas_unicas)
     
+    identidade = identidade_censo(df.attrs.get('chave_dataset'), df)
     with col3:
-        estudantes_unicos = df['Nome_Estudante'].nunique() if 'Nome_Estudante' in df.columns else 0
-        st.metric("Estudantes Únicos", estudantes_unicos)
+        st.metric("Estudantes Únicos", identidade.estudantes(), help="Por CPF; sem CPF, por INEP; sem ambos, por nome e data de nascimento")
     
     with col4:
         turmas_unicas = df['Turma'].nunique() if 'Turma' in df.columns else 0
@@ -1397,6 +1323,8 @@ def criar_interface_censo_escolar(df):
     
     # Filtros Simples
     st.sidebar.markdown("### 🔍 Filtros")
+    motor = motor_filtros(df.attrs.get('chave_dataset'), ("Escola", "Situacao"), df)
+    selecoes = {}
     
     # Filtro por Escola
     if 'Escola' in df.columns:
@@ -1404,12 +1332,11 @@ def criar_interface_censo_escolar(df):
         escola_sel = st.sidebar.selectbox("Escola", escolas_disponiveis)
         
         if escola_sel != 'Todas as Escolas':
-            df_filt = df[df['Escola'] == escola_sel].copy()
-        else:
-            df_filt = df.copy()
+            selecoes['Escola'] = [escola_sel]
     else:
-        df_filt = df.copy()
         escola_sel = 'Todas as Escolas'
+    linhas_filt = motor.posicoes(selecoes)
+    df_filt = motor.filtrar(df, selecoes)
     
     # Filtro por Situação (apenas Matriculado)
     if 'Situacao' in df.columns:
@@ -1417,7 +1344,9 @@ def criar_interface_censo_escolar(df):
         situacao_sel = st.sidebar.selectbox("Situação", situacoes_disponiveis)
         
         if situacao_sel != 'Todas as Situações':
-            df_filt = df_filt[df_filt['Situacao'] == situacao_sel].copy()
+            selecoes['Situacao'] = [situacao_sel]
+            linhas_filt = motor.posicoes(selecoes)
+            df_filt = motor.filtrar(df, selecoes)
     else:
         situacao_sel = 'Todas as Situações'
     
@@ -1430,8 +1359,7 @@ def criar_interface_censo_escolar(df):
         st.metric("Registros", f"{len(df_filt):,}")
     
     with col2:
-        estudantes_filtrados = df_filt['Nome_Estudante'].nunique() if 'Nome_Estudante' in df_filt.columns else 0
-        st.metric("Estudantes", estudantes_filtrados)
+        st.metric("Estudantes", identidade.estudantes(linhas_filt))
     
     with col3:
         escolas_filtradas = df_filt['Escola'].nunique() if 'Escola' in df_filt.columns else 0
@@ -1441,172 +1369,61 @@ def criar_interface_censo_escolar(df):
     st.markdown("### 🔍 Duplicatas Encontradas")
     
     if 'Nome_Estudante' in df_filt.columns and 'Escola' in df_filt.columns:
-        # 1. Duplicatas por Escola (estudante em múltiplas escolas)
-        duplicatas_escola = df_filt.groupby('Nome_Estudante').agg({
-            'Escola': 'nunique',
-            'Turma': 'nunique' if 'Turma' in df_filt.columns else 'count'
-        }).reset_index()
-        
-        estudantes_multiplas_escolas = duplicatas_escola[duplicatas_escola['Escola'] > 1]
-        
-        # 2. Duplicatas por Turma (estudante em múltiplas turmas na mesma escola)
-        duplicatas_turma = df_filt.groupby(['Nome_Estudante', 'Escola']).agg({
-            'Turma': 'nunique' if 'Turma' in df_filt.columns else 'count'
-        }).reset_index()
-        
-        estudantes_multiplas_turmas = duplicatas_turma[duplicatas_turma['Turma'] > 1]
+        # Estudantes em múltiplas escolas e em múltiplas turmas da mesma escola (por CPF/INEP/nome + nascimento)
+        estado_filtros = (escola_sel, situacao_sel)
+        duplicatas = duplicatas_censo(df.attrs.get('chave_dataset'), estado_filtros, identidade, linhas_filt)
+        qtd_multiplas_escolas = duplicatas["qtd_multiplas_escolas"]
+        qtd_multiplas_turmas = duplicatas["qtd_multiplas_turmas"]
         
         # Métricas Principais
         col1, col2, col3, col4 = st.columns(4)
         
         with col1:
-            st.metric("Em Múltiplas Escolas", len(estudantes_multiplas_escolas))
+            st.metric("Em Múltiplas Escolas", qtd_multiplas_escolas)
         
         with col2:
-            st.metric("Em Múltiplas Turmas", len(estudantes_multiplas_turmas))
+            st.metric("Em Múltiplas Turmas", qtd_multiplas_turmas)
         
         with col3:
-            total_duplicatas = len(estudantes_multiplas_escolas) + len(estudantes_multiplas_turmas)
+            total_duplicatas = qtd_multiplas_escolas + qtd_multiplas_turmas
             st.metric("Total Duplicatas", total_duplicatas)
         
         with col4:
-            percentual = (total_duplicatas / len(df_filt['Nome_Estudante'].unique())) * 100 if len(df_filt['Nome_Estudante'].unique()) > 0 else 0
+            percentual = (total_duplicatas / duplicatas["estudantes"]) * 100 if duplicatas["estudantes"] > 0 else 0
             st.metric("Percentual", f"{percentual:.1f}%")
         
         # Tabelas Detalhadas
-        if len(estudantes_multiplas_escolas) > 0 or len(estudantes_multiplas_turmas) > 0:
+        if qtd_multiplas_escolas > 0 or qtd_multiplas_turmas > 0:
             
-            # 1. Estudantes em Múltiplas Escolas (Detalhado)
-            if len(estudantes_multiplas_escolas) > 0:
+            # 1. Estudantes em Múltiplas Escolas (Detalhado: escola + turma de cada registro)
+            if qtd_multiplas_escolas > 0:
                 st.markdown("#### 🏫 Estudantes em Múltiplas Escolas")
-                
-                # Criar tabela detalhada mostrando escola + turma para cada estudante
-                duplicatas_escola_detalhadas = []
-                for _, row in estudantes_multiplas_escolas.iterrows():
-                    nome = row['Nome_Estudante']
-                    dados_estudante = df_filt[df_filt['Nome_Estudante'] == nome]
-                    
-                    # Para cada escola do estudante, mostrar a turma correspondente
-                    for _, linha in dados_estudante.iterrows():
-                        duplicatas_escola_detalhadas.append({
-                            'Nome': nome,
-                            'Escola': linha['Escola'],
-                            'Turma': linha['Turma'] if 'Turma' in linha else 'N/A',
-                            'CPF': linha['CPF'] if 'CPF' in linha else 'N/A',
-                            'Situacao': linha['Situacao'] if 'Situacao' in linha else 'N/A'
-                        })
-                
-                df_duplicatas_escola = pd.DataFrame(duplicatas_escola_detalhadas)
-                st.dataframe(df_duplicatas_escola, use_container_width=True)
+                st.dataframe(duplicatas["multiplas_escolas"], use_container_width=True)
             
             # 2. Estudantes em Múltiplas Turmas (mesma escola) - Detalhado
-            if len(estudantes_multiplas_turmas) > 0:
+            if qtd_multiplas_turmas > 0:
                 st.markdown("#### 🎓 Estudantes em Múltiplas Turmas (Mesma Escola)")
-                
-                # Criar tabela detalhada mostrando cada linha de turma
-                duplicatas_turma_detalhadas = []
-                for _, row in estudantes_multiplas_turmas.iterrows():
-                    nome = row['Nome_Estudante']
-                    escola = row['Escola']
-                    dados_estudante = df_filt[(df_filt['Nome_Estudante'] == nome) & 
-                                            (df_filt['Escola'] == escola)]
-                    
-                    # Para cada turma do estudante na mesma escola
-                    for _, linha in dados_estudante.iterrows():
-                        duplicatas_turma_detalhadas.append({
-                            'Nome': nome,
-                            'Escola': escola,
-                            'Turma': linha['Turma'] if 'Turma' in linha else 'N/A',
-                            'CPF': linha['CPF'] if 'CPF' in linha else 'N/A',
-                            'Situacao': linha['Situacao'] if 'Situacao' in linha else 'N/A'
-                        })
-                
-                df_duplicatas_turma = pd.DataFrame(duplicatas_turma_detalhadas)
-                st.dataframe(df_duplicatas_turma, use_container_width=True)
+                st.dataframe(duplicatas["multiplas_turmas"], use_container_width=True)
             else:
                 st.info("ℹ️ Nenhum estudante encontrado em múltiplas turmas da mesma escola.")
             
             # Botão de Download com Abas Separadas
             st.markdown("#### 💾 Download dos Dados")
-            
-            # Preparar dados para download em abas separadas
-            if len(estudantes_multiplas_escolas) > 0 or len(estudantes_multiplas_turmas) > 0:
-                
-                # Converter para Excel com abas separadas
-                output = BytesIO()
-                with pd.ExcelWriter(output, engine='openpyxl') as writer:
-                    
-                    # Aba 1: Duplicatas por Escola (Detalhado)
-                    if len(estudantes_multiplas_escolas) > 0:
-                        duplicatas_escola_download = []
-                        for _, row in estudantes_multiplas_escolas.iterrows():
-                            nome = row['Nome_Estudante']
-                            dados_estudante = df_filt[df_filt['Nome_Estudante'] == nome]
-                            
-                            # Para cada escola do estudante, mostrar a turma correspondente
-                            for _, linha in dados_estudante.iterrows():
-                                duplicatas_escola_download.append({
-                                    'Nome': nome,
-                                    'Escola': linha['Escola'],
-                                    'Turma': linha['Turma'] if 'Turma' in linha else 'N/A',
-                                    'CPF': linha['CPF'] if 'CPF' in linha else 'N/A',
-                                    'Situacao': linha['Situacao'] if 'Situacao' in linha else 'N/A'
-                                })
-                        
-                        df_escola_download = pd.DataFrame(duplicatas_escola_download)
-                        df_escola_download.to_excel(writer, sheet_name='Múltiplas_Escolas', index=False)
-                    
-                    # Aba 2: Duplicatas por Turma (Detalhado)
-                    if len(estudantes_multiplas_turmas) > 0:
-                        duplicatas_turma_download = []
-                        for _, row in estudantes_multiplas_turmas.iterrows():
-                            nome = row['Nome_Estudante']
-                            escola = row['Escola']
-                            dados_estudante = df_filt[(df_filt['Nome_Estudante'] == nome) & 
-                                                    (df_filt['Escola'] == escola)]
-                            
-                            # Para cada turma do estudante na mesma escola
-                            for _, linha in dados_estudante.iterrows():
-                                duplicatas_turma_download.append({
-                                    'Nome': nome,
-                                    'Escola': escola,
-                                    'Turma': linha['Turma'] if 'Turma' in linha else 'N/A',
-                                    'CPF': linha['CPF'] if 'CPF' in linha else 'N/A',
-                                    'Situacao': linha['Situacao'] if 'Situacao' in linha else 'N/A'
-                                })
-                        
-                        df_turma_download = pd.DataFrame(duplicatas_turma_download)
-                        df_turma_download.to_excel(writer, sheet_name='Múltiplas_Turmas', index=False)
-                    
-                    # Aba 3: Resumo Geral
-                    resumo_geral = pd.DataFrame({
-                        'Tipo_Duplicata': ['Múltiplas Escolas', 'Múltiplas Turmas', 'Total'],
-                        'Quantidade': [
-                            len(estudantes_multiplas_escolas),
-                            len(estudantes_multiplas_turmas),
-                            len(estudantes_multiplas_escolas) + len(estudantes_multiplas_turmas)
-                        ],
-                        'Percentual': [
-                            f"{(len(estudantes_multiplas_escolas) / len(df_filt['Nome_Estudante'].unique())) * 100:.1f}%" if len(df_filt['Nome_Estudante'].unique()) > 0 else "0%",
-                            f"{(len(estudantes_multiplas_turmas) / len(df_filt['Nome_Estudante'].unique())) * 100:.1f}%" if len(df_filt['Nome_Estudante'].unique()) > 0 else "0%",
-                            f"{((len(estudantes_multiplas_escolas) + len(estudantes_multiplas_turmas)) / len(df_filt['Nome_Estudante'].unique())) * 100:.1f}%" if len(df_filt['Nome_Estudante'].unique()) > 0 else "0%"
-                        ]
-                    })
-                    resumo_geral.to_excel(writer, sheet_name='Resumo', index=False)
-                
-                st.download_button(
-                    label="📥 Baixar Relatório Completo (Excel com Abas)",
-                    data=output.getvalue(),
-                    file_name=f"duplicatas_censo_{pd.Timestamp.now().strftime('%Y%m%d_%H%M')}.xlsx",
-                    mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
-                )
+            st.download_button(
+                label="📥 Baixar Relatório Completo (Excel com Abas)",
+                data=relatorio_duplicatas_censo(df.attrs.get('chave_dataset'), estado_filtros, duplicatas),
+                file_name=f"duplicatas_censo_{pd.Timestamp.now().strftime('%Y%m%d_%H%M')}.xlsx",
+                mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+            )
         else:
             st.success("✅ Nenhuma duplicata encontrada nos dados filtrados!")
     
     
-    # Dados Brutos (Opcional)
-    with st.expander("📄 Ver todos os dados", expanded=False):
-        st.dataframe(df_filt, use_container_width=True)
+    # Dados Brutos (Opcional): só enviados ao navegador com o expander aberto
+    expander_dados = _expander_sob_demanda("📄 Ver todos os dados", "expander_dados_censo")
+    with expander_dados:
+        if _aberto(expander_dados):
+            st.dataframe(df_filt, use_container_width=True)
 
 def criar_interface_conteudo_aplicado(df):
     """Cria interface específica para análise de conteúdo aplicado"""
@@ -1931,8 +1748,9 @@ def criar_interface_conteudo_aplicado(df):
     else:
         bimestre_sel = []
     
-    # Aplicar filtros
-    df_filtrado = df.copy()
+    # Aplicar filtros (disciplina, status e bimestre pelos índices; data por intervalo)
+    motor = motor_filtros(df.attrs.get('chave_dataset'), ("Disciplina", "Status", "Bimestre"), df)
+    df_filtrado = motor.filtrar(df, {"Disciplina": disciplina_sel, "Status": status_sel, "Bimestre": bimestre_sel})
     
     # Filtro por data
     if "Data" in df.columns and 'data_inicio' in locals() and 'data_fim' in locals():
@@ -1941,18 +1759,6 @@ def criar_interface_conteudo_aplicado(df):
             (df_filtrado["Data"] <= data_fim)
         ]
     
-    # Filtro por disciplina
-    if disciplina_sel:
-        df_filtrado = df_filtrado[df_filtrado["Disciplina"].isin(disciplina_sel)]
-    
-    # Filtro por status
-    if status_sel:
-        df_filtrado = df_filtrado[df_filtrado["Status"].isin(status_sel)]
-    
-    # Filtro por bimestre
-    if bimestre_sel:
-        df_filtrado = df_filtrado[df_filtrado["Bimestre"].isin(bimestre_sel)]
-    
     # Verificar se há filtros aplicados (agora que as variáveis estão definidas)
     tem_filtros = (
         ('data_inicio' in locals() and 'data_fim' in locals() and 
@@ -2071,153 +1877,172 @@ def criar_interface_conteudo_aplicado(df):
         col_export1, col_export2 = st.columns([1, 4])
         with col_export1:
             if st.button("📊 Exportar Dados", key="export_conteudo", help="Baixar planilha com análise de conteúdo aplicado"):
-                excel_data = criar_excel_formatado(df_filtrado, "Conteudo_Aplicado")
-                st.download_button(
-                    label="Baixar Excel",
-                    data=excel_data,
-                    file_name="conteudo_aplicado.xlsx",
-                    mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
-                )
+                botoes_download(df_filtrado, "Conteudo_Aplicado", "conteudo_aplicado.xlsx")
     else:
         st.info("Nenhum registro encontrado com os filtros aplicados.")
 
-def mapear_bimestre(periodo: str) -> int | None:
-    """Mapeia 'Primeiro Bimestre' -> 1, 'Segundo Bimestre' -> 2, etc."""
-    if not isinstance(periodo, str):
-        return None
-    p = periodo.lower()
-    if "primeiro" in p or "1º" in p or "1o" in p:
-        return 1
-    if "segundo" in p or "2º" in p or "2o" in p:
-        return 2
-    if "terceiro" in p or "3º" in p or "3o" in p:
-        return 3
-    if "quarto" in p or "4º" in p or "4o" in p:
-        return 4
-    return None
+def criar_excel_formatado(df, nome_planilha="Dados"):
+    """
+    Excel de uma tabela com cabeçalho destacado e larguras ajustadas, gravado em fluxo
+    (escrever_excel: memória constante, dividido em abas acima do limite de linhas do Excel).
+    Classificacao e Classificacao_Freq saem com as cores da tela, por formatação condicional.
+    """
+    return escrever_excel({nome_planilha: df}, formatos=formatos_classificacao_excel())
 
-def classificar_status_b1_b2(n1, n2, media12):
+
+# Streamlit 1.52+ aceita data= chamável em st.download_button: o arquivo só é gerado no clique, fora da execução do script
+DOWNLOAD_SOB_DEMANDA = tuple(int(parte) for parte in re.findall(r"\d+", st.__version__)[:2]) >= (1, 52)
+MIME_XLSX = "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+
+
+def botoes_download(df, nome_planilha, file_name, key=None):
     """
-    Regras:
-      - 'Vermelho Duplo': n1<6 e n2<6
-      - 'Queda p/ Vermelho': n1>=6 e n2<6
-      - 'Recuperou': n1<6 e n2>=6
-      - 'Verde': n1>=6 e n2>=6
-      - Se faltar n1 ou n2, retorna 'Incompleto'
+    Botões de download de uma tabela: Excel (file_name) e, ao lado, CSV (UTF-8 com BOM), Parquet e Arrow
+    com o mesmo nome. Todos gravados em fluxo, sem pasta de trabalho intermediária; Parquet e Arrow só com pyarrow.
     """
-    if pd.isna(n1) or pd.isna(n2):
-        return "Incompleto"
-    if n1 < MEDIA_APROVACAO and n2 < MEDIA_APROVACAO:
-        return "Vermelho Duplo"
-    if n1 >= MEDIA_APROVACAO and n2 < MEDIA_APROVACAO:
-        return "Queda p/ Vermelho"
-    if n1 < MEDIA_APROVACAO and n2 >= MEDIA_APROVACAO:
-        return "Recuperou"
-    return "Verde"
+    base = os.path.splitext(file_name)[0]
+    arquivos = [("Excel", file_name, MIME_XLSX, lambda: criar_excel_formatado(df, nome_planilha))]
+    escritores = {"CSV": escrever_csv}
+    if PARQUET_AVAILABLE:
+        escritores.update(Parquet=escrever_parquet, Arrow=escrever_arrow)
+    for formato, escrever in escritores.items():
+        extensao, mime = FORMATOS_EXPORTACAO[formato]
+        arquivos.append((formato, base + extensao, mime, lambda escrever=escrever: escrever(df)))
+
+    for formato, nome_arquivo, mime, gerar in arquivos:
+        st.download_button(
+            label=f"Baixar {formato}",
+            data=gerar if DOWNLOAD_SOB_DEMANDA else gerar(),
+            file_name=nome_arquivo,
+            mime=mime,
+            key=key if key is None or formato == "Excel" else f"{key}_{formato.lower()}",
+        )
 
-def criar_excel_formatado(df, nome_planilha="Dados"):
+
+def montar_planilha_completa(df_filt, indic, tabela_alerta, cols_visiveis, tab_diag, notas_baixas_b1, notas_baixas_b2,
+                             freq_alunos_filt, coluna_aluno, alunos_duplicados, progresso=None):
     """
-    Cria um arquivo Excel formatado usando pandas (método mais simples e confiável)
+    Planilha do "Baixar Tudo", uma aba por análise. Não chama o Streamlit (roda na fila de exportações);
+    progresso(etapa, total, descricao) é chamado ao preparar as abas e antes de gravar cada uma.
     """
-    # Usar pandas para criar o Excel diretamente
-    output = BytesIO()
-    
-    # Criar o arquivo Excel usando pandas
-    with pd.ExcelWriter(output, engine='openpyxl') as writer:
-        df.to_excel(writer, sheet_name=nome_planilha, index=False)
-        
-        # Acessar a planilha para formatação
-        workbook = writer.book
-        worksheet = writer.sheets[nome_planilha]
-        
-        # Formatar cabeçalho
-        header_fill = PatternFill(start_color="366092", end_color="366092", fill_type="solid")
-        header_font = Font(color="FFFFFF", bold=True)
-        
-        for cell in worksheet[1]:
-            cell.fill = header_fill
-            cell.font = header_font
-            cell.alignment = Alignment(horizontal="center", vertical="center")
-        
-        # Ajustar largura das colunas
-        for column in worksheet.columns:
-            max_length = 0
-            column_letter = column[0].column_letter
-            for cell in column:
-                try:
-                    if cell.value and len(str(cell.value)) > max_length:
-                        max_length = len(str(cell.value))
-                except:
-                    pass
-            adjusted_width = min(max_length + 2, 50)
-            worksheet.column_dimensions[column_letter].width = adjusted_width
-    
-    output.seek(0)
-    return output.getvalue()
+    if progresso is not None:
+        progresso(0, 1, "Preparando as abas")
+    abas = {}
+
+    # Aba 1: Alunos em Alerta
+    if len(tabela_alerta) > 0:
+        abas["Alunos_em_Alerta"] = tabela_alerta[cols_visiveis]
+
+    # Aba 2: Panorama Geral de Notas
+    abas["Panorama_Geral_Notas"] = tab_diag[[coluna_aluno, "Turma", "Disciplina", "N1", "N2", "Media12", "Classificacao", "ReqMediaProx2"]]
+
+    # Aba 3: Análise de Frequência (se disponível)
+    if "Frequencia Anual" in df_filt.columns or "Frequencia" in df_filt.columns:
+        freq_detalhada = frequencia_alunos_turma(freq_alunos_filt, "anual")
+        freq_detalhada["Frequencia_Formatada"] = freq_detalhada["Frequencia"].apply(
+            lambda x: f"{x:.1f}%" if pd.notna(x) else "N/A"
+        )
+        cols_freq_xlsx = [coluna_aluno, "Turma", "Frequencia_Formatada", "Classificacao_Freq"]
+        cols_freq_xlsx.extend(
+            c for c in ("Faltas_1_Bimestre", "Faltas_2_Bimestre", "Faltas_Total_1e2_Bim")
+            if c in freq_detalhada.columns
+        )
+        abas["Analise_Frequencia"] = freq_detalhada[cols_freq_xlsx]
+
+    # Aba 4: Notas por Disciplina (se houver dados)
+    base_baixas = pd.concat([notas_baixas_b1, notas_baixas_b2], ignore_index=True)
+    if len(base_baixas) > 0:
+        contagem = base_baixas.groupby("Disciplina", observed=True)["Nota"].count().reset_index()
+        contagem = contagem.rename(columns={"Nota": "Quantidade_Notas_Abaixo_6"})
+        contagem = contagem.sort_values("Quantidade_Notas_Abaixo_6", ascending=False).reset_index(drop=True)
+        abas["Notas_Por_Disciplina"] = contagem
+
+    # Aba 5: Frequência por Faixas (se disponível)
+    if "Frequencia Anual" in df_filt.columns or "Frequencia" in df_filt.columns:
+        freq_geral = frequencia_alunos_turma(freq_alunos_filt, "anual")
+        contagem_freq_geral = freq_geral["Classificacao_Freq"].value_counts()
+
+        dados_grafico = []
+        for categoria, quantidade in contagem_freq_geral.items():
+            if categoria != FAIXAS_FREQUENCIA["sem_dados"] and quantidade > 0:
+                dados_grafico.append({
+                    "Categoria": categoria,
+                    "Numero_Alunos": quantidade
+                })
+
+        if dados_grafico:
+            abas["Frequencia_Por_Faixa"] = pd.DataFrame(dados_grafico)
+
+    # Aba 6: Cruzamento Notas x Frequência (se disponível)
+    if ("Frequencia Anual" in df_filt.columns or "Frequencia" in df_filt.columns) and len(indic) > 0:
+        freq_alunos = frequencia_alunos_turma(freq_alunos_filt, "anual")[[coluna_aluno, "Turma", "Frequencia", "Classificacao_Freq"]]
+        cruzada = indic.merge(freq_alunos, on=[coluna_aluno, "Turma"], how="left")
+        freq_baixa = cruzada[cruzada["Frequencia"] < FAIXAS_FREQUENCIA["limites"][-1]]
 
-def calcula_indicadores(df):
+        if len(freq_baixa) > 0:
+            freq_baixa_display = freq_baixa[[coluna_aluno, "Turma", "Disciplina", "Classificacao", "Classificacao_Freq", "Frequencia"]].copy()
+            freq_baixa_display["Frequencia"] = freq_baixa_display["Frequencia"].apply(
+                lambda x: f"{x:.1f}%" if pd.notna(x) else "N/A"
+            )
+            abas["Cruzamento_Notas_Freq"] = freq_baixa_display
+
+    # Aba 7: Alunos Duplicados (se houver), com uma coluna por turma
+    if len(alunos_duplicados) > 0:
+        abas["Alunos_Duplicados"] = alunos_duplicados
+
+    def _gravando(aba, total_abas, nome):
+        if progresso is not None:
+            progresso(1 + aba, 1 + total_abas, f"Gravando a aba {nome}")
+
+    return escrever_excel(abas, progresso=_gravando, formatos=formatos_classificacao_excel())
+
+
+class FilaExportacoes:
     """
-    Cria um dataframe por Aluno-Disciplina com:
-      N1, N2, N3, N4, Media12, Soma12, ReqMediaProx2 (quanto precisa em média nos próximos 2 bimestres para fechar 6 no ano), Classificacao
+    Planilhas do "Baixar Tudo" geradas em threads próprias e guardadas por (dataset, estado dos filtros):
+    o clique não bloqueia o painel e um novo download da mesma visão sai da planilha já pronta.
+    Guarda as `max_guardadas` mais recentes; as em preparo nunca são descartadas.
     """
-    # Criar coluna Bimestre
-    df = df.copy()
-    df["Bimestre"] = df["Periodo"].apply(mapear_bimestre)
-
-    # Pivot por (Aluno, Turma, Disciplina)
-    # Detectar coluna de aluno/estudante
-    coluna_aluno = None
-    for col in ["Aluno", "Nome_Estudante", "Estudante"]:
-        if col in df.columns:
-            coluna_aluno = col
-            break
-    
-    pivot = df.pivot_table(
-        index=["Escola", "Turma", coluna_aluno, "Disciplina"],
-        columns="Bimestre",
-        values="Nota",
-        aggfunc="mean"
-    ).reset_index()
-
-    # Renomear colunas 1..4 para N1..N4 (se existirem)
-    rename_cols = {}
-    for b in [1, 2, 3, 4]:
-        if b in pivot.columns:
-            rename_cols[b] = f"N{b}"
-    pivot = pivot.rename(columns=rename_cols)
-
-    # Calcular métricas dos 2 primeiros bimestres
-    n1 = pivot.get("N1", pd.Series([np.nan] * len(pivot)))
-    n2 = pivot.get("N2", pd.Series([np.nan] * len(pivot)))
-    
-    # Se não existir a coluna, criar uma série de NaN
-    if isinstance(n1, float):
-        n1 = pd.Series([np.nan] * len(pivot))
-    if isinstance(n2, float):
-        n2 = pd.Series([np.nan] * len(pivot))
-    
-    pivot["Soma12"] = n1.fillna(0) + n2.fillna(0)
-    # Se um dos dois for NaN, a média 12 fica NaN (melhor do que assumir 0)
-    pivot["Media12"] = (n1 + n2) / 2
-
-    # Quanto precisa nos próximos dois bimestres (N3+N4) para fechar soma >= 24
-    pivot["PrecisaSomarProx2"] = SOMA_FINAL_ALVO - pivot["Soma12"]
-    pivot["ReqMediaProx2"] = pivot["PrecisaSomarProx2"] / 2
-
-    # Classificação b1-b2
-    pivot["Classificacao"] = [
-        classificar_status_b1_b2(_n1, _n2, _m12)
-        for _n1, _n2, _m12 in zip(pivot.get("N1", np.nan), pivot.get("N2", np.nan), pivot["Media12"])
-    ]
 
-    # Flags de alerta
-    # "Corda Bamba": precisa de média >= 7 nos próximos dois bimestres
-    pivot["CordaBamba"] = pivot["ReqMediaProx2"] >= 7
+    def __init__(self, max_guardadas=8, max_threads=2):
+        self.max_guardadas = max_guardadas
+        self._executor = ThreadPoolExecutor(max_workers=max_threads, thread_name_prefix="painel-exportacao")
+        self._trabalhos = {}
+        self._trava = threading.Lock()
+
+    def trabalho(self, chave):
+        """Exportação pedida para a chave (dict com futuro, etapa, total e descricao) ou None."""
+        with self._trava:
+            return self._trabalhos.get(chave)
+
+    def iniciar(self, chave, funcao, *args, **kwargs):
+        """Enfileira funcao(*args, progresso=...) para a chave; se já houver uma, devolve a existente."""
+        with self._trava:
+            trabalho = self._trabalhos.get(chave)
+            if trabalho is not None:
+                return trabalho
+            trabalho = {"etapa": 0, "total": 1, "descricao": "Na fila..."}
+
+            def _progresso(etapa, total, descricao):
+                trabalho.update(etapa=etapa, total=total, descricao=descricao)
+
+            trabalho["futuro"] = self._executor.submit(funcao, *args, progresso=_progresso, **kwargs)
+            self._trabalhos[chave] = trabalho
+            prontos = [c for c, t in self._trabalhos.items() if t["futuro"].done()]
+            for antiga in prontos[:max(0, len(self._trabalhos) - self.max_guardadas)]:
+                del self._trabalhos[antiga]
+            return trabalho
+
+    def descartar(self, chave):
+        with self._trava:
+            self._trabalhos.pop(chave, None)
+
 
-    # "Alerta": qualquer Vermelho Duplo ou Queda p/ Vermelho ou Corda Bamba
-    pivot["Alerta"] = pivot["Classificacao"].isin(["Vermelho Duplo", "Queda p/ Vermelho"]) | pivot["CordaBamba"]
+@st.cache_resource(show_spinner=False)
+def fila_exportacoes():
+    """Fila de exportações compartilhada entre sessões (a mesma visão gera a planilha uma vez só)."""
+    return FilaExportacoes()
 
-    return pivot
 
 # -----------------------------
 # Controle de Acesso
@@ -2342,7 +2167,30 @@ st.markdown("---")
 col_upl, col_info = st.columns([1, 2])
 with col_upl:
     st.markdown("### Carregar Dados")
-    arquivo = st.file_uploader("Planilha (.xlsx) do SGE", type=["xlsx"], help="Faça upload da planilha ou salve como 'dados.xlsx' na pasta")
+    arquivos = st.file_uploader(
+        "Planilha (.xlsx) do SGE",
+        type=["xlsx"],
+        accept_multiple_files=True,
+        help="Faça upload de uma ou mais planilhas (ex.: todas as escolas da regional) ou salve como 'dados.xlsx' na pasta",
+    )
+    aba_sel = None
+    if arquivos and len(arquivos) == 1:
+        try:
+            abas_arquivo = listar_abas(arquivos[0])
+        except PlanilhaNaoReconhecida:
+            abas_arquivo = []  # o erro é exibido ao carregar os dados
+        if len(abas_arquivo) > 1:
+            aba_sel = st.selectbox(
+                "Aba da planilha",
+                abas_arquivo + [TODAS_AS_ABAS],
+                format_func=lambda a: "📑 Todas as abas (combinar)" if a == TODAS_AS_ABAS else a,
+                help="Pastas de trabalho com uma aba por turma ou escola podem ser lidas de uma vez",
+            )
+    modo_incremental = bool(arquivos) and len(arquivos) == 1 and st.checkbox(
+        "🔁 Atualizar minha base anterior (envio incremental)",
+        help="Para o reenvio da exportação do ano a cada bimestre: só as linhas novas ou alteradas "
+             "entram na base guardada, e só os alunos/disciplinas afetados são recalculados",
+    )
 with col_info:
     st.markdown("### Como usar")
     st.markdown("""
@@ -2353,8 +2201,37 @@ with col_info:
     """)
 
 # Carregar
+indic_base = None  # tabela de indicadores guardada com a base incremental
 try:
-    df = carregar_dados(arquivo)
+    if arquivos and len(arquivos) > 1:
+        df = carregar_varios_arquivos(arquivos)
+        _removidas = df.attrs.get('linhas_duplicadas_removidas', 0)
+        st.info(
+            f"📚 {df.attrs.get('arquivos_combinados', len(arquivos))} planilhas combinadas"
+            + (f" • {_removidas:,} linhas repetidas entre arquivos removidas".replace(",", ".") if _removidas else "")
+        )
+    else:
+        df = carregar_dados(arquivos[0] if arquivos else None, aba_sel)
+        if modo_incremental and df.attrs.get('tipo_planilha', 'notas_frequencia') == 'notas_frequencia':
+            _usuario = st.session_state.get("usuario") or {}
+            _nome_base = _usuario.get("email") or _usuario.get("cpf") or _usuario.get("inep") or _usuario.get("nome", "")
+            df, indic_base, _resumo = atualizar_base_do_usuario(_nome_base, df.attrs.get('chave_dataset'), df)
+            if _resumo["base_recriada"]:
+                st.success("🔁 Base incremental criada com esta exportação.")
+            else:
+                _fmt = lambda n: f"{n:,}".replace(",", ".")
+                st.success(
+                    f"🔁 Base atualizada: {_fmt(_resumo['linhas_novas'])} linhas novas, "
+                    f"{_fmt(_resumo['linhas_alteradas'])} alteradas, "
+                    f"{_fmt(_resumo['linhas_removidas'])} removidas, "
+                    f"{_fmt(_resumo['grupos_recalculados'])} aluno/disciplina recalculados."
+                )
+        if df.attrs.get('abas_combinadas'):
+            _ignoradas = df.attrs.get('abas_ignoradas') or []
+            st.info(
+                f"📑 {len(df.attrs['abas_combinadas'])} abas combinadas (coluna **Aba** indica a origem)"
+                + (f" • ignoradas: {', '.join(_ignoradas)}" if _ignoradas else "")
+            )
     
     # Verificar tipo de planilha e rotear para interface apropriada
     tipo_planilha = df.attrs.get('tipo_planilha', 'notas_frequencia')
@@ -2396,8 +2273,11 @@ try:
         st.stop()
     else:
         # Continuar com interface padrão de notas/frequência
-        pass
+        render_relatorio_qualidade(df.attrs.get('qualidade'))
         
+except PlanilhaNaoReconhecida as e:
+    st.error(f"❌ {e}")
+    st.stop()
 except FileNotFoundError:
     st.error("Não encontrei `dados.xlsx` na pasta e nenhum arquivo foi enviado no uploader.")
     
@@ -2423,36 +2303,46 @@ st.markdown("""
 </div>
 """, unsafe_allow_html=True)
 
+# Detectar coluna de aluno/estudante
+coluna_aluno = None
+for col in ["Aluno", "Nome_Estudante", "Estudante"]:
+    if col in df.columns:
+        coluna_aluno = col
+        break
+
+# Primeira pintura: contagens guardadas por dataset, sem esperar filtros, indicadores ou seções pesadas
+contagens = contagens_visao_geral(df.attrs.get('chave_dataset'), coluna_aluno, df)
+
 colA, colB, colC, colD, colE = st.columns(5)
 
 with colA:
     st.metric(
         label="Registros", 
-        value=f"{len(df):,}".replace(",", "."),
+        value=f"{contagens['Registros']:,}".replace(",", "."),
         help="Total de linhas de dados na planilha"
     )
 with colB:
     st.metric(
         label="Escolas", 
-        value=df["Escola"].nunique() if "Escola" in df.columns else 0,
+        value=contagens["Escolas"],
         help="Número de escolas diferentes"
     )
 with colC:
     st.metric(
         label="Turmas", 
-        value=df["Turma"].nunique() if "Turma" in df.columns else 0,
+        value=contagens["Turmas"],
         help="Número de turmas diferentes"
     )
 with colD:
     st.metric(
         label="Disciplinas", 
-        value=df["Disciplina"].nunique() if "Disciplina" in df.columns else 0,
+        value=contagens["Disciplinas"],
         help="Número de disciplinas diferentes"
     )
 with colE:
     st.metric(
         label="Status", 
-        value=df["Status"].nunique() if "Status" in df.columns else 0,
+        value=contagens["Status"],
         help="Número de status diferentes"
     )
 
@@ -2465,20 +2355,17 @@ st.markdown("""
 
 col_total = st.columns(1)[0]
 with col_total:
-    # Detectar coluna de aluno/estudante
-    coluna_aluno = None
-    for col in ["Aluno", "Nome_Estudante", "Estudante"]:
-        if col in df.columns:
-            coluna_aluno = col
-            break
-    
-    total_estudantes = df[coluna_aluno].nunique() if coluna_aluno else 0
+    total_estudantes = contagens["Estudantes"]
     st.metric(
         label="Estudantes Únicos", 
         value=f"{total_estudantes:,}".replace(",", "."),
         help="Total de estudantes únicos na escola (sem repetição por disciplina)"
     )
 
+# StudentID: o mesmo aluno com grafias diferentes do nome (acentos, espaços, digitação) tem um ID só
+if coluna_aluno and "StudentID" not in df.columns:
+    df["StudentID"] = identidade_alunos(df.attrs.get('chave_dataset'), coluna_aluno, df)
+
 
 # -----------------------------
 # Filtros laterais
@@ -2490,8 +2377,9 @@ st.sidebar.markdown("""
 </div>
 """, unsafe_allow_html=True)
 
-escolas = sorted(df["Escola"].dropna().unique().tolist()) if "Escola" in df.columns else []
-status_opcoes = sorted(df["Status"].dropna().unique().tolist()) if "Status" in df.columns else []
+hierarquia = hierarquia_opcoes(df.attrs.get('chave_dataset'), coluna_aluno, df)
+escolas = hierarquia.escolas
+status_opcoes = hierarquia.status
 
 st.sidebar.markdown("""
 <div style="background: linear-gradient(135deg, #d1fae5, #a7f3d0); border-radius: 6px; padding: 8px 12px; margin: 6px 0; box-shadow: 0 1px 4px rgba(5, 150, 105, 0.1); border-left: 3px solid #059669;">
@@ -2525,25 +2413,12 @@ status_sel = st.sidebar.multiselect(
     help="Use os botões acima para seleção rápida"
 )
 
-# Filtrar dados baseado na escola e status selecionados para mostrar opções relevantes
-df_temp = df.copy()
-if escola_sel != "Todas":
-    df_temp = df_temp[df_temp["Escola"] == escola_sel]
-if status_sel:  # Se algum status foi selecionado
-    df_temp = df_temp[df_temp["Status"].isin(status_sel)]
-else:  # Se nenhum status selecionado, mostra todos
-    pass  # Mantém todos os status
-
-turmas = sorted(df_temp["Turma"].dropna().unique().tolist()) if "Turma" in df_temp.columns else []
-disciplinas = sorted(df_temp["Disciplina"].dropna().unique().tolist()) if "Disciplina" in df_temp.columns else []
-# Detectar coluna de aluno/estudante
-coluna_aluno_temp = None
-for col in ["Aluno", "Nome_Estudante", "Estudante"]:
-    if col in df_temp.columns:
-        coluna_aluno_temp = col
-        break
-
-alunos = sorted(df_temp[coluna_aluno_temp].dropna().unique().tolist()) if coluna_aluno_temp else []
+# Opções relevantes para a escola e os status selecionados (consulta à hierarquia, sem varrer o df)
+# Se nenhum status selecionado, mostra todos
+opcoes = hierarquia.opcoes(escola_sel, status_sel)
+turmas = opcoes.get("Turma", [])
+disciplinas = opcoes.get("Disciplina", [])
+alunos = opcoes.get(coluna_aluno, [])
 
 # Filtros com interface melhorada
 st.sidebar.markdown("""
@@ -2603,24 +2478,19 @@ st.sidebar.markdown("""
 """, unsafe_allow_html=True)
 aluno_sel = st.sidebar.selectbox("Selecione o aluno:", ["Todos"] + alunos, help="Filtre por aluno específico")
 
-df_filt = df.copy()
-if escola_sel != "Todas":
-    df_filt = df_filt[df_filt["Escola"] == escola_sel]
-if status_sel:  # Se algum status foi selecionado
-    df_filt = df_filt[df_filt["Status"].isin(status_sel)]
-else:  # Se nenhum status selecionado, mostra todos
-    pass  # Mantém todos os status
-if turma_sel:  # Se alguma turma foi selecionada
-    df_filt = df_filt[df_filt["Turma"].isin(turma_sel)]
-else:  # Se nenhuma turma selecionada, mostra todas
-    pass  # Mantém todas as turmas
-
-if disc_sel:  # Se alguma disciplina foi selecionada
-    df_filt = df_filt[df_filt["Disciplina"].isin(disc_sel)]
-else:  # Se nenhuma disciplina selecionada, mostra todas
-    pass  # Mantém todas as disciplinas
-if aluno_sel != "Todos":
-    df_filt = df_filt[df_filt[coluna_aluno] == aluno_sel]
+# Índices invertidos montados uma vez por dataset; listas vazias = sem filtro
+motor = motor_filtros(df.attrs.get('chave_dataset'), ("Escola", "Status", "Turma", "Disciplina", coluna_aluno), df)
+df_filt = motor.filtrar(df, {
+    "Escola": [escola_sel] if escola_sel != "Todas" else None,
+    "Status": status_sel,
+    "Turma": turma_sel,
+    "Disciplina": disc_sel,
+    coluna_aluno: [aluno_sel] if aluno_sel != "Todos" else None,
+})
+
+# Frequência por aluno/turma do recorte atual: uma tabela compartilhada por todas as seções
+estado_filtros = (escola_sel, tuple(status_sel), tuple(turma_sel), tuple(disc_sel), aluno_sel)
+freq_alunos_filt = frequencia_dos_alunos(df.attrs.get('chave_dataset'), estado_filtros, coluna_aluno, df_filt)
 
 # Total de Estudantes Únicos (após filtros)
 st.markdown("""
@@ -2649,14 +2519,14 @@ if "Frequencia Anual" in df_filt.columns or "Frequencia" in df_filt.columns:
 
     tem_periodo = "Periodo" in df_filt.columns and "Frequencia" in df_filt.columns
 
-    contagem_anual = contagem_frequencia_por_faixa(df_filt, coluna_aluno, "anual")
+    contagem_anual = contagem_frequencia_por_faixa(freq_alunos_filt, "anual")
     if contagem_anual is not None:
         st.markdown("#### Frequência anual (consolidada)")
         st.caption("Coluna **Frequência Anual** da planilha — resultado acumulado do ano letivo.")
         render_cards_resumo_frequencia(contagem_anual)
 
     if tem_periodo:
-        contagem_b1 = contagem_frequencia_por_faixa(df_filt, coluna_aluno, "bim1")
+        contagem_b1 = contagem_frequencia_por_faixa(freq_alunos_filt, "bim1")
         if contagem_b1 is not None:
             st.markdown("#### 1º Bimestre")
             st.caption(
@@ -2666,7 +2536,7 @@ if "Frequencia Anual" in df_filt.columns or "Frequencia" in df_filt.columns:
         else:
             st.info("Sem dados de frequência no 1º bimestre para os filtros atuais.")
 
-        contagem_b2 = contagem_frequencia_por_faixa(df_filt, coluna_aluno, "bim2")
+        contagem_b2 = contagem_frequencia_por_faixa(freq_alunos_filt, "bim2")
         if contagem_b2 is not None:
             st.markdown("#### 2º Bimestre")
             st.caption(
@@ -2681,7 +2551,30 @@ if "Frequencia Anual" in df_filt.columns or "Frequencia" in df_filt.columns:
 # -----------------------------
 # Indicadores e tabelas de risco
 # -----------------------------
-indic = calcula_indicadores(df_filt)
+# Calculados uma vez por dataset (na base incremental, já vêm prontos); os filtros recortam o cubo
+cubo = cubo_indicadores(df.attrs.get('chave_dataset'), df, indic_base)
+indic = cubo.recortar(escola_sel, turma_sel, disc_sel, aluno_sel, status_sel)
+
+# Estado compartilhado pelas seções abaixo, calculado uma vez por execução completa do script.
+# Cada seção é um fragmento que só lê este estado: um clique dentro dela reroda apenas a seção.
+# As tabelas pesadas são calculadas em segundo plano enquanto os KPIs já aparecem na tela;
+# cada seção espera só pelo que usa, com um spinner no seu lugar.
+chave_dataset = df.attrs.get('chave_dataset')
+pool_secoes = executor_secoes()
+tabela_alerta_futura = pool_secoes.submit(tabela_alerta_formatada, chave_dataset, estado_filtros, coluna_aluno, indic)
+tab_diag_futura = pool_secoes.submit(panorama_formatado, chave_dataset, estado_filtros, indic)
+alunos_duplicados_futuros = pool_secoes.submit(alunos_duplicados_filtrados, chave_dataset, estado_filtros, coluna_aluno, df_filt)
+
+bimestre_filt = _serie_bimestre(df_filt)
+notas_baixas_b1 = df_filt[(bimestre_filt == 1) & (df_filt["Nota"] < MEDIA_APROVACAO)]
+notas_baixas_b2 = df_filt[(bimestre_filt == 2) & (df_filt["Nota"] < MEDIA_APROVACAO)]
+
+cols_visiveis = [coluna_aluno, "Turma", "Disciplina", "N1", "N2", "Media12", "Classificacao", "ReqMediaProx2", "CordaBamba"]
+
+# Incompletos, separados por bimestre (1º: falta N1; 2º: falta N2)
+incompletos = indic[indic["Classificacao"] == "Incompleto"].copy()
+incompletos_b1 = incompletos[pd.isna(incompletos["N1"])].copy()
+incompletos_b2 = incompletos[pd.isna(incompletos["N2"])].copy()
 
 # KPIs - Análise de Notas Baixas
 st.markdown("""
@@ -2692,9 +2585,6 @@ st.markdown("""
 
 col1, col2, col3, col4 = st.columns(4)
 
-notas_baixas_b1 = df_filt[df_filt["Periodo"].str.contains("Primeiro", case=False, na=False) & (df_filt["Nota"] < MEDIA_APROVACAO)]
-notas_baixas_b2 = df_filt[df_filt["Periodo"].str.contains("Segundo", case=False, na=False) & (df_filt["Nota"] < MEDIA_APROVACAO)]
-
 # Número de alunos únicos com notas baixas (não disciplinas)
 alunos_notas_baixas_b1 = notas_baixas_b1[coluna_aluno].nunique() if coluna_aluno in notas_baixas_b1.columns else 0
 alunos_notas_baixas_b2 = notas_baixas_b2[coluna_aluno].nunique() if coluna_aluno in notas_baixas_b2.columns else 0
@@ -2784,89 +2674,44 @@ st.markdown(f"""
 </div>
 """, unsafe_allow_html=True)
 
-col7, col8, col9, col10, col11 = st.columns(5)
-
-# Função para classificar frequência
-def classificar_frequencia(freq):
-    if pd.isna(freq):
-        return "Sem dados"
-    elif freq < 75:
-        return "Reprovado"
-    elif freq < 80:
-        return "Alto Risco"
-    elif freq < 90:
-        return "Risco Moderado"
-    elif freq < 95:
-        return "Ponto de Atenção"
-    else:
-        return "Meta Favorável"
+cols_faixas_freq = st.columns(len(FAIXAS_FREQUENCIA["rotulos"]))
 
 # Métricas da seção: anual quando existir; senão último registro de Frequencia
-_freq_metricas = None
-if "Frequencia Anual" in df_filt.columns:
-    _freq_metricas = df_filt.groupby(coluna_aluno)["Frequencia Anual"].last().reset_index()
-    _freq_metricas = _freq_metricas.rename(columns={"Frequencia Anual": "Frequencia"})
-elif "Frequencia" in df_filt.columns:
-    _freq_metricas = df_filt.groupby(coluna_aluno)["Frequencia"].last().reset_index()
+_freq_metricas = frequencia_por_aluno(freq_alunos_filt, "anual") if freq_alunos_filt is not None else None
 
-if _freq_metricas is not None:
-    _freq_metricas["Classificacao_Freq"] = _freq_metricas["Frequencia"].apply(classificar_frequencia)
-    contagem_freq = _freq_metricas["Classificacao_Freq"].value_counts()
-    with col7:
-        st.metric(
-            label="< 75% (Reprovado)",
-            value=contagem_freq.get("Reprovado", 0),
-            help="Alunos reprovados por frequência (abaixo de 75%)",
-        )
-    with col8:
+contagem_freq = classificar_frequencia_faixa(_freq_metricas).value_counts() if _freq_metricas is not None else None
+for col_faixa, (rotulo_faixa, intervalo_faixa) in zip(cols_faixas_freq, descrever_faixas_frequencia()):
+    with col_faixa:
         st.metric(
-            label="< 80% (Alto Risco)",
-            value=contagem_freq.get("Alto Risco", 0),
-            help="Alunos em alto risco de reprovação por frequência",
+            label=f"{intervalo_faixa} ({rotulo_faixa})",
+            value=int(contagem_freq.get(rotulo_faixa, 0)) if contagem_freq is not None else "N/A",
+            help=f"Alunos com frequência {intervalo_faixa} ({rotulo_faixa})" if contagem_freq is not None else None,
         )
-    with col9:
-        st.metric(
-            label="< 90% (Risco Moderado)",
-            value=contagem_freq.get("Risco Moderado", 0),
-            help="Alunos com risco moderado de reprovação",
-        )
-    with col10:
-        st.metric(
-            label="< 95% (Ponto Atenção)",
-            value=contagem_freq.get("Ponto de Atenção", 0),
-            help="Alunos que precisam de atenção na frequência",
-        )
-    with col11:
-        st.metric(
-            label="≥ 95% (Meta Favorável)",
-            value=contagem_freq.get("Meta Favorável", 0),
-            help="Alunos com frequência dentro da meta",
-        )
-else:
-    col7.metric("< 75% (Reprovado)", "N/A")
-    col8.metric("< 80% (Alto Risco)", "N/A")
-    col9.metric("< 90% (Risco Moderado)", "N/A")
-    col10.metric("< 95% (Ponto Atenção)", "N/A")
-    col11.metric("≥ 95% (Meta Favorável)", "N/A")
 
 # Análise detalhada: anual + listas nominais por bimestre
-_tem_freq_anual = "Frequencia Anual" in df_filt.columns or (
-    "Frequencia" in df_filt.columns and "Frequencia Anual" not in df_filt.columns
-)
-_tem_freq_bim = "Frequencia" in df_filt.columns and "Periodo" in df_filt.columns
+@fragmento
+def secao_analise_frequencia(df_filt, freq_alunos_filt, coluna_aluno, chave_dataset, estado_filtros):
+    """Expander com as abas anual / 1º / 2º bimestre; só o expander e a aba abertos montam tabelas."""
+    _tem_freq_anual = "Frequencia Anual" in df_filt.columns or (
+        "Frequencia" in df_filt.columns and "Frequencia Anual" not in df_filt.columns
+    )
+    _tem_freq_bim = "Frequencia" in df_filt.columns and "Periodo" in df_filt.columns
+
+    if not (_tem_freq_anual or _tem_freq_bim):
+        with st.expander("Análise Detalhada de Frequência"):
+            st.info("Dados de frequência não disponíveis na planilha.")
+        return
 
-if _tem_freq_anual or _tem_freq_bim:
-    with st.expander("Análise Detalhada de Frequência"):
-        faltas_bim = agregar_faltas_por_bimestre_aluno_turma(df_filt, coluna_aluno)
+    expander_freq = _expander_sob_demanda("Análise Detalhada de Frequência", "expander_analise_frequencia")
+    with expander_freq:
+        if not _aberto(expander_freq):
+            return
 
-        def _anexar_faltas(freq_df, cols_faltas):
-            if faltas_bim is None or freq_df is None:
+        def _colunas_faltas(freq_df, cols_faltas):
+            # As faltas do 1º/2º bimestre já vêm na tabela de frequência (quando há Falta e Periodo)
+            if freq_df is None:
                 return freq_df, None
-            out = freq_df.merge(faltas_bim, on=[coluna_aluno, "Turma"], how="left")
-            for _c in ("Faltas_1_Bimestre", "Faltas_2_Bimestre", "Faltas_Total_1e2_Bim"):
-                if _c in out.columns:
-                    out[_c] = out[_c].fillna(0).astype(int)
-            return out, [c for c in cols_faltas if c in out.columns]
+            return freq_df, [c for c in cols_faltas if c in freq_df.columns] or None
 
         abas = []
         if _tem_freq_anual:
@@ -2874,374 +2719,302 @@ if _tem_freq_anual or _tem_freq_bim:
         if _tem_freq_bim:
             abas.extend(["1º Bimestre", "2º Bimestre"])
 
-        tab_conteudo = st.tabs(abas)
+        tab_conteudo = _abas_sob_demanda(abas, "abas_analise_frequencia")
         idx_aba = 0
 
         if _tem_freq_anual:
             with tab_conteudo[idx_aba]:
-                freq_anual = montar_freq_detalhada_aluno_turma(df_filt, coluna_aluno, "anual")
-                cols_f = ["Faltas_1_Bimestre", "Faltas_2_Bimestre", "Faltas_Total_1e2_Bim"]
-                freq_anual, cols_f_out = _anexar_faltas(freq_anual, cols_f)
-                if freq_anual is not None and len(freq_anual) > 0:
-                    titulo = (
-                        "Frequência anual (consolidada)"
-                        if "Frequencia Anual" in df_filt.columns
-                        else "Frequência (último registro por aluno)"
-                    )
-                    cap = (
-                        "Coluna **Frequência Anual** da planilha. Ordenado da menor para a maior %."
-                        if "Frequencia Anual" in df_filt.columns
-                        else "Ordenado da menor para a maior %."
-                    )
-                    render_tabela_frequencia_detalhada(
-                        freq_anual,
-                        coluna_aluno,
-                        titulo,
-                        cap,
-                        "export_frequencia_anual",
-                        "analise_frequencia_anual.xlsx",
-                        cols_f_out,
-                    )
-                    if cols_f_out:
-                        st.caption(
-                            "Faltas: soma da coluna **Falta** no **1º** e **2º bimestre**. "
-                            "**Faltas_Total_1e2_Bim** = soma dos dois."
+                if _aberto(tab_conteudo[idx_aba]):
+                    freq_anual = frequencia_detalhada(chave_dataset, estado_filtros, coluna_aluno, "anual", freq_alunos_filt)
+                    cols_f = ["Faltas_1_Bimestre", "Faltas_2_Bimestre", "Faltas_Total_1e2_Bim"]
+                    freq_anual, cols_f_out = _colunas_faltas(freq_anual, cols_f)
+                    if freq_anual is not None and len(freq_anual) > 0:
+                        titulo = (
+                            "Frequência anual (consolidada)"
+                            if "Frequencia Anual" in df_filt.columns
+                            else "Frequência (último registro por aluno)"
+                        )
+                        cap = (
+                            "Coluna **Frequência Anual** da planilha. Ordenado da menor para a maior %."
+                            if "Frequencia Anual" in df_filt.columns
+                            else "Ordenado da menor para a maior %."
                         )
-                else:
-                    st.info("Sem dados de frequência anual para os filtros atuais.")
-            idx_aba += 1
-
-        if _tem_freq_bim:
-            for tipo_bim, rotulo, arquivo, col_falta in (
-                ("bim1", "1º Bimestre", "analise_frequencia_1_bimestre.xlsx", "Faltas_1_Bimestre"),
-                ("bim2", "2º Bimestre", "analise_frequencia_2_bimestre.xlsx", "Faltas_2_Bimestre"),
-            ):
-                with tab_conteudo[idx_aba]:
-                    freq_bim = montar_freq_detalhada_aluno_turma(df_filt, coluna_aluno, tipo_bim)
-                    freq_bim, cols_f_out = _anexar_faltas(freq_bim, [col_falta])
-                    if freq_bim is not None and len(freq_bim) > 0:
                         render_tabela_frequencia_detalhada(
-                            freq_bim,
+                            freq_anual,
                             coluna_aluno,
-                            f"Frequência — {rotulo}",
-                            f"Média da coluna **Frequência** por aluno em todas as disciplinas do **{rotulo}**. "
-                            "Ordenado da menor para a maior %.",
-                            f"export_frequencia_{tipo_bim}",
-                            arquivo,
+                            titulo,
+                            cap,
+                            "export_frequencia_anual",
+                            "analise_frequencia_anual.xlsx",
                             cols_f_out,
                         )
                         if cols_f_out:
                             st.caption(
-                                f"**{col_falta}**: soma de faltas em todas as disciplinas apenas no **{rotulo}**."
+                                "Faltas: soma da coluna **Falta** no **1º** e **2º bimestre**. "
+                                "**Faltas_Total_1e2_Bim** = soma dos dois."
                             )
                     else:
-                        st.info(f"Sem dados de frequência no {rotulo} para os filtros atuais.")
+                        st.info("Sem dados de frequência anual para os filtros atuais.")
+            idx_aba += 1
+
+        if _tem_freq_bim:
+            for tipo_bim, rotulo, arquivo, col_falta in (
+                ("bim1", "1º Bimestre", "analise_frequencia_1_bimestre.xlsx", "Faltas_1_Bimestre"),
+                ("bim2", "2º Bimestre", "analise_frequencia_2_bimestre.xlsx", "Faltas_2_Bimestre"),
+            ):
+                with tab_conteudo[idx_aba]:
+                    if _aberto(tab_conteudo[idx_aba]):
+                        freq_bim = frequencia_detalhada(chave_dataset, estado_filtros, coluna_aluno, tipo_bim, freq_alunos_filt)
+                        freq_bim, cols_f_out = _colunas_faltas(freq_bim, [col_falta])
+                        if freq_bim is not None and len(freq_bim) > 0:
+                            render_tabela_frequencia_detalhada(
+                                freq_bim,
+                                coluna_aluno,
+                                f"Frequência — {rotulo}",
+                                f"Média da coluna **Frequência** por aluno em todas as disciplinas do **{rotulo}**. "
+                                "Ordenado da menor para a maior %.",
+                                f"export_frequencia_{tipo_bim}",
+                                arquivo,
+                                cols_f_out,
+                            )
+                            if cols_f_out:
+                                st.caption(
+                                    f"**{col_falta}**: soma de faltas em todas as disciplinas apenas no **{rotulo}**."
+                                )
+                        else:
+                            st.info(f"Sem dados de frequência no {rotulo} para os filtros atuais.")
                 idx_aba += 1
 
         st.markdown("### Legenda de Frequência")
-        col_leg1, col_leg2, col_leg3 = st.columns(3)
-        with col_leg1:
-            st.markdown(
-                "**< 75%**: Reprovado por frequência  \n**< 80%**: Alto risco de reprovação"
-            )
-        with col_leg2:
-            st.markdown("**< 90%**: Risco moderado  \n**< 95%**: Ponto de atenção")
-        with col_leg3:
-            st.markdown("**≥ 95%**: Meta favorável  \n**Sem dados**: Frequência não informada")
-else:
-    with st.expander("Análise Detalhada de Frequência"):
-        st.info("Dados de frequência não disponíveis na planilha.")
+        itens_legenda = [f"**{intervalo}**: {rotulo}" for rotulo, intervalo in descrever_faixas_frequencia()]
+        itens_legenda.append(f"**{FAIXAS_FREQUENCIA['sem_dados']}**: Frequência não informada")
+        por_coluna = -(-len(itens_legenda) // 3)
+        for k, col_leg in enumerate(st.columns(3)):
+            with col_leg:
+                st.markdown("  \n".join(itens_legenda[por_coluna * k:por_coluna * (k + 1)]))
 
+secao_analise_frequencia(df_filt, freq_alunos_filt, coluna_aluno, df.attrs.get('chave_dataset'), estado_filtros)
 
 st.markdown("---")
 
 # Tabela: Alunos-Disciplinas em ALERTA (com cálculo de necessidade para 3º e 4º)
-st.markdown("""
-<div style="background: linear-gradient(135deg, #1e40af, #3b82f6); border-radius: 12px; padding: 25px; margin: 20px 0; box-shadow: 0 4px 15px rgba(30, 64, 175, 0.2);">
-    <h2 style="color: white; text-align: center; margin: 0; font-size: 1.7em; font-weight: 700; text-shadow: 0 1px 3px rgba(0,0,0,0.3);">Alunos/Disciplinas em ALERTA</h2>
-    <p style="color: rgba(255,255,255,0.9); text-align: center; margin: 8px 0 0 0; font-size: 1.1em; font-weight: 500;">Situações que precisam de atenção imediata</p>
-</div>
-""", unsafe_allow_html=True)
-cols_visiveis = [coluna_aluno, "Turma", "Disciplina", "N1", "N2", "Media12", "Classificacao", "ReqMediaProx2", "CordaBamba"]
-# Filtrar alertas excluindo os "Incompleto" (que agora têm seção própria)
-tabela_alerta = (indic[indic["Alerta"] & (indic["Classificacao"] != "Incompleto")]
-                 .copy()
-                 .sort_values(["Turma", coluna_aluno, "Disciplina"]))
-for c in ["N1", "N2", "Media12", "ReqMediaProx2"]:
-    if c in tabela_alerta.columns:
-        # Formatar para 1 casa decimal, removendo .0 desnecessário
-        tabela_alerta[c] = tabela_alerta[c].round(1)
-        tabela_alerta[c] = tabela_alerta[c].apply(lambda x: f"{x:.1f}".rstrip('0').rstrip('.') if pd.notna(x) else x)
-
-# Função para aplicar cores na classificação (definida antes de usar)
-def color_classification(val):
-    if val == "Verde":
-        return "background-color: #10b981; color: white; font-weight: bold;"  # Verde forte
-    elif val == "Vermelho Duplo":
-        return "background-color: #dc2626; color: white; font-weight: bold;"  # Vermelho forte
-    elif val == "Queda p/ Vermelho":
-        return "background-color: #f59e0b; color: white; font-weight: bold;"  # Laranja forte
-    elif val == "Recuperou":
-        return "background-color: #3b82f6; color: white; font-weight: bold;"  # Azul forte
-    elif val == "Incompleto":
-        return "background-color: #6b7280; color: white; font-weight: bold;"  # Cinza forte
+@fragmento
+def secao_alertas(tabela_alerta_futura, cols_visiveis):
+    """Tabela de alunos/disciplinas em alerta e sua exportação."""
+    st.markdown("""
+    <div style="background: linear-gradient(135deg, #1e40af, #3b82f6); border-radius: 12px; padding: 25px; margin: 20px 0; box-shadow: 0 4px 15px rgba(30, 64, 175, 0.2);">
+        <h2 style="color: white; text-align: center; margin: 0; font-size: 1.7em; font-weight: 700; text-shadow: 0 1px 3px rgba(0,0,0,0.3);">Alunos/Disciplinas em ALERTA</h2>
+        <p style="color: rgba(255,255,255,0.9); text-align: center; margin: 8px 0 0 0; font-size: 1.1em; font-weight: 500;">Situações que precisam de atenção imediata</p>
+    </div>
+    """, unsafe_allow_html=True)
+    tabela_alerta = _aguardar(tabela_alerta_futura, "Montando a tabela de alertas...")
+    # Aplicar cores na tabela de alertas também
+    if len(tabela_alerta) > 0:
+        styled_alerta = _style_apply_cells(tabela_alerta[cols_visiveis], color_classification, ["Classificacao"])
+        st.dataframe(styled_alerta, use_container_width=True)
+        
+        # Botão de exportação para alertas
+        col_export1, col_export2 = st.columns([1, 4])
+        with col_export1:
+            if st.button("📊 Exportar Alertas", key="export_alertas", help="Baixar planilha com alunos em alerta"):
+                botoes_download(tabela_alerta[cols_visiveis], "Alunos_em_Alerta", "alunos_em_alerta.xlsx")
     else:
-        return ""
+        st.dataframe(pd.DataFrame(columns=cols_visiveis), use_container_width=True)
 
-# Aplicar cores na tabela de alertas também
-if len(tabela_alerta) > 0:
-    styled_alerta = _style_apply_cells(tabela_alerta[cols_visiveis], color_classification, ["Classificacao"])
-    st.dataframe(styled_alerta, use_container_width=True)
-    
-    # Botão de exportação para alertas
-    col_export1, col_export2 = st.columns([1, 4])
-    with col_export1:
-        if st.button("📊 Exportar Alertas", key="export_alertas", help="Baixar planilha com alunos em alerta"):
-            excel_data = criar_excel_formatado(tabela_alerta[cols_visiveis], "Alunos_em_Alerta")
-            st.download_button(
-                label="Baixar Excel",
-                data=excel_data,
-                file_name="alunos_em_alerta.xlsx",
-                mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
-            )
-else:
-    st.dataframe(pd.DataFrame(columns=cols_visiveis), use_container_width=True)
+secao_alertas(tabela_alerta_futura, cols_visiveis)
 
 # Seção separada para alunos com status "Incompleto" - Separada por Bimestres
-st.markdown("""
-<div style="background: linear-gradient(135deg, #6b7280, #9ca3af); border-radius: 12px; padding: 25px; margin: 20px 0; box-shadow: 0 4px 15px rgba(107, 114, 128, 0.2);">
-    <h2 style="color: white; text-align: center; margin: 0; font-size: 1.7em; font-weight: 700; text-shadow: 0 1px 3px rgba(0,0,0,0.3);">Alunos/Disciplinas INCOMPLETAS</h2>
-    <p style="color: rgba(255,255,255,0.9); text-align: center; margin: 8px 0 0 0; font-size: 1.1em; font-weight: 500;">Faltam notas para completar a avaliação - Separado por Bimestres</p>
-</div>
-""", unsafe_allow_html=True)
-
-# Filtrar apenas os incompletos
-incompletos = indic[indic["Classificacao"] == "Incompleto"].copy()
+@fragmento
+def secao_incompletos(incompletos, incompletos_b1, incompletos_b2, coluna_aluno, chave_dataset, estado_filtros):
+    """Abas de alunos com notas incompletas (geral, 1º e 2º bimestre) e suas exportações."""
+    st.markdown("""
+    <div style="background: linear-gradient(135deg, #6b7280, #9ca3af); border-radius: 12px; padding: 25px; margin: 20px 0; box-shadow: 0 4px 15px rgba(107, 114, 128, 0.2);">
+        <h2 style="color: white; text-align: center; margin: 0; font-size: 1.7em; font-weight: 700; text-shadow: 0 1px 3px rgba(0,0,0,0.3);">Alunos/Disciplinas INCOMPLETAS</h2>
+        <p style="color: rgba(255,255,255,0.9); text-align: center; margin: 8px 0 0 0; font-size: 1.1em; font-weight: 500;">Faltam notas para completar a avaliação - Separado por Bimestres</p>
+    </div>
+    """, unsafe_allow_html=True)
 
-if len(incompletos) > 0:
-    # Separar incompletos por bimestres
-    # Incompletos do 1º bimestre: falta N1
-    incompletos_b1 = incompletos[pd.isna(incompletos["N1"])].copy()
-    
-    # Incompletos do 2º bimestre: falta N2
-    incompletos_b2 = incompletos[pd.isna(incompletos["N2"])].copy()
-    
-    # Criar abas para cada bimestre
-    tab1, tab2, tab3 = st.tabs(["📊 Resumo Geral", "1️⃣ 1º Bimestre", "2️⃣ 2º Bimestre"])
-    
-    with tab1:
-        # Estatísticas gerais dos incompletos
+    if len(incompletos) > 0:
+        # Estatísticas gerais dos incompletos (usadas em todas as abas)
         total_incompletos = len(incompletos)
         alunos_unicos_incompletos = incompletos[coluna_aluno].nunique()
         total_b1 = len(incompletos_b1)
         total_b2 = len(incompletos_b2)
         alunos_b1 = incompletos_b1[coluna_aluno].nunique()
         alunos_b2 = incompletos_b2[coluna_aluno].nunique()
+
+        # Criar abas para cada bimestre; só a aba aberta monta a tabela
+        tab1, tab2, tab3 = _abas_sob_demanda(["📊 Resumo Geral", "1️⃣ 1º Bimestre", "2️⃣ 2º Bimestre"], "abas_incompletos")
         
-        # Criar colunas para mostrar as estatísticas gerais
-        col_gen1, col_gen2, col_gen3, col_gen4 = st.columns(4)
-        
-        with col_gen1:
-            st.markdown(f"""
-            <div style="background: linear-gradient(135deg, #f3f4f6, #e5e7eb); border-radius: 10px; padding: 18px; margin: 5px 0; box-shadow: 0 2px 8px rgba(107, 114, 128, 0.15); border-left: 4px solid #6b7280;">
-                <h3 style="color: #374151; margin: 0 0 15px 0; font-size: 1.1em; font-weight: 600;">Total Incompletas</h3>
-                <div style="display: flex; justify-content: space-between; align-items: center;">
-                    <div style="font-size: 2.2em; font-weight: 700; color: #374151;">{total_incompletos}</div>
-                    <div style="font-size: 1.8em; font-weight: 700; color: #6b7280;">disciplinas</div>
-                </div>
-            </div>
-            """, unsafe_allow_html=True)
-        
-        with col_gen2:
-            st.markdown(f"""
-            <div style="background: linear-gradient(135deg, #f3f4f6, #e5e7eb); border-radius: 10px; padding: 18px; margin: 5px 0; box-shadow: 0 2px 8px rgba(107, 114, 128, 0.15); border-left: 4px solid #6b7280;">
-                <h3 style="color: #374151; margin: 0 0 15px 0; font-size: 1.1em; font-weight: 600;">Alunos Afetados</h3>
-                <div style="display: flex; justify-content: space-between; align-items: center;">
-                    <div style="font-size: 2.2em; font-weight: 700; color: #374151;">{alunos_unicos_incompletos}</div>
-                    <div style="font-size: 1.8em; font-weight: 700; color: #6b7280;">alunos</div>
-                </div>
-            </div>
-            """, unsafe_allow_html=True)
-        
-        with col_gen3:
-            st.markdown(f"""
-            <div style="background: linear-gradient(135deg, #f3f4f6, #e5e7eb); border-radius: 10px; padding: 18px; margin: 5px 0; box-shadow: 0 2px 8px rgba(107, 114, 128, 0.15); border-left: 4px solid #6b7280;">
-                <h3 style="color: #374151; margin: 0 0 15px 0; font-size: 1.1em; font-weight: 600;">Falta 1º Bimestre</h3>
-                <div style="display: flex; justify-content: space-between; align-items: center;">
-                    <div style="font-size: 2.2em; font-weight: 700; color: #374151;">{total_b1}</div>
-                    <div style="font-size: 1.8em; font-weight: 700; color: #6b7280;">disciplinas</div>
-                </div>
-                <div style="font-size: 0.9em; color: #374151; margin-top: 5px;">({alunos_b1} alunos)</div>
-            </div>
-            """, unsafe_allow_html=True)
-        
-        with col_gen4:
-            st.markdown(f"""
-            <div style="background: linear-gradient(135deg, #f3f4f6, #e5e7eb); border-radius: 10px; padding: 18px; margin: 5px 0; box-shadow: 0 2px 8px rgba(107, 114, 128, 0.15); border-left: 4px solid #6b7280;">
-                <h3 style="color: #374151; margin: 0 0 15px 0; font-size: 1.1em; font-weight: 600;">Falta 2º Bimestre</h3>
-                <div style="display: flex; justify-content: space-between; align-items: center;">
-                    <div style="font-size: 2.2em; font-weight: 700; color: #374151;">{total_b2}</div>
-                    <div style="font-size: 1.8em; font-weight: 700; color: #6b7280;">disciplinas</div>
-                </div>
-                <div style="font-size: 0.9em; color: #374151; margin-top: 5px;">({alunos_b2} alunos)</div>
-            </div>
-            """, unsafe_allow_html=True)
-        
-        # Tabela geral de incompletos
-        st.markdown("### 📋 Todos os Incompletos")
-        incompletos_ordenados = incompletos.sort_values(["Turma", coluna_aluno, "Disciplina"])
-        
-        # Formatar colunas numéricas
-        for c in ["N1", "N2", "Media12", "ReqMediaProx2"]:
-            if c in incompletos_ordenados.columns:
-                incompletos_ordenados[c] = incompletos_ordenados[c].round(1)
-                incompletos_ordenados[c] = incompletos_ordenados[c].apply(lambda x: f"{x:.1f}".rstrip('0').rstrip('.') if pd.notna(x) else x)
-        
-        # Adicionar coluna indicando qual bimestre falta
-        incompletos_ordenados["Falta"] = incompletos_ordenados.apply(
-            lambda row: "1º Bimestre" if pd.isna(row["N1"]) else "2º Bimestre", axis=1
-        )
-        
-        cols_incompletos_geral = [coluna_aluno, "Turma", "Disciplina", "N1", "N2", "Falta", "Classificacao"]
-        styled_incompletos_geral = _style_apply_cells(
-            incompletos_ordenados[cols_incompletos_geral], color_classification, ["Classificacao"]
-        )
-        st.dataframe(styled_incompletos_geral, use_container_width=True)
-        
-        # Botão de exportação geral
-        col_export_gen1, col_export_gen2 = st.columns([1, 4])
-        with col_export_gen1:
-            if st.button("📋 Exportar Todos", key="export_incompletos_geral", help="Baixar planilha com todos os incompletos"):
-                excel_data = criar_excel_formatado(incompletos_ordenados[cols_incompletos_geral], "Todos_Incompletos")
-                st.download_button(
-                    label="Baixar Excel",
-                    data=excel_data,
-                    file_name="todos_incompletos.xlsx",
-                    mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
-                )
-    
-    with tab2:
-        # Aba do 1º Bimestre
-        st.markdown("### 1️⃣ Incompletos do 1º Bimestre (Falta N1)")
-        
-        if len(incompletos_b1) > 0:
-            # Estatísticas específicas do 1º bimestre
-            col_b1_1, col_b1_2 = st.columns(2)
+        with tab1:
+            if _aberto(tab1):
+                # Criar colunas para mostrar as estatísticas gerais
+                col_gen1, col_gen2, col_gen3, col_gen4 = st.columns(4)
             
-            with col_b1_1:
-                st.markdown(f"""
-                <div style="background: linear-gradient(135deg, #f3f4f6, #e5e7eb); border-radius: 10px; padding: 18px; margin: 5px 0; box-shadow: 0 2px 8px rgba(107, 114, 128, 0.15); border-left: 4px solid #6b7280;">
-                    <h3 style="color: #374151; margin: 0 0 15px 0; font-size: 1.1em; font-weight: 600;">Disciplinas Incompletas</h3>
-                    <div style="display: flex; justify-content: space-between; align-items: center;">
-                        <div style="font-size: 2.5em; font-weight: 700; color: #374151;">{total_b1}</div>
-                        <div style="font-size: 2.5em; font-weight: 700; color: #6b7280;">disciplinas</div>
+                with col_gen1:
+                    st.markdown(f"""
+                    <div style="background: linear-gradient(135deg, #f3f4f6, #e5e7eb); border-radius: 10px; padding: 18px; margin: 5px 0; box-shadow: 0 2px 8px rgba(107, 114, 128, 0.15); border-left: 4px solid #6b7280;">
+                        <h3 style="color: #374151; margin: 0 0 15px 0; font-size: 1.1em; font-weight: 600;">Total Incompletas</h3>
+                        <div style="display: flex; justify-content: space-between; align-items: center;">
+                            <div style="font-size: 2.2em; font-weight: 700; color: #374151;">{total_incompletos}</div>
+                            <div style="font-size: 1.8em; font-weight: 700; color: #6b7280;">disciplinas</div>
+                        </div>
                     </div>
-                </div>
-                """, unsafe_allow_html=True)
+                    """, unsafe_allow_html=True)
             
-            with col_b1_2:
-                st.markdown(f"""
-                <div style="background: linear-gradient(135deg, #f3f4f6, #e5e7eb); border-radius: 10px; padding: 18px; margin: 5px 0; box-shadow: 0 2px 8px rgba(107, 114, 128, 0.15); border-left: 4px solid #6b7280;">
-                    <h3 style="color: #374151; margin: 0 0 15px 0; font-size: 1.1em; font-weight: 600;">Alunos Afetados</h3>
-                    <div style="display: flex; justify-content: space-between; align-items: center;">
-                        <div style="font-size: 2.5em; font-weight: 700; color: #374151;">{alunos_b1}</div>
-                        <div style="font-size: 2.5em; font-weight: 700; color: #6b7280;">alunos</div>
+                with col_gen2:
+                    st.markdown(f"""
+                    <div style="background: linear-gradient(135deg, #f3f4f6, #e5e7eb); border-radius: 10px; padding: 18px; margin: 5px 0; box-shadow: 0 2px 8px rgba(107, 114, 128, 0.15); border-left: 4px solid #6b7280;">
+                        <h3 style="color: #374151; margin: 0 0 15px 0; font-size: 1.1em; font-weight: 600;">Alunos Afetados</h3>
+                        <div style="display: flex; justify-content: space-between; align-items: center;">
+                            <div style="font-size: 2.2em; font-weight: 700; color: #374151;">{alunos_unicos_incompletos}</div>
+                            <div style="font-size: 1.8em; font-weight: 700; color: #6b7280;">alunos</div>
+                        </div>
                     </div>
-                </div>
-                """, unsafe_allow_html=True)
-            
-            # Ordenar e formatar dados do 1º bimestre
-            incompletos_b1_ordenados = incompletos_b1.sort_values(["Turma", coluna_aluno, "Disciplina"])
-            
-            # Formatar colunas numéricas
-            for c in ["N1", "N2", "Media12", "ReqMediaProx2"]:
-                if c in incompletos_b1_ordenados.columns:
-                    incompletos_b1_ordenados[c] = incompletos_b1_ordenados[c].round(1)
-                    incompletos_b1_ordenados[c] = incompletos_b1_ordenados[c].apply(lambda x: f"{x:.1f}".rstrip('0').rstrip('.') if pd.notna(x) else x)
-            
-            # Mostrar tabela do 1º bimestre
-            cols_incompletos_b1 = [coluna_aluno, "Turma", "Disciplina", "N1", "N2", "Media12", "Classificacao"]
-            styled_incompletos_b1 = _style_apply_cells(
-                incompletos_b1_ordenados[cols_incompletos_b1], color_classification, ["Classificacao"]
-            )
-            st.dataframe(styled_incompletos_b1, use_container_width=True)
-            
-            # Botão de exportação do 1º bimestre
-            col_export_b1_1, col_export_b1_2 = st.columns([1, 4])
-            with col_export_b1_1:
-                if st.button("📋 Exportar 1º Bimestre", key="export_incompletos_b1", help="Baixar planilha com incompletos do 1º bimestre"):
-                    excel_data = criar_excel_formatado(incompletos_b1_ordenados[cols_incompletos_b1], "Incompletos_1_Bimestre")
-                    st.download_button(
-                        label="Baixar Excel",
-                        data=excel_data,
-                        file_name="incompletos_1_bimestre.xlsx",
-                        mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
-                    )
-        else:
-            st.success("✅ Nenhum aluno com notas incompletas do 1º bimestre.")
-    
-    with tab3:
-        # Aba do 2º Bimestre
-        st.markdown("### 2️⃣ Incompletos do 2º Bimestre (Falta N2)")
-        
-        if len(incompletos_b2) > 0:
-            # Estatísticas específicas do 2º bimestre
-            col_b2_1, col_b2_2 = st.columns(2)
+                    """, unsafe_allow_html=True)
             
-            with col_b2_1:
-                st.markdown(f"""
-                <div style="background: linear-gradient(135deg, #f3f4f6, #e5e7eb); border-radius: 10px; padding: 18px; margin: 5px 0; box-shadow: 0 2px 8px rgba(107, 114, 128, 0.15); border-left: 4px solid #6b7280;">
-                    <h3 style="color: #374151; margin: 0 0 15px 0; font-size: 1.1em; font-weight: 600;">Disciplinas Incompletas</h3>
-                    <div style="display: flex; justify-content: space-between; align-items: center;">
-                        <div style="font-size: 2.5em; font-weight: 700; color: #374151;">{total_b2}</div>
-                        <div style="font-size: 2.5em; font-weight: 700; color: #6b7280;">disciplinas</div>
+                with col_gen3:
+                    st.markdown(f"""
+                    <div style="background: linear-gradient(135deg, #f3f4f6, #e5e7eb); border-radius: 10px; padding: 18px; margin: 5px 0; box-shadow: 0 2px 8px rgba(107, 114, 128, 0.15); border-left: 4px solid #6b7280;">
+                        <h3 style="color: #374151; margin: 0 0 15px 0; font-size: 1.1em; font-weight: 600;">Falta 1º Bimestre</h3>
+                        <div style="display: flex; justify-content: space-between; align-items: center;">
+                            <div style="font-size: 2.2em; font-weight: 700; color: #374151;">{total_b1}</div>
+                            <div style="font-size: 1.8em; font-weight: 700; color: #6b7280;">disciplinas</div>
+                        </div>
+                        <div style="font-size: 0.9em; color: #374151; margin-top: 5px;">({alunos_b1} alunos)</div>
                     </div>
-                </div>
-                """, unsafe_allow_html=True)
+                    """, unsafe_allow_html=True)
             
-            with col_b2_2:
-                st.markdown(f"""
-                <div style="background: linear-gradient(135deg, #f3f4f6, #e5e7eb); border-radius: 10px; padding: 18px; margin: 5px 0; box-shadow: 0 2px 8px rgba(107, 114, 128, 0.15); border-left: 4px solid #6b7280;">
-                    <h3 style="color: #374151; margin: 0 0 15px 0; font-size: 1.1em; font-weight: 600;">Alunos Afetados</h3>
-                    <div style="display: flex; justify-content: space-between; align-items: center;">
-                        <div style="font-size: 2.5em; font-weight: 700; color: #374151;">{alunos_b2}</div>
-                        <div style="font-size: 2.5em; font-weight: 700; color: #6b7280;">alunos</div>
+                with col_gen4:
+                    st.markdown(f"""
+                    <div style="background: linear-gradient(135deg, #f3f4f6, #e5e7eb); border-radius: 10px; padding: 18px; margin: 5px 0; box-shadow: 0 2px 8px rgba(107, 114, 128, 0.15); border-left: 4px solid #6b7280;">
+                        <h3 style="color: #374151; margin: 0 0 15px 0; font-size: 1.1em; font-weight: 600;">Falta 2º Bimestre</h3>
+                        <div style="display: flex; justify-content: space-between; align-items: center;">
+                            <div style="font-size: 2.2em; font-weight: 700; color: #374151;">{total_b2}</div>
+                            <div style="font-size: 1.8em; font-weight: 700; color: #6b7280;">disciplinas</div>
+                        </div>
+                        <div style="font-size: 0.9em; color: #374151; margin-top: 5px;">({alunos_b2} alunos)</div>
                     </div>
-                </div>
-                """, unsafe_allow_html=True)
+                    """, unsafe_allow_html=True)
             
-            # Ordenar e formatar dados do 2º bimestre
-            incompletos_b2_ordenados = incompletos_b2.sort_values(["Turma", coluna_aluno, "Disciplina"])
+                # Tabela geral de incompletos
+                st.markdown("### 📋 Todos os Incompletos")
+                incompletos_ordenados = tabela_incompletos(chave_dataset, estado_filtros, coluna_aluno, "geral", incompletos)
             
-            # Formatar colunas numéricas
-            for c in ["N1", "N2", "Media12", "ReqMediaProx2"]:
-                if c in incompletos_b2_ordenados.columns:
-                    incompletos_b2_ordenados[c] = incompletos_b2_ordenados[c].round(1)
-                    incompletos_b2_ordenados[c] = incompletos_b2_ordenados[c].apply(lambda x: f"{x:.1f}".rstrip('0').rstrip('.') if pd.notna(x) else x)
+                cols_incompletos_geral = [coluna_aluno, "Turma", "Disciplina", "N1", "N2", "Falta", "Classificacao"]
+                styled_incompletos_geral = _style_apply_cells(
+                    incompletos_ordenados[cols_incompletos_geral], color_classification, ["Classificacao"]
+                )
+                st.dataframe(styled_incompletos_geral, use_container_width=True)
             
-            # Mostrar tabela do 2º bimestre
-            cols_incompletos_b2 = [coluna_aluno, "Turma", "Disciplina", "N1", "N2", "Media12", "Classificacao"]
-            styled_incompletos_b2 = _style_apply_cells(
-                incompletos_b2_ordenados[cols_incompletos_b2], color_classification, ["Classificacao"]
-            )
-            st.dataframe(styled_incompletos_b2, use_container_width=True)
+                # Botão de exportação geral
+                col_export_gen1, col_export_gen2 = st.columns([1, 4])
+                with col_export_gen1:
+                    if st.button("📋 Exportar Todos", key="export_incompletos_geral", help="Baixar planilha com todos os incompletos"):
+                        botoes_download(incompletos_ordenados[cols_incompletos_geral], "Todos_Incompletos", "todos_incompletos.xlsx")
+        
+        with tab2:
+            if _aberto(tab2):
+                # Aba do 1º Bimestre
+                st.markdown("### 1️⃣ Incompletos do 1º Bimestre (Falta N1)")
+            
+                if len(incompletos_b1) > 0:
+                    # Estatísticas específicas do 1º bimestre
+                    col_b1_1, col_b1_2 = st.columns(2)
+                
+                    with col_b1_1:
+                        st.markdown(f"""
+                        <div style="background: linear-gradient(135deg, #f3f4f6, #e5e7eb); border-radius: 10px; padding: 18px; margin: 5px 0; box-shadow: 0 2px 8px rgba(107, 114, 128, 0.15); border-left: 4px solid #6b7280;">
+                            <h3 style="color: #374151; margin: 0 0 15px 0; font-size: 1.1em; font-weight: 600;">Disciplinas Incompletas</h3>
+                            <div style="display: flex; justify-content: space-between; align-items: center;">
+                                <div style="font-size: 2.5em; font-weight: 700; color: #374151;">{total_b1}</div>
+                                <div style="font-size: 2.5em; font-weight: 700; color: #6b7280;">disciplinas</div>
+                            </div>
+                        </div>
+                        """, unsafe_allow_html=True)
+                
+                    with col_b1_2:
+                        st.markdown(f"""
+                        <div style="background: linear-gradient(135deg, #f3f4f6, #e5e7eb); border-radius: 10px; padding: 18px; margin: 5px 0; box-shadow: 0 2px 8px rgba(107, 114, 128, 0.15); border-left: 4px solid #6b7280;">
+                            <h3 style="color: #374151; margin: 0 0 15px 0; font-size: 1.1em; font-weight: 600;">Alunos Afetados</h3>
+                            <div style="display: flex; justify-content: space-between; align-items: center;">
+                                <div style="font-size: 2.5em; font-weight: 700; color: #374151;">{alunos_b1}</div>
+                                <div style="font-size: 2.5em; font-weight: 700; color: #6b7280;">alunos</div>
+                            </div>
+                        </div>
+                        """, unsafe_allow_html=True)
+                
+                    # Ordenar e formatar dados do 1º bimestre
+                    incompletos_b1_ordenados = tabela_incompletos(chave_dataset, estado_filtros, coluna_aluno, "bim1", incompletos_b1)
+                
+                    # Mostrar tabela do 1º bimestre
+                    cols_incompletos_b1 = [coluna_aluno, "Turma", "Disciplina", "N1", "N2", "Media12", "Classificacao"]
+                    styled_incompletos_b1 = _style_apply_cells(
+                        incompletos_b1_ordenados[cols_incompletos_b1], color_classification, ["Classificacao"]
+                    )
+                    st.dataframe(styled_incompletos_b1, use_container_width=True)
+                
+                    # Botão de exportação do 1º bimestre
+                    col_export_b1_1, col_export_b1_2 = st.columns([1, 4])
+                    with col_export_b1_1:
+                        if st.button("📋 Exportar 1º Bimestre", key="export_incompletos_b1", help="Baixar planilha com incompletos do 1º bimestre"):
+                            botoes_download(incompletos_b1_ordenados[cols_incompletos_b1], "Incompletos_1_Bimestre", "incompletos_1_bimestre.xlsx")
+                else:
+                    st.success("✅ Nenhum aluno com notas incompletas do 1º bimestre.")
+        
+        with tab3:
+            if _aberto(tab3):
+                # Aba do 2º Bimestre
+                st.markdown("### 2️⃣ Incompletos do 2º Bimestre (Falta N2)")
             
-            # Botão de exportação do 2º bimestre
-            col_export_b2_1, col_export_b2_2 = st.columns([1, 4])
-            with col_export_b2_1:
-                if st.button("📋 Exportar 2º Bimestre", key="export_incompletos_b2", help="Baixar planilha com incompletos do 2º bimestre"):
-                    excel_data = criar_excel_formatado(incompletos_b2_ordenados[cols_incompletos_b2], "Incompletos_2_Bimestre")
-                    st.download_button(
-                        label="Baixar Excel",
-                        data=excel_data,
-                        file_name="incompletos_2_bimestre.xlsx",
-                        mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+                if len(incompletos_b2) > 0:
+                    # Estatísticas específicas do 2º bimestre
+                    col_b2_1, col_b2_2 = st.columns(2)
+                
+                    with col_b2_1:
+                        st.markdown(f"""
+                        <div style="background: linear-gradient(135deg, #f3f4f6, #e5e7eb); border-radius: 10px; padding: 18px; margin: 5px 0; box-shadow: 0 2px 8px rgba(107, 114, 128, 0.15); border-left: 4px solid #6b7280;">
+                            <h3 style="color: #374151; margin: 0 0 15px 0; font-size: 1.1em; font-weight: 600;">Disciplinas Incompletas</h3>
+                            <div style="display: flex; justify-content: space-between; align-items: center;">
+                                <div style="font-size: 2.5em; font-weight: 700; color: #374151;">{total_b2}</div>
+                                <div style="font-size: 2.5em; font-weight: 700; color: #6b7280;">disciplinas</div>
+                            </div>
+                        </div>
+                        """, unsafe_allow_html=True)
+                
+                    with col_b2_2:
+                        st.markdown(f"""
+                        <div style="background: linear-gradient(135deg, #f3f4f6, #e5e7eb); border-radius: 10px; padding: 18px; margin: 5px 0; box-shadow: 0 2px 8px rgba(107, 114, 128, 0.15); border-left: 4px solid #6b7280;">
+                            <h3 style="color: #374151; margin: 0 0 15px 0; font-size: 1.1em; font-weight: 600;">Alunos Afetados</h3>
+                            <div style="display: flex; justify-content: space-between; align-items: center;">
+                                <div style="font-size: 2.5em; font-weight: 700; color: #374151;">{alunos_b2}</div>
+                                <div style="font-size: 2.5em; font-weight: 700; color: #6b7280;">alunos</div>
+                            </div>
+                        </div>
+                        """, unsafe_allow_html=True)
+                
+                    # Ordenar e formatar dados do 2º bimestre
+                    incompletos_b2_ordenados = tabela_incompletos(chave_dataset, estado_filtros, coluna_aluno, "bim2", incompletos_b2)
+                
+                    # Mostrar tabela do 2º bimestre
+                    cols_incompletos_b2 = [coluna_aluno, "Turma", "Disciplina", "N1", "N2", "Media12", "Classificacao"]
+                    styled_incompletos_b2 = _style_apply_cells(
+                        incompletos_b2_ordenados[cols_incompletos_b2], color_classification, ["Classificacao"]
                     )
-        else:
-            st.success("✅ Nenhum aluno com notas incompletas do 2º bimestre.")
+                    st.dataframe(styled_incompletos_b2, use_container_width=True)
+                
+                    # Botão de exportação do 2º bimestre
+                    col_export_b2_1, col_export_b2_2 = st.columns([1, 4])
+                    with col_export_b2_1:
+                        if st.button("📋 Exportar 2º Bimestre", key="export_incompletos_b2", help="Baixar planilha com incompletos do 2º bimestre"):
+                            botoes_download(incompletos_b2_ordenados[cols_incompletos_b2], "Incompletos_2_Bimestre", "incompletos_2_bimestre.xlsx")
+                else:
+                    st.success("✅ Nenhum aluno com notas incompletas do 2º bimestre.")
 
-else:
-    st.info("✅ Nenhum aluno com disciplinas incompletas encontrado.")
+    else:
+        st.info("✅ Nenhum aluno com disciplinas incompletas encontrado.")
+
+secao_incompletos(incompletos, incompletos_b1, incompletos_b2, coluna_aluno, df.attrs.get('chave_dataset'), estado_filtros)
 
 # Seção Consolidada: Resumo por Bimestres
 st.markdown("""
@@ -3328,292 +3101,269 @@ with col_bim2:
 
 
 # Destaque: 10 melhores alunos (média geral entre disciplinas)
-st.markdown("""
-<div style="background: linear-gradient(135deg, #047857, #10b981); border-radius: 12px; padding: 22px; margin: 24px 0 16px 0; box-shadow: 0 4px 15px rgba(4, 120, 87, 0.25);">
-    <h2 style="color: white; text-align: center; margin: 0; font-size: 1.65em; font-weight: 700; text-shadow: 0 1px 3px rgba(0,0,0,0.25);">🏆 Destaque: 10 melhores alunos</h2>
-    <p style="color: rgba(255,255,255,0.95); text-align: center; margin: 10px 0 0 0; font-size: 1.05em; font-weight: 500;">Maior média geral entre as disciplinas (1º e 2º bimestres)</p>
-</div>
-""", unsafe_allow_html=True)
+@fragmento
+def secao_melhores_alunos(indic, coluna_aluno):
+    """Ranking dos 10 melhores alunos e sua exportação."""
+    st.markdown("""
+    <div style="background: linear-gradient(135deg, #047857, #10b981); border-radius: 12px; padding: 22px; margin: 24px 0 16px 0; box-shadow: 0 4px 15px rgba(4, 120, 87, 0.25);">
+        <h2 style="color: white; text-align: center; margin: 0; font-size: 1.65em; font-weight: 700; text-shadow: 0 1px 3px rgba(0,0,0,0.25);">🏆 Destaque: 10 melhores alunos</h2>
+        <p style="color: rgba(255,255,255,0.95); text-align: center; margin: 10px 0 0 0; font-size: 1.05em; font-weight: 500;">Maior média geral entre as disciplinas (1º e 2º bimestres)</p>
+    </div>
+    """, unsafe_allow_html=True)
 
-if len(indic) > 0 and "Media12" in indic.columns:
-    medias_aluno = indic.groupby([coluna_aluno, "Turma"], as_index=False).agg(
-        Media_Geral=("Media12", "mean"),
-        Media_N1=("N1", "mean"),
-        Media_N2=("N2", "mean"),
-        Qtd_Disciplinas=("Disciplina", "count"),
-    )
-    medias_aluno = medias_aluno.dropna(subset=["Media_Geral"])
-    if len(medias_aluno) == 0:
-        st.info("Não há médias válidas para montar o ranking de alunos.")
-    else:
-        top10 = (
-            medias_aluno.sort_values("Media_Geral", ascending=False)
-            .head(10)
-            .reset_index(drop=True)
-        )
-        top10.insert(0, "Posição", range(1, len(top10) + 1))
-        for c in ("Media_Geral", "Media_N1", "Media_N2"):
-            top10[c] = top10[c].round(2)
-        top10_exibir = top10.rename(
-            columns={
-                "Media_Geral": "Média geral (disciplinas)",
-                "Media_N1": "Média N1",
-                "Media_N2": "Média N2",
-                "Qtd_Disciplinas": "Qtd. disciplinas",
-            }
+    if len(indic) > 0 and "Media12" in indic.columns:
+        medias_aluno = indic.groupby([coluna_aluno, "Turma"], as_index=False, observed=True).agg(
+            Media_Geral=("Media12", "mean"),
+            Media_N1=("N1", "mean"),
+            Media_N2=("N2", "mean"),
+            Qtd_Disciplinas=("Disciplina", "count"),
         )
-        st.dataframe(top10_exibir, use_container_width=True, hide_index=True)
-        st.caption(
-            "A **média geral** é a média aritmética da coluna **Média 1º+2º bim.** (Média12) entre todas as disciplinas do aluno na turma. "
-            "Em empate na última posição, a ordem segue a da planilha."
-        )
-        col_top1, col_top2 = st.columns([1, 4])
-        with col_top1:
-            if st.button("📊 Exportar ranking", key="export_top10_alunos", help="Baixar os 10 melhores alunos em Excel"):
-                excel_data = criar_excel_formatado(top10_exibir, "Top10_Melhores_Alunos")
-                st.download_button(
-                    label="Baixar Excel",
-                    data=excel_data,
-                    file_name="top10_melhores_alunos.xlsx",
-                    mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-                )
-else:
-    st.info("Indicadores de notas indisponíveis para exibir o ranking.")
-
-# Tabela: Panorama Geral de Notas (todos para diagnóstico rápido)
-st.markdown("""
-<div style="background: linear-gradient(135deg, #1e40af, #3b82f6); border-radius: 12px; padding: 25px; margin: 20px 0; box-shadow: 0 4px 15px rgba(30, 64, 175, 0.2);">
-    <h2 style="color: white; text-align: center; margin: 0; font-size: 1.7em; font-weight: 700; text-shadow: 0 1px 3px rgba(0,0,0,0.3);">Panorama Geral de Notas (B1→B2)</h2>
-    <p style="color: rgba(255,255,255,0.9); text-align: center; margin: 8px 0 0 0; font-size: 1.1em; font-weight: 500;">Visão completa de todos os alunos e disciplinas</p>
-</div>
-""", unsafe_allow_html=True)
-tab_diag = indic.copy()
-for c in ["N1", "N2", "Media12", "ReqMediaProx2"]:
-    if c in tab_diag.columns:
-        # Formatar para 1 casa decimal, removendo .0 desnecessário
-        tab_diag[c] = tab_diag[c].round(1)
-        tab_diag[c] = tab_diag[c].apply(lambda x: f"{x:.1f}".rstrip('0').rstrip('.') if pd.notna(x) else x)
-
-
-
-# Aplicar estilização
-styled_table = _style_apply_cells(
-    tab_diag[[coluna_aluno, "Turma", "Disciplina", "N1", "N2", "Media12", "Classificacao", "ReqMediaProx2"]].sort_values(
-        ["Turma", coluna_aluno, "Disciplina"]
-    ),
-    color_classification,
-    ["Classificacao"],
-)
-
-st.dataframe(styled_table, use_container_width=True)
-
-# Botão de exportação para panorama de notas
-col_export3, col_export4 = st.columns([1, 4])
-with col_export3:
-        if st.button("📊 Exportar Panorama", key="export_panorama", help="Baixar planilha com panorama geral de notas"):
-            excel_data = criar_excel_formatado(tab_diag[[coluna_aluno, "Turma", "Disciplina", "N1", "N2", "Media12", "Classificacao", "ReqMediaProx2"]], "Panorama_Geral_Notas")
-            st.download_button(
-                label="Baixar Excel",
-                data=excel_data,
-                file_name="panorama_notas.xlsx",
-                mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+        medias_aluno = medias_aluno.dropna(subset=["Media_Geral"])
+        if len(medias_aluno) == 0:
+            st.info("Não há médias válidas para montar o ranking de alunos.")
+        else:
+            top10 = (
+                medias_aluno.sort_values("Media_Geral", ascending=False)
+                .head(10)
+                .reset_index(drop=True)
+            )
+            top10.insert(0, "Posição", range(1, len(top10) + 1))
+            for c in ("Media_Geral", "Media_N1", "Media_N2"):
+                top10[c] = top10[c].round(2)
+            top10_exibir = top10.rename(
+                columns={
+                    "Media_Geral": "Média geral (disciplinas)",
+                    "Media_N1": "Média N1",
+                    "Media_N2": "Média N2",
+                    "Qtd_Disciplinas": "Qtd. disciplinas",
+                }
+            )
+            st.dataframe(top10_exibir, use_container_width=True, hide_index=True)
+            st.caption(
+                "A **média geral** é a média aritmética da coluna **Média 1º+2º bim.** (Média12) entre todas as disciplinas do aluno na turma. "
+                "Em empate na última posição, a ordem segue a da planilha."
             )
+            col_top1, col_top2 = st.columns([1, 4])
+            with col_top1:
+                if st.button("📊 Exportar ranking", key="export_top10_alunos", help="Baixar os 10 melhores alunos em Excel"):
+                    botoes_download(top10_exibir, "Top10_Melhores_Alunos", "top10_melhores_alunos.xlsx")
+    else:
+        st.info("Indicadores de notas indisponíveis para exibir o ranking.")
 
-# Legenda de cores
-st.markdown("### 🎨 Legenda de Cores")
-col1, col2, col3 = st.columns(3)
-with col1:
-    st.markdown("""
-    <div style="background-color: #10b981; color: white; padding: 8px; border-radius: 5px; margin: 5px 0; font-weight: bold; text-align: center;">
-        🟢 Verde: Aluno está bem (N1≥6 e N2≥6)
-    </div>
-    <div style="background-color: #dc2626; color: white; padding: 8px; border-radius: 5px; margin: 5px 0; font-weight: bold; text-align: center;">
-        🔴 Vermelho Duplo: Risco alto (N1<6 e N2<6)
-    </div>
-    """, unsafe_allow_html=True)
-with col2:
-    st.markdown("""
-    <div style="background-color: #f59e0b; color: white; padding: 8px; border-radius: 5px; margin: 5px 0; font-weight: bold; text-align: center;">
-        🟠 Queda p/ Vermelho: Piorou (N1≥6 e N2<6)
-    </div>
-    <div style="background-color: #3b82f6; color: white; padding: 8px; border-radius: 5px; margin: 5px 0; font-weight: bold; text-align: center;">
-        🔵 Recuperou: Melhorou (N1<6 e N2≥6)
-    </div>
-    """, unsafe_allow_html=True)
-with col3:
+secao_melhores_alunos(indic, coluna_aluno)
+
+# Tabela: Panorama Geral de Notas (todos para diagnóstico rápido)
+@fragmento
+def secao_panorama(tab_diag_futura, coluna_aluno):
+    """Panorama geral de notas (B1→B2) e sua exportação."""
     st.markdown("""
-    <div style="background-color: #6b7280; color: white; padding: 8px; border-radius: 5px; margin: 5px 0; font-weight: bold; text-align: center;">
-        ⚪ Incompleto: Falta nota
-    </div>
-    <div style="background-color: #8b5cf6; color: white; padding: 8px; border-radius: 5px; margin: 5px 0; font-weight: bold; text-align: center;">
-        🟣 Corda Bamba: Precisa ≥7 nos próximos 2
+    <div style="background: linear-gradient(135deg, #1e40af, #3b82f6); border-radius: 12px; padding: 25px; margin: 20px 0; box-shadow: 0 4px 15px rgba(30, 64, 175, 0.2);">
+        <h2 style="color: white; text-align: center; margin: 0; font-size: 1.7em; font-weight: 700; text-shadow: 0 1px 3px rgba(0,0,0,0.3);">Panorama Geral de Notas (B1→B2)</h2>
+        <p style="color: rgba(255,255,255,0.9); text-align: center; margin: 8px 0 0 0; font-size: 1.1em; font-weight: 500;">Visão completa de todos os alunos e disciplinas</p>
     </div>
     """, unsafe_allow_html=True)
+    tab_diag = _aguardar(tab_diag_futura, "Montando o panorama geral...")
+    # Aplicar estilização
+    styled_table = _style_apply_cells(
+        tab_diag[[coluna_aluno, "Turma", "Disciplina", "N1", "N2", "Media12", "Classificacao", "ReqMediaProx2"]].sort_values(
+            ["Turma", coluna_aluno, "Disciplina"]
+        ),
+        color_classification,
+        ["Classificacao"],
+    )
 
-st.markdown(
-    """
-    **Interpretação rápida**  
-    - *Vermelho Duplo*: segue risco alto (dois bimestres < 6).  
-    - *Queda p/ Vermelho*: atenção no 3º bimestre (piora do 1º para o 2º).  
-    - *Recuperou*: saiu do vermelho no 2º.  
-    - *Corda Bamba*: para fechar média 6 no ano, precisa tirar **≥ 7,0** em média no 3º e 4º.
-    """
-)
+    st.dataframe(styled_table, use_container_width=True)
+
+    # Botão de exportação para panorama de notas
+    col_export3, col_export4 = st.columns([1, 4])
+    with col_export3:
+            if st.button("📊 Exportar Panorama", key="export_panorama", help="Baixar planilha com panorama geral de notas"):
+                botoes_download(tab_diag[[coluna_aluno, "Turma", "Disciplina", "N1", "N2", "Media12", "Classificacao", "ReqMediaProx2"]], "Panorama_Geral_Notas", "panorama_notas.xlsx")
+
+    # Legenda de cores
+    st.markdown("### 🎨 Legenda de Cores")
+    col1, col2, col3 = st.columns(3)
+    with col1:
+        st.markdown("""
+        <div style="background-color: #10b981; color: white; padding: 8px; border-radius: 5px; margin: 5px 0; font-weight: bold; text-align: center;">
+            🟢 Verde: Aluno está bem (N1≥6 e N2≥6)
+        </div>
+        <div style="background-color: #dc2626; color: white; padding: 8px; border-radius: 5px; margin: 5px 0; font-weight: bold; text-align: center;">
+            🔴 Vermelho Duplo: Risco alto (N1<6 e N2<6)
+        </div>
+        """, unsafe_allow_html=True)
+    with col2:
+        st.markdown("""
+        <div style="background-color: #f59e0b; color: white; padding: 8px; border-radius: 5px; margin: 5px 0; font-weight: bold; text-align: center;">
+            🟠 Queda p/ Vermelho: Piorou (N1≥6 e N2<6)
+        </div>
+        <div style="background-color: #3b82f6; color: white; padding: 8px; border-radius: 5px; margin: 5px 0; font-weight: bold; text-align: center;">
+            🔵 Recuperou: Melhorou (N1<6 e N2≥6)
+        </div>
+        """, unsafe_allow_html=True)
+    with col3:
+        st.markdown("""
+        <div style="background-color: #6b7280; color: white; padding: 8px; border-radius: 5px; margin: 5px 0; font-weight: bold; text-align: center;">
+            ⚪ Incompleto: Falta nota
+        </div>
+        <div style="background-color: #8b5cf6; color: white; padding: 8px; border-radius: 5px; margin: 5px 0; font-weight: bold; text-align: center;">
+            🟣 Corda Bamba: Precisa ≥7 nos próximos 2
+        </div>
+        """, unsafe_allow_html=True)
+
+    st.markdown(
+        """
+        **Interpretação rápida**  
+        - *Vermelho Duplo*: segue risco alto (dois bimestres < 6).  
+        - *Queda p/ Vermelho*: atenção no 3º bimestre (piora do 1º para o 2º).  
+        - *Recuperou*: saiu do vermelho no 2º.  
+        - *Corda Bamba*: para fechar média 6 no ano, precisa tirar **≥ 7,0** em média no 3º e 4º.
+        """
+    )
+
+secao_panorama(tab_diag_futura, coluna_aluno)
 
 # Gráficos: Notas e Frequência por Disciplina (movidos para o final)
-st.markdown("---")
-st.markdown("""
-<div style="background: linear-gradient(135deg, #1e40af, #3b82f6); border-radius: 12px; padding: 25px; margin: 20px 0; box-shadow: 0 4px 15px rgba(30, 64, 175, 0.2);">
-    <h2 style="color: white; text-align: center; margin: 0; font-size: 1.7em; font-weight: 700; text-shadow: 0 1px 3px rgba(0,0,0,0.3);">Análises Gráficas</h2>
-    <p style="color: rgba(255,255,255,0.9); text-align: center; margin: 8px 0 0 0; font-size: 1.1em; font-weight: 500;">Visualizações complementares dos dados</p>
-</div>
-""", unsafe_allow_html=True)
+@fragmento
+def secao_graficos_notas(notas_baixas_b1, notas_baixas_b2):
+    """Gráficos de notas abaixo da média por disciplina e suas exportações."""
+    st.markdown("---")
+    st.markdown("""
+    <div style="background: linear-gradient(135deg, #1e40af, #3b82f6); border-radius: 12px; padding: 25px; margin: 20px 0; box-shadow: 0 4px 15px rgba(30, 64, 175, 0.2);">
+        <h2 style="color: white; text-align: center; margin: 0; font-size: 1.7em; font-weight: 700; text-shadow: 0 1px 3px rgba(0,0,0,0.3);">Análises Gráficas</h2>
+        <p style="color: rgba(255,255,255,0.9); text-align: center; margin: 8px 0 0 0; font-size: 1.1em; font-weight: 500;">Visualizações complementares dos dados</p>
+    </div>
+    """, unsafe_allow_html=True)
 
-# Seção de Gráficos de Notas por Disciplina
-st.markdown("### 📊 Gráficos de Notas Abaixo da Média por Disciplina")
+    # Seção de Gráficos de Notas por Disciplina
+    st.markdown("### 📊 Gráficos de Notas Abaixo da Média por Disciplina")
 
-# Gráfico Geral (1º + 2º Bimestre)
-with st.expander("📈 Geral - Notas Abaixo da Média por Disciplina (1º + 2º Bimestre)"):
-    base_baixas = pd.concat([notas_baixas_b1, notas_baixas_b2], ignore_index=True)
-    if len(base_baixas) > 0:
-        # Contar notas por disciplina
-        contagem = base_baixas.groupby("Disciplina")["Nota"].count().reset_index()
-        contagem = contagem.rename(columns={"Nota": "Qtd Notas < 6"})
-        
-        # Ordenar em ordem decrescente (maior para menor)
-        contagem = contagem.sort_values("Qtd Notas < 6", ascending=False).reset_index(drop=True)
-        
-        # Adicionar coluna de cores intercaladas baseada na posição após ordenação
-        contagem['Cor'] = ['#1e40af' if i % 2 == 0 else '#059669' for i in range(len(contagem))]
-        
-        fig = px.bar(contagem, x="Disciplina", y="Qtd Notas < 6", 
-                    title="Notas abaixo da média (1º + 2º Bimestre)",
-                    color="Cor",
-                    color_discrete_map={'#1e40af': '#1e40af', '#059669': '#059669'})
-        
-        # Forçar a ordem das disciplinas no eixo X
-        fig.update_layout(
-            xaxis_title=None, 
-            yaxis_title="Quantidade", 
-            bargap=0.25, 
-            showlegend=False, 
-            xaxis_tickangle=45,
-            xaxis={'categoryorder': 'array', 'categoryarray': contagem['Disciplina'].tolist()}
-        )
-        st.plotly_chart(fig, use_container_width=True)
-        
-        # Botão de exportação para dados do gráfico
-        col_export_graf1, col_export_graf2 = st.columns([1, 4])
-        with col_export_graf1:
-            if st.button("📊 Exportar Dados do Gráfico", key="export_grafico_notas_geral", help="Baixar planilha com dados do gráfico geral"):
-                # Preparar dados para exportação (remover coluna de cor)
-                dados_export = contagem[['Disciplina', 'Qtd Notas < 6']].copy()
-                dados_export = dados_export.rename(columns={'Qtd Notas < 6': 'Quantidade_Notas_Abaixo_6'})
-                
-                excel_data = criar_excel_formatado(dados_export, "Notas_Por_Disciplina_Geral")
-                st.download_button(
-                    label="Baixar Excel",
-                    data=excel_data,
-                    file_name="notas_por_disciplina_geral.xlsx",
-                    mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
-                )
-    else:
-        st.info("Sem notas abaixo da média para os filtros atuais.")
-
-# Gráficos separados por bimestre
-col_graf1, col_graf2 = st.columns(2)
-
-# Gráfico 1º Bimestre
-with col_graf1:
-    with st.expander("📊 1º Bimestre - Notas Abaixo da Média por Disciplina"):
-        if len(notas_baixas_b1) > 0:
-            # Contar notas por disciplina no 1º bimestre
-            contagem_b1 = notas_baixas_b1.groupby("Disciplina")["Nota"].count().reset_index()
-            contagem_b1 = contagem_b1.rename(columns={"Nota": "Qtd Notas < 6"})
+    # Gráfico Geral (1º + 2º Bimestre)
+    with st.expander("📈 Geral - Notas Abaixo da Média por Disciplina (1º + 2º Bimestre)"):
+        base_baixas = pd.concat([notas_baixas_b1, notas_baixas_b2], ignore_index=True)
+        if len(base_baixas) > 0:
+            # Contar notas por disciplina
+            contagem = base_baixas.groupby("Disciplina", observed=True)["Nota"].count().reset_index()
+            contagem = contagem.rename(columns={"Nota": "Qtd Notas < 6"})
             
             # Ordenar em ordem decrescente (maior para menor)
-            contagem_b1 = contagem_b1.sort_values("Qtd Notas < 6", ascending=False).reset_index(drop=True)
+            contagem = contagem.sort_values("Qtd Notas < 6", ascending=False).reset_index(drop=True)
             
             # Adicionar coluna de cores intercaladas baseada na posição após ordenação
-            contagem_b1['Cor'] = ['#dc2626' if i % 2 == 0 else '#ea580c' for i in range(len(contagem_b1))]
+            contagem['Cor'] = ['#1e40af' if i % 2 == 0 else '#059669' for i in range(len(contagem))]
             
-            fig_b1 = px.bar(contagem_b1, x="Disciplina", y="Qtd Notas < 6", 
-                           title="Notas abaixo da média - 1º Bimestre",
-                           color="Cor",
-                           color_discrete_map={'#dc2626': '#dc2626', '#ea580c': '#ea580c'})
+            fig = px.bar(contagem, x="Disciplina", y="Qtd Notas < 6", 
+                        title="Notas abaixo da média (1º + 2º Bimestre)",
+                        color="Cor",
+                        color_discrete_map={'#1e40af': '#1e40af', '#059669': '#059669'})
             
             # Forçar a ordem das disciplinas no eixo X
-            fig_b1.update_layout(
+            fig.update_layout(
                 xaxis_title=None, 
                 yaxis_title="Quantidade", 
                 bargap=0.25, 
                 showlegend=False, 
                 xaxis_tickangle=45,
-                xaxis={'categoryorder': 'array', 'categoryarray': contagem_b1['Disciplina'].tolist()}
+                xaxis={'categoryorder': 'array', 'categoryarray': contagem['Disciplina'].tolist()}
             )
-            st.plotly_chart(fig_b1, use_container_width=True)
+            st.plotly_chart(fig, use_container_width=True)
             
-            # Botão de exportação para dados do gráfico 1º bimestre
-            if st.button("📊 Exportar 1º Bimestre", key="export_grafico_notas_b1", help="Baixar planilha com dados do 1º bimestre"):
-                # Preparar dados para exportação (remover coluna de cor)
-                dados_export_b1 = contagem_b1[['Disciplina', 'Qtd Notas < 6']].copy()
-                dados_export_b1 = dados_export_b1.rename(columns={'Qtd Notas < 6': 'Quantidade_Notas_Abaixo_6'})
+            # Botão de exportação para dados do gráfico
+            col_export_graf1, col_export_graf2 = st.columns([1, 4])
+            with col_export_graf1:
+                if st.button("📊 Exportar Dados do Gráfico", key="export_grafico_notas_geral", help="Baixar planilha com dados do gráfico geral"):
+                    # Preparar dados para exportação (remover coluna de cor)
+                    dados_export = contagem[['Disciplina', 'Qtd Notas < 6']].copy()
+                    dados_export = dados_export.rename(columns={'Qtd Notas < 6': 'Quantidade_Notas_Abaixo_6'})
+                    
+                    botoes_download(dados_export, "Notas_Por_Disciplina_Geral", "notas_por_disciplina_geral.xlsx")
+        else:
+            st.info("Sem notas abaixo da média para os filtros atuais.")
+
+    # Gráficos separados por bimestre
+    col_graf1, col_graf2 = st.columns(2)
+
+    # Gráfico 1º Bimestre
+    with col_graf1:
+        with st.expander("📊 1º Bimestre - Notas Abaixo da Média por Disciplina"):
+            if len(notas_baixas_b1) > 0:
+                # Contar notas por disciplina no 1º bimestre
+                contagem_b1 = notas_baixas_b1.groupby("Disciplina", observed=True)["Nota"].count().reset_index()
+                contagem_b1 = contagem_b1.rename(columns={"Nota": "Qtd Notas < 6"})
+                
+                # Ordenar em ordem decrescente (maior para menor)
+                contagem_b1 = contagem_b1.sort_values("Qtd Notas < 6", ascending=False).reset_index(drop=True)
+                
+                # Adicionar coluna de cores intercaladas baseada na posição após ordenação
+                contagem_b1['Cor'] = ['#dc2626' if i % 2 == 0 else '#ea580c' for i in range(len(contagem_b1))]
+                
+                fig_b1 = px.bar(contagem_b1, x="Disciplina", y="Qtd Notas < 6", 
+                               title="Notas abaixo da média - 1º Bimestre",
+                               color="Cor",
+                               color_discrete_map={'#dc2626': '#dc2626', '#ea580c': '#ea580c'})
                 
-                excel_data = criar_excel_formatado(dados_export_b1, "Notas_Por_Disciplina_B1")
-                st.download_button(
-                    label="Baixar Excel",
-                    data=excel_data,
-                    file_name="notas_por_disciplina_1bimestre.xlsx",
-                    mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+                # Forçar a ordem das disciplinas no eixo X
+                fig_b1.update_layout(
+                    xaxis_title=None, 
+                    yaxis_title="Quantidade", 
+                    bargap=0.25, 
+                    showlegend=False, 
+                    xaxis_tickangle=45,
+                    xaxis={'categoryorder': 'array', 'categoryarray': contagem_b1['Disciplina'].tolist()}
                 )
-        else:
-            st.info("Sem notas abaixo da média no 1º bimestre para os filtros atuais.")
-
-# Gráfico 2º Bimestre
-with col_graf2:
-    with st.expander("📊 2º Bimestre - Notas Abaixo da Média por Disciplina"):
-        if len(notas_baixas_b2) > 0:
-            # Contar notas por disciplina no 2º bimestre
-            contagem_b2 = notas_baixas_b2.groupby("Disciplina")["Nota"].count().reset_index()
-            contagem_b2 = contagem_b2.rename(columns={"Nota": "Qtd Notas < 6"})
-            
-            # Ordenar em ordem decrescente (maior para menor)
-            contagem_b2 = contagem_b2.sort_values("Qtd Notas < 6", ascending=False).reset_index(drop=True)
-            
-            # Adicionar coluna de cores intercaladas baseada na posição após ordenação
-            contagem_b2['Cor'] = ['#7c3aed' if i % 2 == 0 else '#a855f7' for i in range(len(contagem_b2))]
-            
-            fig_b2 = px.bar(contagem_b2, x="Disciplina", y="Qtd Notas < 6", 
-                           title="Notas abaixo da média - 2º Bimestre",
-                           color="Cor",
-                           color_discrete_map={'#7c3aed': '#7c3aed', '#a855f7': '#a855f7'})
-            
-            # Forçar a ordem das disciplinas no eixo X
-            fig_b2.update_layout(
-                xaxis_title=None, 
-                yaxis_title="Quantidade", 
-                bargap=0.25, 
-                showlegend=False, 
-                xaxis_tickangle=45,
-                xaxis={'categoryorder': 'array', 'categoryarray': contagem_b2['Disciplina'].tolist()}
-            )
-            st.plotly_chart(fig_b2, use_container_width=True)
-            
-            # Botão de exportação para dados do gráfico 2º bimestre
-            if st.button("📊 Exportar 2º Bimestre", key="export_grafico_notas_b2", help="Baixar planilha com dados do 2º bimestre"):
-                # Preparar dados para exportação (remover coluna de cor)
-                dados_export_b2 = contagem_b2[['Disciplina', 'Qtd Notas < 6']].copy()
-                dados_export_b2 = dados_export_b2.rename(columns={'Qtd Notas < 6': 'Quantidade_Notas_Abaixo_6'})
+                st.plotly_chart(fig_b1, use_container_width=True)
+                
+                # Botão de exportação para dados do gráfico 1º bimestre
+                if st.button("📊 Exportar 1º Bimestre", key="export_grafico_notas_b1", help="Baixar planilha com dados do 1º bimestre"):
+                    # Preparar dados para exportação (remover coluna de cor)
+                    dados_export_b1 = contagem_b1[['Disciplina', 'Qtd Notas < 6']].copy()
+                    dados_export_b1 = dados_export_b1.rename(columns={'Qtd Notas < 6': 'Quantidade_Notas_Abaixo_6'})
+                    
+                    botoes_download(dados_export_b1, "Notas_Por_Disciplina_B1", "notas_por_disciplina_1bimestre.xlsx")
+            else:
+                st.info("Sem notas abaixo da média no 1º bimestre para os filtros atuais.")
+
+    # Gráfico 2º Bimestre
+    with col_graf2:
+        with st.expander("📊 2º Bimestre - Notas Abaixo da Média por Disciplina"):
+            if len(notas_baixas_b2) > 0:
+                # Contar notas por disciplina no 2º bimestre
+                contagem_b2 = notas_baixas_b2.groupby("Disciplina", observed=True)["Nota"].count().reset_index()
+                contagem_b2 = contagem_b2.rename(columns={"Nota": "Qtd Notas < 6"})
+                
+                # Ordenar em ordem decrescente (maior para menor)
+                contagem_b2 = contagem_b2.sort_values("Qtd Notas < 6", ascending=False).reset_index(drop=True)
+                
+                # Adicionar coluna de cores intercaladas baseada na posição após ordenação
+                contagem_b2['Cor'] = ['#7c3aed' if i % 2 == 0 else '#a855f7' for i in range(len(contagem_b2))]
+                
+                fig_b2 = px.bar(contagem_b2, x="Disciplina", y="Qtd Notas < 6", 
+                               title="Notas abaixo da média - 2º Bimestre",
+                               color="Cor",
+                               color_discrete_map={'#7c3aed': '#7c3aed', '#a855f7': '#a855f7'})
                 
-                excel_data = criar_excel_formatado(dados_export_b2, "Notas_Por_Disciplina_B2")
-                st.download_button(
-                    label="Baixar Excel",
-                    data=excel_data,
-                    file_name="notas_por_disciplina_2bimestre.xlsx",
-                    mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+                # Forçar a ordem das disciplinas no eixo X
+                fig_b2.update_layout(
+                    xaxis_title=None, 
+                    yaxis_title="Quantidade", 
+                    bargap=0.25, 
+                    showlegend=False, 
+                    xaxis_tickangle=45,
+                    xaxis={'categoryorder': 'array', 'categoryarray': contagem_b2['Disciplina'].tolist()}
                 )
-        else:
-            st.info("Sem notas abaixo da média no 2º bimestre para os filtros atuais.")
+                st.plotly_chart(fig_b2, use_container_width=True)
+                
+                # Botão de exportação para dados do gráfico 2º bimestre
+                if st.button("📊 Exportar 2º Bimestre", key="export_grafico_notas_b2", help="Baixar planilha com dados do 2º bimestre"):
+                    # Preparar dados para exportação (remover coluna de cor)
+                    dados_export_b2 = contagem_b2[['Disciplina', 'Qtd Notas < 6']].copy()
+                    dados_export_b2 = dados_export_b2.rename(columns={'Qtd Notas < 6': 'Quantidade_Notas_Abaixo_6'})
+                    
+                    botoes_download(dados_export_b2, "Notas_Por_Disciplina_B2", "notas_por_disciplina_2bimestre.xlsx")
+            else:
+                st.info("Sem notas abaixo da média no 2º bimestre para os filtros atuais.")
+
+secao_graficos_notas(notas_baixas_b1, notas_baixas_b2)
 
 st.markdown("### 🏫 Média das notas por turma")
 with st.expander("📊 Ranking das turmas — média geral (da melhor para a pior)"):
@@ -3623,7 +3373,7 @@ with st.expander("📊 Ranking das turmas — média geral (da melhor para a pio
         st.info("Sem notas válidas para calcular a média por turma.")
     else:
         media_por_turma = (
-            df_filt.groupby("Turma", as_index=False)["Nota"]
+            df_filt.groupby("Turma", as_index=False, observed=True)["Nota"]
             .mean()
             .rename(columns={"Nota": "Media_notas"})
         )
@@ -3668,526 +3418,391 @@ with st.expander("📊 Ranking das turmas — média geral (da melhor para a pio
             )
 
 # Gráfico: Distribuição de Frequência por Faixas
-col_graf1, col_graf2 = st.columns(2)
-
-# Gráfico: Distribuição de Frequência por Faixas
-with col_graf2:
-    with st.expander("Distribuição de Frequência por Faixas"):
-        if "Frequencia Anual" in df_filt.columns or "Frequencia" in df_filt.columns:
-            # Usar os mesmos dados do Resumo de Frequência
-            if "Frequencia Anual" in df_filt.columns:
-                freq_geral = df_filt.groupby([coluna_aluno, "Turma"])["Frequencia Anual"].last().reset_index()
-                freq_geral = freq_geral.rename(columns={"Frequencia Anual": "Frequencia"})
-            else:
-                freq_geral = df_filt.groupby([coluna_aluno, "Turma"])["Frequencia"].last().reset_index()
-            
-            freq_geral["Classificacao_Freq"] = freq_geral["Frequencia"].apply(classificar_frequencia_geral)
-            contagem_freq_geral = freq_geral["Classificacao_Freq"].value_counts()
-            
-            # Preparar dados para o gráfico
-            dados_grafico = []
-            cores = {
-                "Reprovado": "#dc2626",
-                "Alto Risco": "#ea580c", 
-                "Risco Moderado": "#d97706",
-                "Ponto de Atenção": "#f59e0b",
-                "Meta Favorável": "#16a34a"
-            }
-            
-            for categoria, quantidade in contagem_freq_geral.items():
-                if categoria != "Sem dados":  # Excluir "Sem dados" do gráfico
-                    dados_grafico.append({
-                        "Categoria": categoria,
-                        "Quantidade": quantidade,
-                        "Cor": cores.get(categoria, "#6b7280")
-                    })
-            
-            if dados_grafico:
-                df_grafico = pd.DataFrame(dados_grafico)
-                
-                # Criar gráfico de barras
-                fig_freq = px.bar(df_grafico, x="Categoria", y="Quantidade", 
-                                 title="Distribuição de Alunos por Faixa de Frequência",
-                                 color="Categoria", 
-                                 color_discrete_map=cores)
-                fig_freq.update_layout(xaxis_title=None, yaxis_title="Número de Alunos", 
-                                     bargap=0.25, showlegend=False, xaxis_tickangle=45)
-                st.plotly_chart(fig_freq, use_container_width=True)
-                
-                # Botão de exportação para dados do gráfico de frequência
-                col_export_graf3, col_export_graf4 = st.columns([1, 4])
-                with col_export_graf3:
-                    if st.button("📊 Exportar Dados do Gráfico", key="export_grafico_freq", help="Baixar planilha com dados do gráfico de frequência"):
-                        # Preparar dados para exportação
-                        dados_export_freq = df_grafico[['Categoria', 'Quantidade']].copy()
-                        dados_export_freq = dados_export_freq.rename(columns={'Quantidade': 'Numero_Alunos'})
-                        
-                        excel_data = criar_excel_formatado(dados_export_freq, "Frequencia_Por_Faixa")
-                        st.download_button(
-                            label="Baixar Excel",
-                            data=excel_data,
-                            file_name="frequencia_por_faixa.xlsx",
-                            mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
-                        )
-                
-                # Estatísticas adicionais
-                st.markdown("**Resumo das Faixas de Frequência:**")
-                col_stat1, col_stat2, col_stat3 = st.columns(3)
-                with col_stat1:
-                    total_alunos = contagem_freq_geral.sum()
-                    st.metric("Total de Alunos", total_alunos, help="Total de alunos considerados na análise de frequência")
-                with col_stat2:
-                    alunos_risco = contagem_freq_geral.get("Reprovado", 0) + contagem_freq_geral.get("Alto Risco", 0)
-                    st.metric("Alunos em Risco", alunos_risco, help="Alunos reprovados ou em alto risco de reprovação por frequência")
-                with col_stat3:
-                    alunos_meta = contagem_freq_geral.get("Meta Favorável", 0)
-                    percentual_meta = (alunos_meta / total_alunos * 100) if total_alunos > 0 else 0
-                    st.metric("Meta Favorável", f"{percentual_meta:.1f}%", help="Percentual de alunos com frequência ≥ 95% (meta favorável)")
-            else:
-                st.info("Sem dados de frequência para exibir.")
-        else:
-            st.info("Dados de frequência não disponíveis na planilha.")
-
-# Seção expandível: Análise Cruzada Nota x Frequência (movida para o final)
-st.markdown("---")
-st.markdown("""
-<div style="background: linear-gradient(135deg, #1e40af, #3b82f6); border-radius: 12px; padding: 25px; margin: 20px 0; box-shadow: 0 4px 15px rgba(30, 64, 175, 0.2);">
-    <h2 style="color: white; text-align: center; margin: 0; font-size: 1.7em; font-weight: 700; text-shadow: 0 1px 3px rgba(0,0,0,0.3);">Análise Cruzada</h2>
-    <p style="color: rgba(255,255,255,0.9); text-align: center; margin: 8px 0 0 0; font-size: 1.1em; font-weight: 500;">Cruzamento entre Notas e Frequência</p>
-</div>
-""", unsafe_allow_html=True)
-
-with st.expander("Análise Cruzada: Notas x Frequência"):
-    if ("Frequencia Anual" in df_filt.columns or "Frequencia" in df_filt.columns) and len(indic) > 0:
-        # Combinar dados de notas e frequência (priorizando Frequencia Anual)
-        if "Frequencia Anual" in df_filt.columns:
-            freq_alunos = df_filt.groupby([coluna_aluno, "Turma"])["Frequencia Anual"].last().reset_index()
-            freq_alunos = freq_alunos.rename(columns={"Frequencia Anual": "Frequencia"})
-        else:
-            freq_alunos = df_filt.groupby([coluna_aluno, "Turma"])["Frequencia"].last().reset_index()
-        freq_alunos["Classificacao_Freq"] = freq_alunos["Frequencia"].apply(classificar_frequencia)
-        
-        # Merge com indicadores de notas
-        cruzada = indic.merge(freq_alunos, on=[coluna_aluno, "Turma"], how="left")
-        
-        # Matriz: alunos únicos (aluno + turma) em cada célula — evita contar várias disciplinas do mesmo aluno
-        cruzada_uni = cruzada.drop_duplicates(
-            subset=[coluna_aluno, "Turma", "Classificacao", "Classificacao_Freq"]
-        )
-        matriz_cruzada = (
-            cruzada_uni.groupby(["Classificacao", "Classificacao_Freq"])
-            .size()
-            .unstack(fill_value=0)
-        )
-        
-        if not matriz_cruzada.empty:
-            st.markdown("**Matriz de Cruzamento: Classificação de Notas x Frequência**")
-            st.caption(
-                "Valores = **número de alunos únicos** (mesmo aluno na mesma turma conta uma vez por combinação de classificação de notas e de frequência)."
-            )
-            st.dataframe(matriz_cruzada, use_container_width=True)
-            
-            # Análise de alunos com frequência abaixo de 95%
-            freq_baixa = cruzada[cruzada["Frequencia"] < 95]
-            
-            if len(freq_baixa) > 0:
-                st.markdown("### Alunos com Frequência Abaixo de 95% (Cruzamento Notas x Frequência)")
-                # Mostrar apenas colunas relevantes para frequência baixa
-                freq_baixa_display = freq_baixa[[coluna_aluno, "Turma", "Disciplina", "Classificacao", "Classificacao_Freq", "Frequencia"]].copy()
-                # Formatar frequência
-                freq_baixa_display["Frequencia"] = freq_baixa_display["Frequencia"].apply(
-                    lambda x: f"{x:.1f}%" if pd.notna(x) else "N/A"
-                )
-                
-                # Função para colorir classificações de frequência
-                def color_frequencia_classification(val):
-                    if val == "Reprovado":
-                        return "background-color: #dc2626; color: white; font-weight: bold;"  # Vermelho forte
-                    elif val == "Alto Risco":
-                        return "background-color: #ea580c; color: white; font-weight: bold;"  # Laranja escuro
-                    elif val == "Risco Moderado":
-                        return "background-color: #f59e0b; color: white; font-weight: bold;"  # Laranja forte
-                    elif val == "Ponto de Atenção":
-                        return "background-color: #eab308; color: white; font-weight: bold;"  # Amarelo forte
-                    elif val == "Meta Favorável":
-                        return "background-color: #10b981; color: white; font-weight: bold;"  # Verde forte
-                    else:
-                        return ""
-                
-                # Aplicar cores nas duas colunas de classificação
-                styled_cruzada = _style_apply_cells(
-                    _style_apply_cells(freq_baixa_display, color_classification, ["Classificacao"]),
-                    color_frequencia_classification,
-                    ["Classificacao_Freq"],
-                )
-                
-                st.dataframe(styled_cruzada, use_container_width=True)
-                
-                # Legenda para classificações de frequência
-                st.markdown("### 🎨 Legenda das Classificações")
-                col_leg1, col_leg2 = st.columns(2)
-                
-                with col_leg1:
-                    st.markdown("**Classificação de Notas:**")
-                    st.markdown("""
-                    <div style="background-color: #10b981; color: white; padding: 5px; border-radius: 3px; margin: 2px 0; font-weight: bold; text-align: center;">
-                        🟢 Verde: Aluno está bem (N1≥6 e N2≥6)
-                    </div>
-                    <div style="background-color: #dc2626; color: white; padding: 5px; border-radius: 3px; margin: 2px 0; font-weight: bold; text-align: center;">
-                        🔴 Vermelho Duplo: Risco alto (N1<6 e N2<6)
-                    </div>
-                    <div style="background-color: #f59e0b; color: white; padding: 5px; border-radius: 3px; margin: 2px 0; font-weight: bold; text-align: center;">
-                        🟠 Queda p/ Vermelho: Piorou (N1≥6 e N2<6)
-                    </div>
-                    <div style="background-color: #3b82f6; color: white; padding: 5px; border-radius: 3px; margin: 2px 0; font-weight: bold; text-align: center;">
-                        🔵 Recuperou: Melhorou (N1<6 e N2≥6)
-                    </div>
-                    <div style="background-color: #6b7280; color: white; padding: 5px; border-radius: 3px; margin: 2px 0; font-weight: bold; text-align: center;">
-                        ⚪ Incompleto: Falta nota
-                    </div>
-                    """, unsafe_allow_html=True)
-                
-                with col_leg2:
-                    st.markdown("**Classificação de Frequência:**")
-                    st.markdown("""
-                    <div style="background-color: #dc2626; color: white; padding: 5px; border-radius: 3px; margin: 2px 0; font-weight: bold; text-align: center;">
-                        🔴 Reprovado: < 75%
-                    </div>
-                    <div style="background-color: #ea580c; color: white; padding: 5px; border-radius: 3px; margin: 2px 0; font-weight: bold; text-align: center;">
-                        🟠 Alto Risco: < 80%
-                    </div>
-                    <div style="background-color: #f59e0b; color: white; padding: 5px; border-radius: 3px; margin: 2px 0; font-weight: bold; text-align: center;">
-                        🟠 Risco Moderado: < 90%
-                    </div>
-                    <div style="background-color: #eab308; color: white; padding: 5px; border-radius: 3px; margin: 2px 0; font-weight: bold; text-align: center;">
-                        🟡 Ponto de Atenção: < 95%
-                    </div>
-                    <div style="background-color: #10b981; color: white; padding: 5px; border-radius: 3px; margin: 2px 0; font-weight: bold; text-align: center;">
-                        🟢 Meta Favorável: ≥ 95%
-                    </div>
-                    """, unsafe_allow_html=True)
-                
-                # Botão de exportação para alunos com frequência baixa
-                col_export_freq_baixa1, col_export_freq_baixa2 = st.columns([1, 4])
-                with col_export_freq_baixa1:
-                    if st.button("📊 Exportar Cruzamento", key="export_freq_baixa", help="Baixar planilha com cruzamento de notas e frequência (alunos com frequência < 95%)"):
-                        excel_data = criar_excel_formatado(freq_baixa_display, "Cruzamento_Notas_Freq")
-                        st.download_button(
-                            label="Baixar Excel",
-                            data=excel_data,
-                            file_name="cruzamento_notas_frequencia.xlsx",
-                            mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
-                        )
-            else:
-                st.info("Todos os alunos têm frequência ≥ 95% (Meta Favorável).")
-        else:
-            st.info("Dados insuficientes para análise cruzada.")
-    else:
-        st.info("Dados de frequência ou notas não disponíveis para análise cruzada.")
-
-# Botão para baixar todas as planilhas em uma única planilha Excel
-st.markdown("---")
-st.markdown("""
-<div style="background: linear-gradient(135deg, #059669, #10b981); border-radius: 12px; padding: 25px; margin: 20px 0; box-shadow: 0 4px 15px rgba(5, 150, 105, 0.2);">
-    <h2 style="color: white; text-align: center; margin: 0; font-size: 1.7em; font-weight: 700; text-shadow: 0 1px 3px rgba(0,0,0,0.3);">📊 Exportação Completa</h2>
-    <p style="color: rgba(255,255,255,0.9); text-align: center; margin: 8px 0 0 0; font-size: 1.1em; font-weight: 500;">Baixar todas as análises em uma única planilha Excel</p>
-</div>
-""", unsafe_allow_html=True)
-
-col_export_all1, col_export_all2 = st.columns([1, 4])
-with col_export_all1:
-    if st.button("📊 Baixar Tudo", key="export_tudo", help="Baixar todas as análises em uma única planilha Excel com múltiplas abas"):
-        # Criar arquivo Excel com múltiplas abas
-        output = BytesIO()
-        
-        with pd.ExcelWriter(output, engine='openpyxl') as writer:
-            # Aba 1: Alunos em Alerta
-            if len(tabela_alerta) > 0:
-                tabela_alerta[cols_visiveis].to_excel(writer, sheet_name="Alunos_em_Alerta", index=False)
-            
-            # Aba 2: Panorama Geral de Notas
-            tab_diag[[coluna_aluno, "Turma", "Disciplina", "N1", "N2", "Media12", "Classificacao", "ReqMediaProx2"]].to_excel(
-                writer, sheet_name="Panorama_Geral_Notas", index=False)
-            
-            # Aba 3: Análise de Frequência (se disponível)
-            if "Frequencia Anual" in df_filt.columns or "Frequencia" in df_filt.columns:
-                if "Frequencia Anual" in df_filt.columns:
-                    freq_detalhada = df_filt.groupby([coluna_aluno, "Turma"])["Frequencia Anual"].last().reset_index()
-                    freq_detalhada = freq_detalhada.rename(columns={"Frequencia Anual": "Frequencia"})
-                else:
-                    freq_detalhada = df_filt.groupby([coluna_aluno, "Turma"])["Frequencia"].last().reset_index()
-                
-                freq_detalhada["Classificacao_Freq"] = freq_detalhada["Frequencia"].apply(classificar_frequencia)
-                freq_detalhada["Frequencia_Formatada"] = freq_detalhada["Frequencia"].apply(
-                    lambda x: f"{x:.1f}%" if pd.notna(x) else "N/A"
-                )
-                faltas_bim = agregar_faltas_por_bimestre_aluno_turma(df_filt, coluna_aluno)
-                cols_freq_xlsx = [coluna_aluno, "Turma", "Frequencia_Formatada", "Classificacao_Freq"]
-                if faltas_bim is not None:
-                    freq_detalhada = freq_detalhada.merge(
-                        faltas_bim, on=[coluna_aluno, "Turma"], how="left"
-                    )
-                    for _c in ("Faltas_1_Bimestre", "Faltas_2_Bimestre", "Faltas_Total_1e2_Bim"):
-                        freq_detalhada[_c] = freq_detalhada[_c].fillna(0).astype(int)
-                    cols_freq_xlsx.extend(
-                        ["Faltas_1_Bimestre", "Faltas_2_Bimestre", "Faltas_Total_1e2_Bim"]
-                    )
-                freq_detalhada[cols_freq_xlsx].to_excel(
-                    writer, sheet_name="Analise_Frequencia", index=False)
-            
-            # Aba 4: Notas por Disciplina (se houver dados)
-            base_baixas = pd.concat([notas_baixas_b1, notas_baixas_b2], ignore_index=True)
-            if len(base_baixas) > 0:
-                contagem = base_baixas.groupby("Disciplina")["Nota"].count().reset_index()
-                contagem = contagem.rename(columns={"Nota": "Quantidade_Notas_Abaixo_6"})
-                contagem = contagem.sort_values("Quantidade_Notas_Abaixo_6", ascending=False).reset_index(drop=True)
-                contagem.to_excel(writer, sheet_name="Notas_Por_Disciplina", index=False)
-            
-            # Aba 5: Frequência por Faixas (se disponível)
+@fragmento
+def secao_grafico_frequencia(df_filt, freq_alunos_filt):
+    """Distribuição de frequência por faixas e sua exportação."""
+    col_graf1, col_graf2 = st.columns(2)
+
+    # Gráfico: Distribuição de Frequência por Faixas
+    with col_graf2:
+        with st.expander("Distribuição de Frequência por Faixas"):
             if "Frequencia Anual" in df_filt.columns or "Frequencia" in df_filt.columns:
-                if "Frequencia Anual" in df_filt.columns:
-                    freq_geral = df_filt.groupby([coluna_aluno, "Turma"])["Frequencia Anual"].last().reset_index()
-                    freq_geral = freq_geral.rename(columns={"Frequencia Anual": "Frequencia"})
-                else:
-                    freq_geral = df_filt.groupby([coluna_aluno, "Turma"])["Frequencia"].last().reset_index()
-                
-                freq_geral["Classificacao_Freq"] = freq_geral["Frequencia"].apply(classificar_frequencia_geral)
+                # Usar os mesmos dados do Resumo de Frequência
+                freq_geral = frequencia_alunos_turma(freq_alunos_filt, "anual")
                 contagem_freq_geral = freq_geral["Classificacao_Freq"].value_counts()
                 
+                # Preparar dados para o gráfico
                 dados_grafico = []
+                paleta = ["#dc2626", "#ea580c", "#d97706", "#f59e0b", "#16a34a"]
+                cores = {
+                    rotulo: paleta[_posicao_cor_faixa(rotulo, len(paleta))]
+                    for rotulo in FAIXAS_FREQUENCIA["rotulos"]
+                }
+                
                 for categoria, quantidade in contagem_freq_geral.items():
-                    if categoria != "Sem dados":
+                    # Excluir "Sem dados" e faixas sem alunos do gráfico
+                    if categoria != FAIXAS_FREQUENCIA["sem_dados"] and quantidade > 0:
                         dados_grafico.append({
                             "Categoria": categoria,
-                            "Numero_Alunos": quantidade
+                            "Quantidade": quantidade,
+                            "Cor": cores.get(categoria, "#6b7280")
                         })
                 
                 if dados_grafico:
                     df_grafico = pd.DataFrame(dados_grafico)
-                    df_grafico.to_excel(writer, sheet_name="Frequencia_Por_Faixa", index=False)
-            
-            # Aba 6: Cruzamento Notas x Frequência (se disponível)
-            if ("Frequencia Anual" in df_filt.columns or "Frequencia" in df_filt.columns) and len(indic) > 0:
-                if "Frequencia Anual" in df_filt.columns:
-                    freq_alunos = df_filt.groupby([coluna_aluno, "Turma"])["Frequencia Anual"].last().reset_index()
-                    freq_alunos = freq_alunos.rename(columns={"Frequencia Anual": "Frequencia"})
+                    
+                    # Criar gráfico de barras
+                    fig_freq = px.bar(df_grafico, x="Categoria", y="Quantidade", 
+                                     title="Distribuição de Alunos por Faixa de Frequência",
+                                     color="Categoria", 
+                                     color_discrete_map=cores)
+                    fig_freq.update_layout(xaxis_title=None, yaxis_title="Número de Alunos", 
+                                         bargap=0.25, showlegend=False, xaxis_tickangle=45)
+                    st.plotly_chart(fig_freq, use_container_width=True)
+                    
+                    # Botão de exportação para dados do gráfico de frequência
+                    col_export_graf3, col_export_graf4 = st.columns([1, 4])
+                    with col_export_graf3:
+                        if st.button("📊 Exportar Dados do Gráfico", key="export_grafico_freq", help="Baixar planilha com dados do gráfico de frequência"):
+                            # Preparar dados para exportação
+                            dados_export_freq = df_grafico[['Categoria', 'Quantidade']].copy()
+                            dados_export_freq = dados_export_freq.rename(columns={'Quantidade': 'Numero_Alunos'})
+                            
+                            botoes_download(dados_export_freq, "Frequencia_Por_Faixa", "frequencia_por_faixa.xlsx")
+                    
+                    # Estatísticas adicionais
+                    st.markdown("**Resumo das Faixas de Frequência:**")
+                    col_stat1, col_stat2, col_stat3 = st.columns(3)
+                    with col_stat1:
+                        total_alunos = contagem_freq_geral.sum()
+                        st.metric("Total de Alunos", total_alunos, help="Total de alunos considerados na análise de frequência")
+                    with col_stat2:
+                        # As duas piores faixas (padrão: Reprovado e Alto Risco)
+                        alunos_risco = int(sum(contagem_freq_geral.get(r, 0) for r in FAIXAS_FREQUENCIA["rotulos"][:2]))
+                        st.metric("Alunos em Risco", alunos_risco, help="Alunos reprovados ou em alto risco de reprovação por frequência")
+                    with col_stat3:
+                        rotulo_meta, intervalo_meta = descrever_faixas_frequencia()[-1]
+                        alunos_meta = contagem_freq_geral.get(rotulo_meta, 0)
+                        percentual_meta = (alunos_meta / total_alunos * 100) if total_alunos > 0 else 0
+                        st.metric(rotulo_meta, f"{percentual_meta:.1f}%", help=f"Percentual de alunos com frequência {intervalo_meta} ({rotulo_meta.lower()})")
                 else:
-                    freq_alunos = df_filt.groupby([coluna_aluno, "Turma"])["Frequencia"].last().reset_index()
+                    st.info("Sem dados de frequência para exibir.")
+            else:
+                st.info("Dados de frequência não disponíveis na planilha.")
+
+secao_grafico_frequencia(df_filt, freq_alunos_filt)
+
+# Seção expandível: Análise Cruzada Nota x Frequência (movida para o final)
+@fragmento
+def secao_analise_cruzada(indic, df_filt, freq_alunos_filt, coluna_aluno):
+    """Cruzamento de notas e frequência e sua exportação."""
+    st.markdown("---")
+    st.markdown("""
+    <div style="background: linear-gradient(135deg, #1e40af, #3b82f6); border-radius: 12px; padding: 25px; margin: 20px 0; box-shadow: 0 4px 15px rgba(30, 64, 175, 0.2);">
+        <h2 style="color: white; text-align: center; margin: 0; font-size: 1.7em; font-weight: 700; text-shadow: 0 1px 3px rgba(0,0,0,0.3);">Análise Cruzada</h2>
+        <p style="color: rgba(255,255,255,0.9); text-align: center; margin: 8px 0 0 0; font-size: 1.1em; font-weight: 500;">Cruzamento entre Notas e Frequência</p>
+    </div>
+    """, unsafe_allow_html=True)
+
+    expander_cruzada = _expander_sob_demanda("Análise Cruzada: Notas x Frequência", "expander_analise_cruzada")
+    with expander_cruzada:
+        if not _aberto(expander_cruzada):
+            return
+        if ("Frequencia Anual" in df_filt.columns or "Frequencia" in df_filt.columns) and len(indic) > 0:
+            # Combinar dados de notas e frequência (priorizando Frequencia Anual)
+            freq_alunos = frequencia_alunos_turma(freq_alunos_filt, "anual")[[coluna_aluno, "Turma", "Frequencia", "Classificacao_Freq"]]
+            
+            # Merge com indicadores de notas
+            cruzada = indic.merge(freq_alunos, on=[coluna_aluno, "Turma"], how="left")
+            
+            # Matriz: alunos únicos (aluno + turma) em cada célula — evita contar várias disciplinas do mesmo aluno
+            cruzada_uni = cruzada.drop_duplicates(
+                subset=[coluna_aluno, "Turma", "Classificacao", "Classificacao_Freq"]
+            )
+            matriz_cruzada = (
+                cruzada_uni.groupby(["Classificacao", "Classificacao_Freq"], observed=True)
+                .size()
+                .unstack(fill_value=0)
+            )
+            # Colunas na ordem das faixas, mas como índice comum (st.dataframe não serializa CategoricalIndex)
+            matriz_cruzada.columns = matriz_cruzada.columns.astype(object)
+            
+            if not matriz_cruzada.empty:
+                st.markdown("**Matriz de Cruzamento: Classificação de Notas x Frequência**")
+                st.caption(
+                    "Valores = **número de alunos únicos** (mesmo aluno na mesma turma conta uma vez por combinação de classificação de notas e de frequência)."
+                )
+                st.dataframe(matriz_cruzada, use_container_width=True)
                 
-                freq_alunos["Classificacao_Freq"] = freq_alunos["Frequencia"].apply(classificar_frequencia)
-                cruzada = indic.merge(freq_alunos, on=[coluna_aluno, "Turma"], how="left")
-                freq_baixa = cruzada[cruzada["Frequencia"] < 95]
+                # Análise de alunos com frequência abaixo da meta (último limite das faixas)
+                limite_meta = FAIXAS_FREQUENCIA["limites"][-1]
+                freq_baixa = cruzada[cruzada["Frequencia"] < limite_meta]
                 
                 if len(freq_baixa) > 0:
+                    st.markdown(f"### Alunos com Frequência Abaixo de {limite_meta:g}% (Cruzamento Notas x Frequência)")
+                    # Mostrar apenas colunas relevantes para frequência baixa
                     freq_baixa_display = freq_baixa[[coluna_aluno, "Turma", "Disciplina", "Classificacao", "Classificacao_Freq", "Frequencia"]].copy()
+                    # Formatar frequência
                     freq_baixa_display["Frequencia"] = freq_baixa_display["Frequencia"].apply(
                         lambda x: f"{x:.1f}%" if pd.notna(x) else "N/A"
                     )
-                    freq_baixa_display.to_excel(writer, sheet_name="Cruzamento_Notas_Freq", index=False)
-            
-            # Aba 7: Alunos Duplicados (se houver)
-            alunos_turmas = df_filt.groupby(coluna_aluno)["Turma"].nunique().reset_index()
-            alunos_turmas = alunos_turmas.rename(columns={"Turma": "Qtd_Turmas"})
-            alunos_duplicados = alunos_turmas[alunos_turmas["Qtd_Turmas"] > 1].copy()
-            
-            if len(alunos_duplicados) > 0:
-                # Criar formato com colunas separadas para cada turma
-                export_data = []
-                for _, row in alunos_duplicados.iterrows():
-                    aluno = row[coluna_aluno]
-                    qtd_turmas = row["Qtd_Turmas"]
-                    turmas_aluno = df_filt[df_filt[coluna_aluno] == aluno]["Turma"].unique().tolist()
-                    turmas_aluno = sorted(turmas_aluno)
                     
-                    # Criar linha com colunas separadas
-                    linha = {
-                        coluna_aluno: aluno,
-                        "Qtd_Turmas": qtd_turmas
-                    }
+                    # Função para colorir classificações de frequência
+                    # Vermelho forte, laranja escuro, laranja forte, amarelo forte, verde forte
+                    cores_freq = ["#dc2626", "#ea580c", "#f59e0b", "#eab308", "#10b981"]
+                    emojis_freq = ["🔴", "🟠", "🟠", "🟡", "🟢"]
+
+                    def color_frequencia_classification(val):
+                        posicao = _posicao_cor_faixa(val, len(cores_freq))
+                        if posicao is None:
+                            return ""
+                        return f"background-color: {cores_freq[posicao]}; color: white; font-weight: bold;"
                     
-                    # Adicionar cada turma em uma coluna separada
-                    for i, turma in enumerate(turmas_aluno, 1):
-                        linha[f"Turma_{i}"] = turma
+                    # Aplicar cores nas duas colunas de classificação
+                    styled_cruzada = _style_apply_cells(
+                        _style_apply_cells(freq_baixa_display, color_classification, ["Classificacao"]),
+                        color_frequencia_classification,
+                        ["Classificacao_Freq"],
+                    )
                     
-                    # Preencher colunas vazias com None para alunos com menos turmas
-                    max_turmas = alunos_duplicados["Qtd_Turmas"].max()
-                    for i in range(len(turmas_aluno) + 1, max_turmas + 1):
-                        linha[f"Turma_{i}"] = None
+                    st.dataframe(styled_cruzada, use_container_width=True)
                     
-                    export_data.append(linha)
-                
-                df_export = pd.DataFrame(export_data)
-                df_export = df_export.sort_values(["Qtd_Turmas", coluna_aluno], ascending=[False, True])
-                df_export.to_excel(writer, sheet_name="Alunos_Duplicados", index=False)
-        
-        output.seek(0)
+                    # Legenda para classificações de frequência
+                    st.markdown("### 🎨 Legenda das Classificações")
+                    col_leg1, col_leg2 = st.columns(2)
+                    
+                    with col_leg1:
+                        st.markdown("**Classificação de Notas:**")
+                        st.markdown("""
+                        <div style="background-color: #10b981; color: white; padding: 5px; border-radius: 3px; margin: 2px 0; font-weight: bold; text-align: center;">
+                            🟢 Verde: Aluno está bem (N1≥6 e N2≥6)
+                        </div>
+                        <div style="background-color: #dc2626; color: white; padding: 5px; border-radius: 3px; margin: 2px 0; font-weight: bold; text-align: center;">
+                            🔴 Vermelho Duplo: Risco alto (N1<6 e N2<6)
+                        </div>
+                        <div style="background-color: #f59e0b; color: white; padding: 5px; border-radius: 3px; margin: 2px 0; font-weight: bold; text-align: center;">
+                            🟠 Queda p/ Vermelho: Piorou (N1≥6 e N2<6)
+                        </div>
+                        <div style="background-color: #3b82f6; color: white; padding: 5px; border-radius: 3px; margin: 2px 0; font-weight: bold; text-align: center;">
+                            🔵 Recuperou: Melhorou (N1<6 e N2≥6)
+                        </div>
+                        <div style="background-color: #6b7280; color: white; padding: 5px; border-radius: 3px; margin: 2px 0; font-weight: bold; text-align: center;">
+                            ⚪ Incompleto: Falta nota
+                        </div>
+                        """, unsafe_allow_html=True)
+                    
+                    with col_leg2:
+                        st.markdown("**Classificação de Frequência:**")
+                        legenda_freq = ""
+                        for rotulo, intervalo in descrever_faixas_frequencia():
+                            posicao = _posicao_cor_faixa(rotulo, len(cores_freq))
+                            legenda_freq += f"""
+                        <div style="background-color: {cores_freq[posicao]}; color: white; padding: 5px; border-radius: 3px; margin: 2px 0; font-weight: bold; text-align: center;">
+                            {emojis_freq[posicao]} {rotulo}: {intervalo}
+                        </div>"""
+                        st.markdown(legenda_freq, unsafe_allow_html=True)
+                    
+                    # Botão de exportação para alunos com frequência baixa
+                    col_export_freq_baixa1, col_export_freq_baixa2 = st.columns([1, 4])
+                    with col_export_freq_baixa1:
+                        if st.button("📊 Exportar Cruzamento", key="export_freq_baixa", help=f"Baixar planilha com cruzamento de notas e frequência (alunos com frequência < {limite_meta:g}%)"):
+                            botoes_download(freq_baixa_display, "Cruzamento_Notas_Freq", "cruzamento_notas_frequencia.xlsx")
+                else:
+                    rotulo_meta, intervalo_meta = descrever_faixas_frequencia()[-1]
+                    st.info(f"Todos os alunos têm frequência {intervalo_meta} ({rotulo_meta}).")
+            else:
+                st.info("Dados insuficientes para análise cruzada.")
+        else:
+            st.info("Dados de frequência ou notas não disponíveis para análise cruzada.")
+
+secao_analise_cruzada(indic, df_filt, freq_alunos_filt, coluna_aluno)
+
+# Botão para baixar todas as planilhas em uma única planilha Excel
+@fragmento
+def secao_exportacao_completa(df_filt, indic, tabela_alerta_futura, cols_visiveis, tab_diag_futura, notas_baixas_b1,
+                              notas_baixas_b2, freq_alunos_filt, coluna_aluno, alunos_duplicados_futuros,
+                              chave_dataset, estado_filtros):
+    """Botão "Baixar Tudo": a planilha é montada na fila de exportações, com o andamento na tela."""
+    st.markdown("---")
+    st.markdown("""
+    <div style="background: linear-gradient(135deg, #059669, #10b981); border-radius: 12px; padding: 25px; margin: 20px 0; box-shadow: 0 4px 15px rgba(5, 150, 105, 0.2);">
+        <h2 style="color: white; text-align: center; margin: 0; font-size: 1.7em; font-weight: 700; text-shadow: 0 1px 3px rgba(0,0,0,0.3);">📊 Exportação Completa</h2>
+        <p style="color: rgba(255,255,255,0.9); text-align: center; margin: 8px 0 0 0; font-size: 1.1em; font-weight: 500;">Baixar todas as análises em uma única planilha Excel</p>
+    </div>
+    """, unsafe_allow_html=True)
+
+    fila = fila_exportacoes()
+    chave_exportacao = (chave_dataset, estado_filtros)
+    trabalho = fila.trabalho(chave_exportacao)
+
+    col_export_all1, col_export_all2 = st.columns([1, 4])
+    with col_export_all1:
+        if trabalho is None and st.button("📊 Baixar Tudo", key="export_tudo", help="Baixar todas as análises em uma única planilha Excel com múltiplas abas"):
+            trabalho = fila.iniciar(
+                chave_exportacao, montar_planilha_completa,
+                df_filt, indic, tabela_alerta_futura.result(), cols_visiveis, tab_diag_futura.result(),
+                notas_baixas_b1, notas_baixas_b2, freq_alunos_filt, coluna_aluno, alunos_duplicados_futuros.result(),
+            )
+    if trabalho is None:
+        return
+
+    futuro = trabalho["futuro"]
+    if not futuro.done():
+        # A barra é um fragmento periódico: a sessão não fica presa esperando a exportação, que
+        # continua na fila; ao terminar, o painel reexecuta e mostra o botão de download
+        acompanhar = _fragmento_periodico(0.5)
+        with col_export_all2:
+            if acompanhar is not None:
+                @acompanhar
+                def andamento_exportacao():
+                    if futuro.done():
+                        st.rerun()
+                    st.progress(trabalho["etapa"] / trabalho["total"], text=f"{trabalho['descricao']}...")
+
+                andamento_exportacao()
+                return
+            barra = st.progress(0.0, text=trabalho["descricao"])
+            while not futuro.done():  # Streamlit sem fragmentos: espera aqui, como antes
+                barra.progress(trabalho["etapa"] / trabalho["total"], text=f"{trabalho['descricao']}...")
+                time.sleep(0.2)
+            barra.empty()
+
+    if futuro.exception() is not None:
+        fila.descartar(chave_exportacao)
+        st.error(f"Não foi possível gerar a planilha completa: {futuro.exception()}")
+        return
+    with col_export_all1:
         st.download_button(
             label="📥 Baixar Planilha Completa",
-            data=output.getvalue(),
+            data=futuro.result(),
             file_name="painel_sge_completo.xlsx",
             mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
         )
 
-# Seção: Identificação de Alunos em Múltiplas Turmas
-st.markdown("---")
-st.markdown("""
-<div style="background: linear-gradient(135deg, #dc2626, #ef4444); border-radius: 12px; padding: 25px; margin: 20px 0; box-shadow: 0 4px 15px rgba(220, 38, 38, 0.2);">
-    <h2 style="color: white; text-align: center; margin: 0; font-size: 1.7em; font-weight: 700; text-shadow: 0 1px 3px rgba(0,0,0,0.3);">🔍 Identificação de Alunos Duplicados</h2>
-    <p style="color: rgba(255,255,255,0.9); text-align: center; margin: 8px 0 0 0; font-size: 1.1em; font-weight: 500;">Detecção de alunos que aparecem em múltiplas turmas</p>
-</div>
-""", unsafe_allow_html=True)
-
-# Identificar alunos em múltiplas turmas
-alunos_turmas = df_filt.groupby(coluna_aluno)["Turma"].nunique().reset_index()
-alunos_turmas = alunos_turmas.rename(columns={"Turma": "Qtd_Turmas"})
+secao_exportacao_completa(df_filt, indic, tabela_alerta_futura, cols_visiveis, tab_diag_futura, notas_baixas_b1,
+                          notas_baixas_b2, freq_alunos_filt, coluna_aluno, alunos_duplicados_futuros,
+                          chave_dataset, estado_filtros)
 
-# Filtrar apenas alunos com mais de uma turma
-alunos_duplicados = alunos_turmas[alunos_turmas["Qtd_Turmas"] > 1].copy()
+# Seção: Identificação de Alunos em Múltiplas Turmas
+@fragmento
+def secao_alunos_duplicados(alunos_duplicados_futuros, df_filt, coluna_aluno):
+    """Alunos em várias turmas e sua exportação."""
+    st.markdown("---")
+    st.markdown("""
+    <div style="background: linear-gradient(135deg, #dc2626, #ef4444); border-radius: 12px; padding: 25px; margin: 20px 0; box-shadow: 0 4px 15px rgba(220, 38, 38, 0.2);">
+        <h2 style="color: white; text-align: center; margin: 0; font-size: 1.7em; font-weight: 700; text-shadow: 0 1px 3px rgba(0,0,0,0.3);">🔍 Identificação de Alunos Duplicados</h2>
+        <p style="color: rgba(255,255,255,0.9); text-align: center; margin: 8px 0 0 0; font-size: 1.1em; font-weight: 500;">Detecção de alunos que aparecem em múltiplas turmas</p>
+    </div>
+    """, unsafe_allow_html=True)
 
-if len(alunos_duplicados) > 0:
-    # Criar dataframe detalhado com todas as turmas de cada aluno duplicado
-    alunos_detalhados = []
-    
-    for _, row in alunos_duplicados.iterrows():
-        aluno = row[coluna_aluno]
-        qtd_turmas = row["Qtd_Turmas"]
+    # Identificar alunos em múltiplas turmas (uma coluna por turma)
+    alunos_duplicados = _aguardar(alunos_duplicados_futuros, "Procurando alunos em várias turmas...")
+
+    if len(alunos_duplicados) > 0:
+        # Tabela da tela: todas as turmas de cada aluno duplicado em uma única coluna
+        colunas_turma = [c for c in alunos_duplicados.columns if c.startswith("Turma_")]
+        turmas_str = alunos_duplicados[colunas_turma[0]].astype(str)
+        for c in colunas_turma[1:]:
+            tem_turma = alunos_duplicados[c].notna()
+            turmas_str = turmas_str.where(~tem_turma, turmas_str + ", " + alunos_duplicados[c].astype(str))
+        colunas_aluno = [c for c in alunos_duplicados.columns if not c.startswith("Turma_")]
+        df_alunos_duplicados = alunos_duplicados[colunas_aluno].assign(Turmas=turmas_str)
+        
+        # Função para colorir quantidade de turmas
+        def color_qtd_turmas(val):
+            if val == 2:
+                return "background-color: #fef3c7; color: #92400e"  # Amarelo para duplicidade
+            elif val == 3:
+                return "background-color: #fed7aa; color: #9a3412"  # Laranja para triplicidade
+            elif val >= 4:
+                return "background-color: #fecaca; color: #991b1b"  # Vermelho para 4+ turmas
+            else:
+                return ""
         
-        # Obter todas as turmas deste aluno
-        turmas_aluno = df_filt[df_filt[coluna_aluno] == aluno]["Turma"].unique().tolist()
-        turmas_str = ", ".join(sorted(turmas_aluno))
+        # Aplicar cores
+        styled_duplicados = _style_apply_cells(df_alunos_duplicados, color_qtd_turmas, ["Qtd_Turmas"])
         
-        alunos_detalhados.append({
-            coluna_aluno: aluno,
-            "Qtd_Turmas": qtd_turmas,
-            "Turmas": turmas_str
-        })
-    
-    df_alunos_duplicados = pd.DataFrame(alunos_detalhados)
-    df_alunos_duplicados = df_alunos_duplicados.sort_values(["Qtd_Turmas", coluna_aluno], ascending=[False, True])
-    
-    # Função para colorir quantidade de turmas
-    def color_qtd_turmas(val):
-        if val == 2:
-            return "background-color: #fef3c7; color: #92400e"  # Amarelo para duplicidade
-        elif val == 3:
-            return "background-color: #fed7aa; color: #9a3412"  # Laranja para triplicidade
-        elif val >= 4:
-            return "background-color: #fecaca; color: #991b1b"  # Vermelho para 4+ turmas
-        else:
-            return ""
-    
-    # Aplicar cores
-    styled_duplicados = _style_apply_cells(df_alunos_duplicados, color_qtd_turmas, ["Qtd_Turmas"])
-    
-    st.dataframe(styled_duplicados, use_container_width=True)
-    
-    # Métricas resumidas
-    col_dup1, col_dup2, col_dup3 = st.columns(3)
-    
-    with col_dup1:
-        total_duplicados = len(df_alunos_duplicados)
-        st.metric(
-            label="Total de Alunos Duplicados", 
-            value=total_duplicados,
-            help="Alunos que aparecem em mais de uma turma"
-        )
-    
-    with col_dup2:
-        duplicidade = len(df_alunos_duplicados[df_alunos_duplicados["Qtd_Turmas"] == 2])
-        st.metric(
-            label="Duplicidade (2 turmas)", 
-            value=duplicidade,
-            help="Alunos que aparecem em exatamente 2 turmas"
-        )
-    
-    with col_dup3:
-        triplicidade_mais = len(df_alunos_duplicados[df_alunos_duplicados["Qtd_Turmas"] >= 3])
-        st.metric(
-            label="Triplicidade+ (3+ turmas)", 
-            value=triplicidade_mais,
-            help="Alunos que aparecem em 3 ou mais turmas"
-        )
-    
-    # Botão de exportação
-    col_export_dup1, col_export_dup2 = st.columns([1, 4])
-    with col_export_dup1:
-        if st.button("📊 Exportar Duplicados", key="export_duplicados", help="Baixar planilha com alunos em múltiplas turmas"):
-            # Criar formato com colunas separadas para cada turma
-            export_data = []
-            for _, row in df_alunos_duplicados.iterrows():
-                aluno = row[coluna_aluno]
-                qtd_turmas = row["Qtd_Turmas"]
-                turmas_aluno = df_filt[df_filt[coluna_aluno] == aluno]["Turma"].unique().tolist()
-                turmas_aluno = sorted(turmas_aluno)
-                
-                # Criar linha com colunas separadas
-                linha = {
-                    coluna_aluno: aluno,
-                    "Qtd_Turmas": qtd_turmas
-                }
-                
-                # Adicionar cada turma em uma coluna separada
-                for i, turma in enumerate(turmas_aluno, 1):
-                    linha[f"Turma_{i}"] = turma
-                
-                # Preencher colunas vazias com None para alunos com menos turmas
-                max_turmas = df_alunos_duplicados["Qtd_Turmas"].max()
-                for i in range(len(turmas_aluno) + 1, max_turmas + 1):
-                    linha[f"Turma_{i}"] = None
-                
-                export_data.append(linha)
-            
-            df_export = pd.DataFrame(export_data)
-            excel_data = criar_excel_formatado(df_export, "Alunos_Duplicados")
-            st.download_button(
-                label="Baixar Excel",
-                data=excel_data,
-                file_name="alunos_duplicados.xlsx",
-                mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+        st.dataframe(styled_duplicados, use_container_width=True)
+        
+        # Métricas resumidas
+        col_dup1, col_dup2, col_dup3 = st.columns(3)
+        
+        with col_dup1:
+            total_duplicados = len(df_alunos_duplicados)
+            st.metric(
+                label="Total de Alunos Duplicados", 
+                value=total_duplicados,
+                help="Alunos que aparecem em mais de uma turma"
             )
-    
-    # Legenda
-    st.markdown("### Legenda de Cores")
-    col_leg_dup1, col_leg_dup2, col_leg_dup3 = st.columns(3)
-    with col_leg_dup1:
-        st.markdown("""
-        **2 turmas**: Duplicidade (amarelo)  
-        **3 turmas**: Triplicidade (laranja)
-        """)
-    with col_leg_dup2:
-        st.markdown("""
-        **4+ turmas**: Múltiplas turmas (vermelho)  
-        **Ação**: Verificar dados
-        """)
-    with col_leg_dup3:
-        st.markdown("""
-        **Possíveis causas**:  
-        • Erro de digitação  
-        • Transferência não registrada
+        
+        with col_dup2:
+            duplicidade = len(df_alunos_duplicados[df_alunos_duplicados["Qtd_Turmas"] == 2])
+            st.metric(
+                label="Duplicidade (2 turmas)", 
+                value=duplicidade,
+                help="Alunos que aparecem em exatamente 2 turmas"
+            )
+        
+        with col_dup3:
+            triplicidade_mais = len(df_alunos_duplicados[df_alunos_duplicados["Qtd_Turmas"] >= 3])
+            st.metric(
+                label="Triplicidade+ (3+ turmas)", 
+                value=triplicidade_mais,
+                help="Alunos que aparecem em 3 ou mais turmas"
+            )
+        
+        # Botão de exportação
+        col_export_dup1, col_export_dup2 = st.columns([1, 4])
+        with col_export_dup1:
+            if st.button("📊 Exportar Duplicados", key="export_duplicados", help="Baixar planilha com alunos em múltiplas turmas"):
+                # Formato com colunas separadas para cada turma
+                df_export = alunos_duplicados
+                botoes_download(df_export, "Alunos_Duplicados", "alunos_duplicados.xlsx")
+        
+        # Legenda
+        st.markdown("### Legenda de Cores")
+        col_leg_dup1, col_leg_dup2, col_leg_dup3 = st.columns(3)
+        with col_leg_dup1:
+            st.markdown("""
+            **2 turmas**: Duplicidade (amarelo)  
+            **3 turmas**: Triplicidade (laranja)
+            """)
+        with col_leg_dup2:
+            st.markdown("""
+            **4+ turmas**: Múltiplas turmas (vermelho)  
+            **Ação**: Verificar dados
+            """)
+        with col_leg_dup3:
+            st.markdown("""
+            **Possíveis causas**:  
+            • Erro de digitação  
+            • Transferência não registrada
+            """)
+        
+        # Aviso importante
+        st.warning("""
+        ⚠️ **Atenção**: Alunos em múltiplas turmas podem indicar:
+        - Erros de digitação nos dados
+        - Transferências não registradas adequadamente
+        - Inconsistências na base de dados
+        
+        Recomenda-se verificar e corrigir essas situações.
         """)
-    
-    # Aviso importante
-    st.warning("""
-    ⚠️ **Atenção**: Alunos em múltiplas turmas podem indicar:
-    - Erros de digitação nos dados
-    - Transferências não registradas adequadamente
-    - Inconsistências na base de dados
-    
-    Recomenda-se verificar e corrigir essas situações.
-    """)
-    
-else:
-    st.success("✅ **Excelente!** Não foram encontrados alunos em múltiplas turmas. Os dados estão consistentes.")
-    
-    # Mostrar estatística geral
-    col_stats1, col_stats2 = st.columns(2)
-    with col_stats1:
-        total_alunos_unicos = df_filt[coluna_aluno].nunique()
-        st.metric("Total de Alunos Únicos", total_alunos_unicos, help="Número total de alunos únicos nos dados filtrados")
-    
-    with col_stats2:
-        total_turmas = df_filt["Turma"].nunique()
-        st.metric("Total de Turmas", total_turmas, help="Número total de turmas nos dados filtrados")
+        
+    else:
+        st.success("✅ **Excelente!** Não foram encontrados alunos em múltiplas turmas. Os dados estão consistentes.")
+        
+        # Mostrar estatística geral
+        col_stats1, col_stats2 = st.columns(2)
+        with col_stats1:
+            total_alunos_unicos = df_filt[coluna_aluno].nunique()
+            st.metric("Total de Alunos Únicos", total_alunos_unicos, help="Número total de alunos únicos nos dados filtrados")
+        
+        with col_stats2:
+            total_turmas = df_filt["Turma"].nunique()
+            st.metric("Total de Turmas", total_turmas, help="Número total de turmas nos dados filtrados")
+
+secao_alunos_duplicados(alunos_duplicados_futuros, df_filt, coluna_aluno)
 
 # Assinatura discreta do criador
 st.markdown("---")
@@ -0,0 +1,104 @@
+"""
+Micro-benchmark de calcula_indicadores em escala regional.
+
+Gera uma base sintética com N pares aluno-disciplina (padrão: 1 milhão, 2 bimestres cada)
+e mede o custo por linha da classificação vetorizada contra a versão linha a linha
+(uma chamada Python por aluno-disciplina), além do calcula_indicadores completo.
+
+Uso:
+    python benchmark_indicadores.py [pares_aluno_disciplina]
+
+O resultado é impresso e gravado em bench_output.txt.
+"""
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+from processamento_planilhas import (
+    MEDIA_APROVACAO,
+    aplicar_esquema_notas_frequencia,
+    calcula_indicadores,
+    classificar_status_b1_b2,
+)
+
+
+def _classificar_linha(n1, n2):
+    """Regra antiga, avaliada uma vez por aluno-disciplina (referência do benchmark)."""
+    if pd.isna(n1) or pd.isna(n2):
+        return "Incompleto"
+    if n1 < MEDIA_APROVACAO and n2 < MEDIA_APROVACAO:
+        return "Vermelho Duplo"
+    if n1 >= MEDIA_APROVACAO and n2 < MEDIA_APROVACAO:
+        return "Queda p/ Vermelho"
+    if n1 < MEDIA_APROVACAO and n2 >= MEDIA_APROVACAO:
+        return "Recuperou"
+    return "Verde"
+
+
+def gerar_base(pares, seed=42):
+    """Base de notas com 2 bimestres por aluno-disciplina (~5% das notas ausentes)."""
+    rng = np.random.default_rng(seed)
+    disciplinas = 10
+    alunos = pares // disciplinas
+    aluno = np.repeat(np.arange(alunos), disciplinas)
+    disciplina = np.tile(np.arange(disciplinas), alunos)
+    turma = aluno // 35
+    escola = turma // 20
+    linhas = len(aluno)
+    notas = np.round(rng.uniform(0, 10, size=2 * linhas), 1)
+    notas[rng.random(2 * linhas) < 0.05] = np.nan
+    df = pd.DataFrame({
+        "Escola": np.tile([f"Escola {e:04d}" for e in escola], 2),
+        "Turma": np.tile([f"Turma {t:05d}" for t in turma], 2),
+        "Aluno": np.tile([f"ALUNO {a:07d}" for a in aluno], 2),
+        "Periodo": np.repeat(["Primeiro Bimestre", "Segundo Bimestre"], linhas),
+        "Disciplina": np.tile([f"Disciplina {d:02d}" for d in disciplina], 2),
+        "Nota": notas,
+    })
+    return aplicar_esquema_notas_frequencia(df)
+
+
+def _cronometrar(funcao, repeticoes=3):
+    melhor = float("inf")
+    for _ in range(repeticoes):
+        inicio = time.perf_counter()
+        funcao()
+        melhor = min(melhor, time.perf_counter() - inicio)
+    return melhor
+
+
+def main():
+    pares = int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000
+    linhas_saida = []
+
+    def relatar(texto):
+        print(texto)
+        linhas_saida.append(texto)
+
+    inicio = time.perf_counter()
+    df = gerar_base(pares)
+    relatar(f"Base sintética: {len(df):,} linhas de notas, gerada em {time.perf_counter() - inicio:.1f} s")
+
+    indic = calcula_indicadores(df)
+    n1 = indic["N1"].to_numpy()
+    n2 = indic["N2"].to_numpy()
+    total = len(indic)
+    relatar(f"Pares aluno-disciplina: {total:,}")
+
+    t_linha = _cronometrar(lambda: [_classificar_linha(a, b) for a, b in zip(n1, n2)], repeticoes=1)
+    t_vetor = _cronometrar(lambda: classificar_status_b1_b2(n1, n2))
+    relatar(f"Classificação linha a linha: {t_linha:.3f} s ({t_linha / total * 1e9:.0f} ns/linha)")
+    relatar(f"Classificação vetorizada:    {t_vetor:.3f} s ({t_vetor / total * 1e9:.0f} ns/linha)")
+    relatar(f"Ganho na classificação: {t_linha / t_vetor:.1f}x")
+
+    t_total = _cronometrar(lambda: calcula_indicadores(df), repeticoes=1)
+    relatar(f"calcula_indicadores completo: {t_total:.2f} s ({t_total / total * 1e9:.0f} ns/par aluno-disciplina)")
+
+    with open("bench_output.txt", "w", encoding="utf-8") as f:
+        f.write("\n".join(linhas_saida) + "\n")
+
+
+if __name__ == "__main__":
+    main()
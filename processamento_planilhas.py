@@ -0,0 +1,2142 @@
+"""
+Leitura e normalização das planilhas exportadas do SGE.
+
+Módulo sem dependência do Streamlit: pode ser importado pelos processos do pool
+que processam vários arquivos em paralelo sem executar a interface do painel.
+"""
+import hashlib
+import json
+import multiprocessing
+import os
+import re
+import tempfile
+import time
+import zipfile
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from datetime import datetime
+from difflib import SequenceMatcher
+from io import BytesIO, TextIOWrapper
+
+import numpy as np
+import openpyxl
+import pandas as pd
+
+# Parquet para o cache em disco das planilhas processadas (opcional)
+try:
+    import pyarrow  # noqa: F401
+    PARQUET_AVAILABLE = True
+except ImportError:
+    PARQUET_AVAILABLE = False
+
+
+# -----------------------------
+# Detecção e leitura
+# -----------------------------
+def detectar_tipo_planilha(df):
+    """
+    Detecta automaticamente o tipo de planilha baseado nas colunas disponíveis
+    (aceita o DataFrame ou apenas a lista de nomes de colunas do cabeçalho)
+    Retorna: 'notas_frequencia', 'conteudo_aplicado' ou 'censo_escolar'
+    """
+    nomes = df.columns if hasattr(df, "columns") else df
+    colunas = [str(col).lower().strip() for col in nomes]
+
+    # Verificar se é planilha de censo escolar
+    censo_indicators = [
+        'código', 'superv', 'convên', 'entidade', 'inep', 'situação', 'classific',
+        'nome', 'endereço', 'bairro', 'distrito', 'cep', 'cnpj', 'telefone', 'email',
+        'nível de', 'categoria', 'tipo de estrutura', 'etapas', 'ano letivo', 'calendário',
+        'curso', 'avaliação', 'conceito', 'servidor', 'turno', 'horário', 'tempo',
+        'média', 'salário', 'língua', 'professor', 'área de cargo', 'data na', 'cpf'
+    ]
+
+    # Verificar se é planilha de conteúdo aplicado
+    conteudo_indicators = [
+        'componente curricu', 'atividade/conteúdo', 'situação', 'data', 'horário'
+    ]
+
+    # Verificar se é planilha de notas/frequência
+    notas_indicators = [
+        'aluno', 'nota', 'frequencia', 'turma', 'escola', 'disciplina', 'periodo'
+    ]
+
+    censo_score = sum(1 for indicator in censo_indicators
+                      if any(indicator in col for col in colunas))
+    conteudo_score = sum(1 for indicator in conteudo_indicators
+                         if any(indicator in col for col in colunas))
+    notas_score = sum(1 for indicator in notas_indicators
+                      if any(indicator in col for col in colunas))
+
+    # Se tem mais indicadores de censo escolar, é esse tipo
+    if censo_score >= 8:
+        return 'censo_escolar'
+    elif conteudo_score >= 3:
+        return 'conteudo_aplicado'
+    elif notas_score >= 3:
+        return 'notas_frequencia'
+    else:
+        # Se não conseguir detectar claramente, assume notas/frequência como padrão
+        return 'notas_frequencia'
+
+# Planilhas de notas/frequência acima deste tamanho são lidas em blocos (memória limitada)
+LIMITE_LEITURA_EM_BLOCOS_MB = 5
+TAMANHO_BLOCO_LEITURA = 20000
+
+
+def _abrir_planilha_somente_leitura(arquivo, sheet=None):
+    """Abre o workbook em modo read-only (linhas lidas sob demanda, sem carregar tudo)."""
+    if hasattr(arquivo, "seek"):
+        arquivo.seek(0)
+    wb = openpyxl.load_workbook(arquivo, read_only=True, data_only=True)
+    ws = wb[sheet] if sheet else wb.worksheets[0]
+    return wb, ws
+
+
+def _nomes_colunas_cabecalho(valores):
+    """Nomes de colunas como o pd.read_excel: vazios viram 'Unnamed: i', repetidos ganham '.1', '.2'..."""
+    nomes = []
+    vistos = {}
+    for i, valor in enumerate(valores):
+        nome = f"Unnamed: {i}" if valor is None or str(valor).strip() == "" else str(valor)
+        if nome in vistos:
+            vistos[nome] += 1
+            nome = f"{nome}.{vistos[nome]}"
+        else:
+            vistos[nome] = 0
+        nomes.append(nome)
+    return nomes
+
+
+def ler_planilha_em_blocos(arquivo, sheet=None, tamanho_bloco=TAMANHO_BLOCO_LEITURA, usecols=None):
+    """
+    Lê a planilha linha a linha (openpyxl read-only) e gera blocos de DataFrame.
+    Cada item é (bloco, linhas_lidas, total_linhas); total_linhas pode ser None.
+    usecols: conjunto de nomes de coluna (sem espaços nas pontas) a manter; None = todas.
+    """
+    wb, ws = _abrir_planilha_somente_leitura(arquivo, sheet)
+    try:
+        linhas = ws.iter_rows(values_only=True)
+        cabecalho = next(linhas, None)
+        if cabecalho is None:
+            return
+        colunas = _nomes_colunas_cabecalho(cabecalho)
+        n_colunas = len(colunas)
+        manter = None
+        if usecols is not None:
+            manter = [i for i, c in enumerate(colunas) if c.strip() in usecols]
+            colunas = [colunas[i] for i in manter]
+        total_linhas = ws.max_row - 1 if ws.max_row else None
+
+        def _montar_bloco(registros):
+            bloco = pd.DataFrame.from_records(registros, columns=colunas)
+            # Células vazias chegam como None; o read_excel entrega NaN
+            for col in bloco.columns[bloco.dtypes == object]:
+                bloco[col] = bloco[col].where(bloco[col].notna(), np.nan)
+            return bloco
+
+        registros = []
+        linhas_lidas = 0
+        for linha in linhas:
+            linhas_lidas += 1
+            if all(v is None for v in linha):
+                continue
+            if len(linha) != n_colunas:
+                linha = (tuple(linha) + (None,) * n_colunas)[:n_colunas]
+            if manter is not None:
+                linha = [linha[i] for i in manter]
+            registros.append(linha)
+            if len(registros) >= tamanho_bloco:
+                yield _montar_bloco(registros), linhas_lidas, total_linhas
+                registros = []
+        if registros:
+            yield _montar_bloco(registros), linhas_lidas, total_linhas
+    finally:
+        wb.close()
+
+
+def _acumular_bloco(buffers, bloco):
+    """
+    Acrescenta as colunas de um bloco já processado aos buffers por coluna.
+    Colunas numéricas/datas guardam o array do bloco; colunas de texto guardam
+    códigos int32 de um dicionário compartilhado (cada texto repetido é guardado uma vez).
+    """
+    for col in bloco.columns:
+        serie = bloco[col]
+        buf = buffers.setdefault(col, {"partes": [], "dicionario": {}})
+        if (
+            pd.api.types.is_numeric_dtype(serie)
+            or pd.api.types.is_datetime64_any_dtype(serie)
+        ) and not pd.api.types.is_bool_dtype(serie):
+            buf["partes"].append(("valores", serie.to_numpy()))
+            continue
+        codigos_locais, unicos = pd.factorize(serie.to_numpy(dtype=object))
+        dicionario = buf["dicionario"]
+        mapa = np.array([dicionario.setdefault(v, len(dicionario)) for v in unicos], dtype=np.int32)
+        codigos = np.full(len(codigos_locais), -1, dtype=np.int32)
+        validos = codigos_locais >= 0
+        codigos[validos] = mapa[codigos_locais[validos]]
+        buf["partes"].append(("codigos", codigos))
+
+
+def _montar_dataframe_dos_buffers(buffers):
+    """Concatena os buffers por coluna em um único DataFrame (texto decodificado sem cópias por linha)."""
+    colunas = {}
+    for col, buf in buffers.items():
+        partes = buf["partes"]
+        if all(tipo == "valores" for tipo, _ in partes):
+            colunas[col] = np.concatenate([arr for _, arr in partes]) if partes else np.array([])
+            continue
+        valores_dic = np.empty(len(buf["dicionario"]) + 1, dtype=object)
+        valores_dic[:-1] = list(buf["dicionario"])
+        valores_dic[-1] = np.nan  # código -1 (vazio) aponta para a última posição
+        pedacos = [
+            valores_dic[arr] if tipo == "codigos" else arr.astype(object)
+            for tipo, arr in partes
+        ]
+        colunas[col] = np.concatenate(pedacos)
+        buffers[col] = None  # libera os códigos assim que a coluna é montada
+    return pd.DataFrame(colunas)
+
+
+def carregar_notas_frequencia_em_blocos(arquivo, sheet=None, progresso=None, usecols=None):
+    """
+    Caminho de leitura com memória limitada para planilhas grandes de notas/frequência:
+    cada bloco é normalizado por processar_notas_frequencia assim que chega e
+    acumulado em buffers por coluna. progresso(linhas_lidas, total_linhas) é opcional.
+    """
+    buffers = {}
+    relatorios = []
+    for bloco, linhas_lidas, total_linhas in ler_planilha_em_blocos(arquivo, sheet, usecols=usecols):
+        bloco.columns = [c.strip() for c in bloco.columns]
+        processado = processar_notas_frequencia(bloco)
+        relatorios.append(processado.attrs.get('qualidade'))
+        _acumular_bloco(buffers, processado)
+        if progresso:
+            progresso(linhas_lidas, total_linhas)
+    df = _montar_dataframe_dos_buffers(buffers)
+    df.attrs['tipo_planilha'] = 'notas_frequencia'
+    df.attrs['qualidade'] = somar_qualidade(relatorios)
+    return df
+
+
+# Colunas lidas de cada tipo de planilha (None = todas, pois a interface exibe os dados brutos)
+COLUNAS_NOTAS_FREQUENCIA = {
+    "Escola", "Turma", "Turno", "Status", "Aluno", "Nome_Estudante", "Estudante",
+    "Periodo", "Período", "Disciplina", "Nota", "Falta",
+    "Frequencia", "Frequência", "Frequencia Anual", "Frequência Anual", "Composicao",
+}
+COLUNAS_POR_TIPO = {
+    'notas_frequencia': COLUNAS_NOTAS_FREQUENCIA,
+    'conteudo_aplicado': None,
+    'censo_escolar': None,
+}
+
+
+class PlanilhaNaoReconhecida(ValueError):
+    """Arquivo enviado não corresponde a nenhum dos relatórios do SGE suportados."""
+
+
+def ler_cabecalhos_planilha(origem):
+    """Lê apenas a primeira linha de cada aba: {nome_da_aba: [colunas]}."""
+    wb = None
+    try:
+        if hasattr(origem, "seek"):
+            origem.seek(0)
+        wb = openpyxl.load_workbook(origem, read_only=True, data_only=True)
+        cabecalhos = {}
+        for ws in wb.worksheets:
+            primeira = next(ws.iter_rows(max_row=1, values_only=True), None)
+            cabecalhos[ws.title] = [c.strip() for c in _nomes_colunas_cabecalho(primeira or ())]
+        return cabecalhos
+    except (OSError, KeyError, ValueError, zipfile.BadZipFile) as e:
+        if isinstance(e, FileNotFoundError):
+            raise
+        raise PlanilhaNaoReconhecida(
+            "Não foi possível abrir o arquivo como planilha Excel (.xlsx). "
+            "Verifique se é a exportação original do SGE."
+        ) from e
+    finally:
+        if wb is not None:
+            wb.close()
+
+
+def identificar_planilha(colunas):
+    """
+    Decide o processador pelo cabeçalho, antes de ler as linhas.
+    Retorna o tipo de planilha ou levanta PlanilhaNaoReconhecida com uma mensagem clara.
+    """
+    if not colunas or all(c.startswith("Unnamed: ") for c in colunas):
+        raise PlanilhaNaoReconhecida("A planilha está vazia ou não tem linha de cabeçalho.")
+    tipo = detectar_tipo_planilha(colunas)
+    if tipo == 'notas_frequencia':
+        presentes = set(colunas)
+        obrigatorias = {
+            "Escola": {"Escola"},
+            "Turma": {"Turma"},
+            "Aluno": {"Aluno", "Nome_Estudante", "Estudante"},
+            "Período": {"Periodo", "Período"},
+            "Disciplina": {"Disciplina"},
+            "Nota": {"Nota"},
+        }
+        faltando = [nome for nome, opcoes in obrigatorias.items() if not presentes & opcoes]
+        if faltando:
+            raise PlanilhaNaoReconhecida(
+                "A planilha não parece ser um relatório do SGE (notas/frequência, censo escolar "
+                f"ou conteúdo aplicado). Colunas obrigatórias ausentes: {', '.join(faltando)}."
+            )
+    return tipo
+
+
+def processar_planilha(origem, sheet=None, tamanho_mb=0.0, progresso=None):
+    """
+    Lê e processa a planilha (caminho ou arquivo em memória) conforme o tipo detectado.
+    O tipo é decidido só pelo cabeçalho; depois são lidas apenas as colunas que o
+    processador usa. Planilhas grandes de notas/frequência são lidas em blocos.
+    """
+    cabecalhos = ler_cabecalhos_planilha(origem)
+    if sheet is not None and sheet not in cabecalhos:
+        raise PlanilhaNaoReconhecida(f"A aba '{sheet}' não existe na planilha.")
+    aba = sheet if sheet is not None else next(iter(cabecalhos), None)
+    tipo_planilha = identificar_planilha(cabecalhos.get(aba, []))
+    usecols = COLUNAS_POR_TIPO.get(tipo_planilha)
+
+    if tipo_planilha == 'notas_frequencia' and tamanho_mb > LIMITE_LEITURA_EM_BLOCOS_MB:
+        return aplicar_esquema_notas_frequencia(
+            carregar_notas_frequencia_em_blocos(origem, sheet, progresso, usecols)
+        )
+
+    if hasattr(origem, "seek"):
+        origem.seek(0)
+    filtro_colunas = (lambda c: str(c).strip() in usecols) if usecols is not None else None
+    df = pd.read_excel(origem, sheet_name=sheet or 0, usecols=filtro_colunas)
+
+    # Normalizar nomes de colunas
+    df.columns = [c.strip() for c in df.columns]
+    
+    if tipo_planilha == 'conteudo_aplicado':
+        # Processar planilha de conteúdo aplicado
+        return processar_conteudo_aplicado(df)
+    elif tipo_planilha == 'censo_escolar':
+        # Processar planilha do censo escolar
+        return processar_censo_escolar(df)
+    else:
+        # Processar planilha de notas/frequência (padrão atual)
+        return aplicar_esquema_notas_frequencia(processar_notas_frequencia(df))
+
+
+# -----------------------------
+# Cache em disco das planilhas processadas
+# -----------------------------
+# Compartilhado entre sessões e reinícios; a chave é o hash do conteúdo enviado.
+PASTA_CACHE_PLANILHAS = os.getenv("PAINEL_CACHE_DIR", ".cache_planilhas")
+LIMITE_CACHE_PLANILHAS_MB = float(os.getenv("PAINEL_CACHE_MAX_MB", "500"))
+VERSAO_CACHE_PLANILHAS = 5  # incrementar quando o processamento mudar o resultado
+
+
+def _bytes_do_arquivo(arquivo):
+    if arquivo is None:
+        with open("dados.xlsx", "rb") as f:
+            return f.read()
+    if hasattr(arquivo, "getvalue"):
+        return arquivo.getvalue()
+    arquivo.seek(0)
+    return arquivo.read()
+
+
+def chave_conteudo_planilha(conteudo, sheet=None):
+    """Hash do conteúdo do arquivo (mais aba e versão do processamento)."""
+    h = hashlib.sha256(conteudo)
+    h.update(f"|{sheet}|v{VERSAO_CACHE_PLANILHAS}".encode("utf-8"))
+    return h.hexdigest()
+
+
+def _caminhos_cache_planilha(chave, pasta=PASTA_CACHE_PLANILHAS):
+    base = os.path.join(pasta, chave)
+    return f"{base}.json", f"{base}.parquet", f"{base}.pkl"
+
+
+def ler_cache_planilha(chave, pasta=PASTA_CACHE_PLANILHAS):
+    """Retorna o DataFrame processado guardado para a chave, ou None."""
+    caminho_meta, caminho_parquet, caminho_pkl = _caminhos_cache_planilha(chave, pasta)
+    if not os.path.exists(caminho_meta):
+        return None
+    try:
+        with open(caminho_meta, "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        if meta.get("formato") == "parquet":
+            caminho_dados = caminho_parquet
+            df = pd.read_parquet(caminho_dados)
+        else:
+            caminho_dados = caminho_pkl
+            df = pd.read_pickle(caminho_dados)
+        df.attrs.update(meta.get("attrs", {}))
+        # Marca como usado recentemente (ordem de descarte LRU)
+        agora = time.time()
+        os.utime(caminho_meta, (agora, agora))
+        os.utime(caminho_dados, (agora, agora))
+        return df
+    except Exception as e:
+        print(f"Cache de planilha ignorado ({chave[:12]}): {e}")
+        return None
+
+
+def _gravar_atomico(caminho, escrever):
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(caminho) or ".", suffix=".tmp")
+    os.close(fd)
+    try:
+        escrever(tmp)
+        os.replace(tmp, caminho)
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+
+
+def gravar_cache_planilha(chave, df, pasta=PASTA_CACHE_PLANILHAS):
+    """
+    Guarda o DataFrame processado (Parquet; pickle quando o Parquet não é possível).
+    Só a pasta padrão do cache tem descarte LRU; outras pastas guardam dados persistentes.
+    """
+    try:
+        os.makedirs(pasta, exist_ok=True)
+        caminho_meta, caminho_parquet, caminho_pkl = _caminhos_cache_planilha(chave, pasta)
+        formato = "pickle"
+        if PARQUET_AVAILABLE:
+            try:
+                _gravar_atomico(caminho_parquet, lambda tmp: df.to_parquet(tmp))
+                formato = "parquet"
+            except Exception:
+                pass  # colunas com tipos mistos, por exemplo
+        if formato == "pickle":
+            _gravar_atomico(caminho_pkl, lambda tmp: df.to_pickle(tmp))
+        meta = {"formato": formato, "attrs": dict(df.attrs), "gravado_em": datetime.now().isoformat()}
+
+        def _escrever_meta(tmp):
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump(meta, f, ensure_ascii=False, default=str)
+
+        _gravar_atomico(caminho_meta, _escrever_meta)
+        if pasta == PASTA_CACHE_PLANILHAS:
+            _limpar_cache_planilhas()
+    except Exception as e:
+        print(f"Não foi possível gravar o cache de planilha: {e}")
+
+
+def _limpar_cache_planilhas():
+    """Descarta as entradas usadas há mais tempo até o cache caber no limite."""
+    entradas = []
+    for nome in os.listdir(PASTA_CACHE_PLANILHAS):
+        if not nome.endswith(".json"):
+            continue
+        caminhos = [p for p in _caminhos_cache_planilha(nome[:-5]) if os.path.exists(p)]
+        try:
+            ultimo_uso = os.path.getmtime(caminhos[0])
+            tamanho = sum(os.path.getsize(p) for p in caminhos)
+        except (OSError, IndexError):
+            continue
+        entradas.append((ultimo_uso, tamanho, caminhos))
+    total = sum(tamanho for _, tamanho, _ in entradas)
+    limite = LIMITE_CACHE_PLANILHAS_MB * 1024 * 1024
+    for _, tamanho, caminhos in sorted(entradas, key=lambda e: e[0]):
+        if total <= limite:
+            break
+        for caminho in caminhos:
+            try:
+                os.remove(caminho)
+            except OSError:
+                pass
+        total -= tamanho
+
+
+# -----------------------------
+# Processamento por tipo de planilha
+# -----------------------------
+def processar_conteudo_aplicado(df):
+    """Processa planilha de conteúdo aplicado"""
+    # Mapear colunas para nomes padronizados
+    mapeamento_colunas = {}
+    
+    for col in df.columns:
+        col_lower = col.lower().strip()
+        if 'componente curricu' in col_lower:
+            mapeamento_colunas[col] = 'Disciplina'
+        elif 'atividade/conteúdo' in col_lower or 'atividade' in col_lower:
+            mapeamento_colunas[col] = 'Atividade'
+        elif 'situação' in col_lower:
+            mapeamento_colunas[col] = 'Status'
+        elif 'data' in col_lower:
+            mapeamento_colunas[col] = 'Data'
+        elif 'horário' in col_lower:
+            mapeamento_colunas[col] = 'Horario'
+    
+    df = df.rename(columns=mapeamento_colunas)
+    
+    # Converter Data para datetime se possível
+    if 'Data' in df.columns:
+        # Tentar diferentes formatos de data
+        df['Data'] = pd.to_datetime(df['Data'], format='%d/%m/%Y', errors='coerce')
+        # Se não funcionar, tentar formato automático
+        if df['Data'].isna().all():
+            df['Data'] = pd.to_datetime(df['Data'], errors='coerce')
+    
+    # Padronizar texto dos campos principais
+    for col in ['Disciplina', 'Atividade', 'Status']:
+        if col in df.columns:
+            df[col] = df[col].astype(str).str.strip()
+    
+    # Adicionar tipo de planilha para identificação
+    df.attrs['tipo_planilha'] = 'conteudo_aplicado'
+    
+    return df
+
+def processar_notas_frequencia(df):
+    """Processa planilha de notas/frequência (processamento atual)"""
+    # Garantir colunas esperadas (flexível aos nomes encontrados)
+    # Esperados: Escola, Turma, Turno, Aluno, Periodo, Disciplina, Nota, Falta, Frequência, Frequência Anual
+    # Algumas planilhas têm "Período" com acento; vamos padronizar para "Periodo"
+    if "Período" in df.columns and "Periodo" not in df.columns:
+        df = df.rename(columns={"Período": "Periodo"})
+    if "Frequência" in df.columns and "Frequencia" not in df.columns:
+        df = df.rename(columns={"Frequência": "Frequencia"})
+    if "Frequência Anual" in df.columns and "Frequencia Anual" not in df.columns:
+        df = df.rename(columns={"Frequência Anual": "Frequencia Anual"})
+    
+    # Detectar se é planilha do tipo "AtaMapa" (tem coluna "Estudante" e "Composicao")
+    # Para este tipo de planilha, filtrar apenas primeiro e segundo bimestre
+    is_atamapa = "Estudante" in df.columns and "Composicao" in df.columns
+
+    # Relatório de qualidade montado na mesma passada da conversão
+    qualidade = {}
+    if "Periodo" in df.columns:
+        qualidade["periodos_vazios"] = int(_texto_vazio(df["Periodo"]).sum())
+    
+    if is_atamapa and "Periodo" in df.columns:
+        # Normalizar valores de período para comparação (já feito acima, mas garantir)
+        df["Periodo"] = df["Periodo"].astype(str).str.strip()
+        # Filtrar apenas primeiro e segundo bimestre usando a mesma lógica de mapear_bimestre
+        df = df[bimestre_do_periodo(df["Periodo"]).isin([1, 2])].copy()
+
+    # Converter Nota (vírgula -> ponto, texto -> float)
+    if "Nota" in df.columns:
+        bruto = df["Nota"]
+        df["Nota"] = converter_numero_decimal(bruto)
+        falhas = bruto[df["Nota"].isna() & bruto.notna()]
+        invalidas = falhas[~_texto_vazio(falhas)]
+        qualidade["notas_invalidas"] = int(len(invalidas))
+        qualidade["exemplos_notas_invalidas"] = [str(v).strip() for v in pd.unique(invalidas.to_numpy())[:5]]
+        qualidade["notas_fora_0_10"] = int(((df["Nota"] < 0) | (df["Nota"] > 10)).sum())
+
+    # Falta -> numérico
+    if "Falta" in df.columns:
+        df["Falta"] = pd.to_numeric(df["Falta"], errors="coerce").fillna(0).astype(int)
+
+    # Frequências -> numérico
+    qualidade["frequencias_fora_0_100"] = 0
+    for col in ["Frequencia", "Frequencia Anual"]:
+        if col in df.columns:
+            df[col] = converter_numero_decimal(df[col])
+            qualidade["frequencias_fora_0_100"] += int(((df[col] < 0) | (df[col] > 100)).sum())
+
+    # Padronizar texto dos campos principais (evita diferenças por espaços)
+    for col in ["Escola", "Turma", "Turno", "Status", "Periodo", "Disciplina"]:
+        if col in df.columns:
+            df[col] = df[col].astype(str).str.strip()
+    
+    # Detectar coluna de aluno/estudante
+    coluna_aluno = None
+    for col in ["Aluno", "Nome_Estudante", "Estudante"]:
+        if col in df.columns:
+            coluna_aluno = col
+            break
+    
+    if coluna_aluno:
+        df[coluna_aluno] = df[coluna_aluno].astype(str).str.strip()
+    
+    # Adicionar tipo de planilha para identificação
+    df.attrs['tipo_planilha'] = 'notas_frequencia'
+    df.attrs['qualidade'] = qualidade
+    
+    return df
+
+
+def _texto_vazio(serie):
+    """Valores ausentes ou só com espaços (inclui o texto 'nan' de colunas já convertidas)."""
+    texto = serie.astype(str).str.strip()
+    return serie.isna() | texto.isin(["", "nan", "None"])
+
+
+def converter_numero_decimal(serie):
+    """
+    Converte para número aceitando vírgula decimal ("7,5") e espaços ("7, 5").
+    Valores que o Excel já entrega como número convertem direto; só os textos que
+    falham na primeira tentativa passam pela troca de vírgula.
+    """
+    valores = pd.to_numeric(serie, errors="coerce")
+    pendentes = valores.isna() & serie.notna()
+    if pendentes.any():
+        texto = (
+            serie[pendentes]
+            .astype(str)
+            .str.replace(",", ".", regex=False)
+            .str.replace(" ", "", regex=False)
+        )
+        valores = valores.astype("float64")
+        valores[pendentes] = pd.to_numeric(texto, errors="coerce")
+    return valores
+
+
+def somar_qualidade(relatorios):
+    """Soma relatórios de qualidade de blocos/arquivos (exemplos: até 5 valores distintos)."""
+    total = {}
+    for relatorio in relatorios:
+        for chave, valor in (relatorio or {}).items():
+            if isinstance(valor, list):
+                exemplos = total.setdefault(chave, [])
+                exemplos.extend(v for v in valor if v not in exemplos)
+                del exemplos[5:]
+            else:
+                total[chave] = total.get(chave, 0) + valor
+    return total
+
+
+def mapear_bimestre(periodo: str) -> int | None:
+    """Mapeia 'Primeiro Bimestre' -> 1, 'Segundo Bimestre' -> 2, etc."""
+    if not isinstance(periodo, str):
+        return None
+    p = periodo.lower()
+    if "primeiro" in p or "1º" in p or "1o" in p:
+        return 1
+    if "segundo" in p or "2º" in p or "2o" in p:
+        return 2
+    if "terceiro" in p or "3º" in p or "3o" in p:
+        return 3
+    if "quarto" in p or "4º" in p or "4o" in p:
+        return 4
+    return None
+
+
+def bimestre_do_periodo(serie_periodo):
+    """
+    Resolve a coluna Periodo em número do bimestre (int8; 0 = não identificado).
+    mapear_bimestre roda uma vez por valor distinto, não por linha.
+    """
+    codigos, unicos = pd.factorize(serie_periodo)
+    mapa = np.array([mapear_bimestre(u) or 0 for u in unicos] + [0], dtype=np.int8)
+    return pd.Series(mapa[codigos], index=serie_periodo.index, name="Bimestre")
+
+
+def _serie_bimestre(df):
+    """Coluna Bimestre calculada na carga (ou resolvida agora, se o DataFrame não a tiver)."""
+    if "Bimestre" in df.columns:
+        return df["Bimestre"]
+    return bimestre_do_periodo(df["Periodo"])
+
+
+# Colunas de texto repetidas em todas as linhas (poucos valores distintos) -> category
+COLUNAS_CATEGORICAS_NOTAS = [
+    "Escola", "Turma", "Turno", "Status", "Periodo", "Disciplina",
+    "Aluno", "Nome_Estudante", "Estudante", "Aba",
+]
+
+
+def aplicar_esquema_notas_frequencia(df):
+    """
+    Converte o DataFrame de notas/frequência para tipos compactos:
+    textos repetidos viram category (categorias em ordem alfabética, para que
+    ordenações e filtros deem o mesmo resultado do texto) e Falta vira int16.
+    Os tipos se mantêm nos recortes por filtro; agrupamentos usam observed=True.
+    Também grava a coluna Bimestre (int8), resolvida uma única vez a partir de Periodo,
+    e completa o relatório de qualidade com as linhas repetidas de (aluno, disciplina, período).
+    """
+    attrs = dict(df.attrs)
+    coluna_aluno = next((c for c in ["Aluno", "Nome_Estudante", "Estudante"] if c in df.columns), None)
+    if coluna_aluno and "Disciplina" in df.columns and "Periodo" in df.columns:
+        qualidade = dict(attrs.get('qualidade') or {})
+        qualidade["linhas_duplicadas"] = int(df.duplicated([coluna_aluno, "Disciplina", "Periodo"]).sum())
+        attrs['qualidade'] = qualidade
+    if "Periodo" in df.columns:
+        df["Bimestre"] = bimestre_do_periodo(df["Periodo"])
+    for col in COLUNAS_CATEGORICAS_NOTAS:
+        if col in df.columns and not isinstance(df[col].dtype, pd.CategoricalDtype):
+            df[col] = df[col].astype("category")
+    falta = df["Falta"] if "Falta" in df.columns else None
+    if falta is not None and len(df) and falta.notna().all() and falta.abs().max() <= np.iinfo(np.int16).max:
+        df["Falta"] = df["Falta"].astype("int16")
+    df.attrs.update(attrs)
+    return df
+
+
+def processar_censo_escolar(df):
+    """
+    Processa dados do Censo Escolar - Lista de Estudantes
+    """
+    # Normalizar nomes das colunas
+    df.columns = df.columns.str.strip()
+    
+    # Mapear colunas específicas da planilha ListaDeEstudantes_TurmaEscolarização
+    colunas_mapeadas = {}
+    for col in df.columns:
+        col_lower = col.lower()
+        if col == 'Nome':
+            colunas_mapeadas[col] = 'Nome_Estudante'
+        elif col == 'Escola':
+            colunas_mapeadas[col] = 'Escola'
+        elif col == 'CPF':
+            colunas_mapeadas[col] = 'CPF'
+        elif col == 'INEP':
+            colunas_mapeadas[col] = 'Codigo_Estudante'
+        elif col == 'Situação da Matrícula':
+            colunas_mapeadas[col] = 'Situacao'
+        elif col == 'Turno':
+            colunas_mapeadas[col] = 'Turno'
+        elif col == 'Data Nascimento':
+            colunas_mapeadas[col] = 'Data_Nascimento'
+        elif col == 'Nível de Ensino':
+            colunas_mapeadas[col] = 'Nivel_Educacao'
+        elif col == 'Ano/Série':
+            colunas_mapeadas[col] = 'Ano_Serie'
+        elif col == 'Descrição Turma':
+            colunas_mapeadas[col] = 'Turma'
+        elif col == 'Entidade Conveniada':
+            colunas_mapeadas[col] = 'Entidade'
+        elif col == 'Superintendência Regional':
+            colunas_mapeadas[col] = 'Supervisao'
+        elif col == 'Convênio':
+            colunas_mapeadas[col] = 'Convenio'
+        elif col == 'INEP da Escola':
+            colunas_mapeadas[col] = 'INEP_Escola'
+        elif col == 'Classificação da Escola':
+            colunas_mapeadas[col] = 'Classificacao'
+        elif col == 'Endereço':
+            colunas_mapeadas[col] = 'Endereco'
+        elif col == 'Bairro':
+            colunas_mapeadas[col] = 'Bairro'
+        elif col == 'Distrito':
+            colunas_mapeadas[col] = 'Distrito'
+        elif col == 'Cep':
+            colunas_mapeadas[col] = 'CEP'
+        elif col == 'Telefone Principal':
+            colunas_mapeadas[col] = 'Telefone'
+        elif col == 'E-mail':
+            colunas_mapeadas[col] = 'Email'
+        elif col == 'CNPJ':
+            colunas_mapeadas[col] = 'CNPJ'
+        elif col == 'Carga Horária':
+            colunas_mapeadas[col] = 'Carga_Horaria'
+        elif col == 'Entrada':
+            colunas_mapeadas[col] = 'Data_Entrada'
+        elif col == 'Data de saída':
+            colunas_mapeadas[col] = 'Data_Saida'
+        elif col == 'Cor/Raça':
+            colunas_mapeadas[col] = 'Cor_Raca'
+    
+    # Renomear colunas
+    df = df.rename(columns=colunas_mapeadas)
+    
+    # Converter tipos de dados
+    if 'Data_Nascimento' in df.columns:
+        df['Data_Nascimento'] = pd.to_datetime(df['Data_Nascimento'], dayfirst=True, errors='coerce')
+    
+    if 'Data_Entrada' in df.columns:
+        df['Data_Entrada'] = pd.to_datetime(df['Data_Entrada'], dayfirst=True, errors='coerce')
+    
+    if 'Data_Saida' in df.columns:
+        df['Data_Saida'] = pd.to_datetime(df['Data_Saida'], dayfirst=True, errors='coerce')
+    
+    # Padronizar texto dos campos principais
+    for col in ['Nome_Estudante', 'Escola', 'Situacao', 'Turno', 'Nivel_Educacao', 'Ano_Serie', 'Turma']:
+        if col in df.columns:
+            df[col] = df[col].astype(str).str.strip()
+    
+    # Marcar tipo de planilha
+    df.attrs['tipo_planilha'] = 'censo_escolar'
+    
+    return df
+
+
+# -----------------------------
+# Indicadores por aluno/disciplina
+# -----------------------------
+MEDIA_APROVACAO = 6.0
+MEDIA_FINAL_ALVO = 6.0   # média final desejada após 4 bimestres
+SOMA_FINAL_ALVO = MEDIA_FINAL_ALVO * 4  # 24 pontos no ano
+
+def classificar_status_b1_b2(n1, n2):
+    """
+    Classificação vetorizada (arrays ou Series de N1/N2). Regras:
+      - 'Vermelho Duplo': n1<6 e n2<6
+      - 'Queda p/ Vermelho': n1>=6 e n2<6
+      - 'Recuperou': n1<6 e n2>=6
+      - 'Verde': n1>=6 e n2>=6
+      - Se faltar n1 ou n2, retorna 'Incompleto'
+    """
+    n1 = np.asarray(n1, dtype="float64")
+    n2 = np.asarray(n2, dtype="float64")
+    incompleto = np.isnan(n1) | np.isnan(n2)
+    aprovado1 = n1 >= MEDIA_APROVACAO
+    aprovado2 = n2 >= MEDIA_APROVACAO
+    return np.select(
+        [incompleto, ~aprovado1 & ~aprovado2, aprovado1 & ~aprovado2, ~aprovado1 & aprovado2],
+        ["Incompleto", "Vermelho Duplo", "Queda p/ Vermelho", "Recuperou"],
+        default="Verde",
+    )
+
+
+def calcula_indicadores(df):
+    """
+    Cria um dataframe por Aluno-Disciplina com:
+      N1, N2, N3, N4, Media12, Soma12, ReqMediaProx2 (quanto precisa em média nos próximos 2 bimestres para fechar 6 no ano), Classificacao
+    """
+    # Bimestre já vem resolvido da carga; linhas sem bimestre identificado ficam de fora
+    df = df.assign(Bimestre=_serie_bimestre(df))
+    df = df[df["Bimestre"] > 0]
+
+    # Pivot por (Aluno, Turma, Disciplina)
+    # Detectar coluna de aluno/estudante
+    coluna_aluno = None
+    for col in ["Aluno", "Nome_Estudante", "Estudante"]:
+        if col in df.columns:
+            coluna_aluno = col
+            break
+    
+    pivot = df.pivot_table(
+        index=["Escola", "Turma", coluna_aluno, "Disciplina"],
+        columns="Bimestre",
+        values="Nota",
+        aggfunc="mean",
+        observed=True
+    ).reset_index()
+
+    # Renomear colunas 1..4 para N1..N4 (se existirem)
+    rename_cols = {}
+    for b in [1, 2, 3, 4]:
+        if b in pivot.columns:
+            rename_cols[b] = f"N{b}"
+    pivot = pivot.rename(columns=rename_cols)
+
+    # Métricas dos 2 primeiros bimestres (bimestre sem nenhuma nota = tudo NaN)
+    sem_nota = np.full(len(pivot), np.nan)
+    n1 = pivot["N1"].to_numpy(dtype="float64") if "N1" in pivot.columns else sem_nota
+    n2 = pivot["N2"].to_numpy(dtype="float64") if "N2" in pivot.columns else sem_nota
+
+    soma12 = np.nan_to_num(n1) + np.nan_to_num(n2)
+    pivot["Soma12"] = soma12
+    # Se um dos dois for NaN, a média 12 fica NaN (melhor do que assumir 0)
+    pivot["Media12"] = (n1 + n2) / 2
+
+    # Quanto precisa nos próximos dois bimestres (N3+N4) para fechar soma >= 24
+    precisa_somar = SOMA_FINAL_ALVO - soma12
+    req_media = precisa_somar / 2
+    pivot["PrecisaSomarProx2"] = precisa_somar
+    pivot["ReqMediaProx2"] = req_media
+
+    # Classificação b1-b2
+    classificacao = classificar_status_b1_b2(n1, n2)
+    pivot["Classificacao"] = classificacao
+
+    # Flags de alerta
+    # "Corda Bamba": precisa de média >= 7 nos próximos dois bimestres
+    corda_bamba = req_media >= 7
+    pivot["CordaBamba"] = corda_bamba
+
+    # "Alerta": qualquer Vermelho Duplo ou Queda p/ Vermelho ou Corda Bamba
+    pivot["Alerta"] = (classificacao == "Vermelho Duplo") | (classificacao == "Queda p/ Vermelho") | corda_bamba
+
+    return pivot
+
+
+def _codificar_dimensao(serie):
+    """Rótulos distintos + código inteiro por linha (usa os códigos da categoria quando houver)."""
+    if isinstance(serie.dtype, pd.CategoricalDtype):
+        return pd.Index(serie.cat.categories), serie.cat.codes.to_numpy()
+    codigos, rotulos = pd.factorize(serie)
+    return pd.Index(rotulos), codigos
+
+
+class CuboIndicadores:
+    """
+    Indicadores do dataset inteiro (calcula_indicadores), calculados uma vez por dataset.
+
+    Os filtros de escola, turma, disciplina e aluno recortam as linhas do cubo por máscara
+    sobre códigos inteiros, com o mesmo resultado de calcula_indicadores(df_filt).
+    O filtro de Status é por linha da planilha: grupos com um único status entram ou saem
+    inteiros; só os grupos com status misto são recalculados a partir das linhas filtradas.
+    """
+
+    def __init__(self, df, indicadores=None):
+        self.df = df
+        self.coluna_aluno = next((c for c in COLUNAS_ALUNO if c in df.columns), None)
+        self.chaves = ["Escola", "Turma", self.coluna_aluno, "Disciplina"]
+        self.indicadores = calcula_indicadores(df) if indicadores is None else indicadores
+        self._dimensoes = {col: _codificar_dimensao(self.indicadores[col]) for col in self.chaves}
+        self._status_grupo = None
+        if "Status" in df.columns:
+            self._preparar_status()
+
+    def _preparar_status(self):
+        """Código do Status de cada grupo do cubo (-2 = status misto) e grupo de cada linha do df."""
+        indice_cubo = pd.MultiIndex.from_frame(self.indicadores[self.chaves])
+        self._grupo_linha = indice_cubo.get_indexer(pd.MultiIndex.from_frame(self.df[self.chaves]))
+        self._rotulos_status, codigos = _codificar_dimensao(self.df["Status"])
+        validas = (self._grupo_linha >= 0) & (_serie_bimestre(self.df).to_numpy() > 0)
+        grupos = self._grupo_linha[validas]
+        minimo = np.full(len(indice_cubo), np.iinfo(np.int64).max)
+        maximo = np.full(len(indice_cubo), -1)
+        np.minimum.at(minimo, grupos, codigos[validas])
+        np.maximum.at(maximo, grupos, codigos[validas])
+        self._status_grupo = np.where(minimo == maximo, maximo, -2)
+
+    def _mascara(self, coluna, selecionados):
+        rotulos, codigos = self._dimensoes[coluna]
+        return np.isin(codigos, rotulos.get_indexer(selecionados))
+
+    def recortar(self, escola_sel="Todas", turma_sel=None, disc_sel=None, aluno_sel="Todos", status_sel=None):
+        """Linhas do cubo para os filtros da barra lateral (listas vazias = sem filtro)."""
+        mascara = np.ones(len(self.indicadores), dtype=bool)
+        if escola_sel != "Todas":
+            mascara &= self._mascara("Escola", [escola_sel])
+        if turma_sel:
+            mascara &= self._mascara("Turma", turma_sel)
+        if disc_sel:
+            mascara &= self._mascara("Disciplina", disc_sel)
+        if aluno_sel != "Todos":
+            mascara &= self._mascara(self.coluna_aluno, [aluno_sel])
+
+        recalculados = None
+        if status_sel and self._status_grupo is not None:
+            codigos_sel = self._rotulos_status.get_indexer(status_sel)
+            codigos_sel = codigos_sel[codigos_sel >= 0]
+            mistos = np.flatnonzero(mascara & (self._status_grupo == -2))
+            mascara &= np.isin(self._status_grupo, codigos_sel)
+            if len(mistos):
+                linhas = np.isin(self._grupo_linha, mistos) & self.df["Status"].isin(status_sel).to_numpy()
+                recalculados = calcula_indicadores(self.df[linhas])
+
+        recorte = self.indicadores[mascara]
+        if recalculados is not None and len(recalculados):
+            # Devolve os grupos recalculados na ordem do cubo (a mesma do pivot sobre df_filt)
+            indice_cubo = pd.MultiIndex.from_frame(self.indicadores[self.chaves])
+            posicoes = np.concatenate([
+                np.flatnonzero(mascara),
+                indice_cubo.get_indexer(pd.MultiIndex.from_frame(recalculados[self.chaves])),
+            ])
+            recorte = pd.concat([recorte, recalculados], ignore_index=True)
+            recorte = recorte.iloc[np.argsort(posicoes, kind="stable")]
+        recorte = recorte.reset_index(drop=True)
+        # O pivot do recorte não teria as colunas de bimestre sem nenhuma nota
+        vazias = [c for c in ("N1", "N2", "N3", "N4") if c in recorte.columns and recorte[c].isna().all()]
+        return recorte.drop(columns=vazias)
+
+
+# -----------------------------
+# Frequência por aluno
+# -----------------------------
+# Faixas de frequência: limites em % (crescentes) e um rótulo por faixa, da pior para a melhor.
+# Redes com outra regra de frequência trocam os valores num JSON com as mesmas chaves,
+# indicado em PAINEL_FAIXAS_FREQUENCIA, sem mexer no código.
+FAIXAS_FREQUENCIA_PADRAO = {
+    "limites": [75, 80, 90, 95],
+    "rotulos": ["Reprovado", "Alto Risco", "Risco Moderado", "Ponto de Atenção", "Meta Favorável"],
+    "sem_dados": "Sem dados",
+}
+
+
+def carregar_faixas_frequencia(caminho=None):
+    """Faixas padrão, sobrescritas pelo JSON em `caminho` (ou PAINEL_FAIXAS_FREQUENCIA), se houver."""
+    faixas = dict(FAIXAS_FREQUENCIA_PADRAO)
+    caminho = caminho or os.getenv("PAINEL_FAIXAS_FREQUENCIA")
+    if caminho:
+        with open(caminho, encoding="utf-8") as f:
+            faixas.update(json.load(f))
+    limites = [float(x) for x in faixas["limites"]]
+    rotulos = list(faixas["rotulos"])
+    if len(rotulos) != len(limites) + 1 or any(a >= b for a, b in zip(limites, limites[1:])):
+        raise ValueError(
+            "Faixas de frequência inválidas: os limites devem ser crescentes e deve haver um rótulo a mais que limites"
+        )
+    return {"limites": limites, "rotulos": rotulos, "sem_dados": str(faixas["sem_dados"])}
+
+
+FAIXAS_FREQUENCIA = carregar_faixas_frequencia()
+
+
+def descrever_faixas_frequencia(faixas=None):
+    """(rótulo, texto do intervalo) de cada faixa, ex.: ("Reprovado", "< 75%"), ..., ("Meta Favorável", "≥ 95%")."""
+    faixas = faixas or FAIXAS_FREQUENCIA
+    limites = faixas["limites"]
+    textos = [f"< {lim:g}%" for lim in limites] + [f"≥ {limites[-1]:g}%"]
+    return list(zip(faixas["rotulos"], textos))
+
+
+def classificar_frequencia_faixa(freq, faixas=None):
+    """
+    Classifica frequências (%) nas faixas de uma vez (searchsorted sobre o array).
+    Devolve um Categorical ordenado (Series com o mesmo índice, se a entrada for Series);
+    frequência ausente vira a categoria "Sem dados", a última.
+    """
+    faixas = faixas or FAIXAS_FREQUENCIA
+    valores = np.asarray(freq, dtype="float64")
+    categorias = faixas["rotulos"] + [faixas["sem_dados"]]
+    codigos = np.searchsorted(faixas["limites"], valores, side="right")
+    codigos[np.isnan(valores)] = len(categorias) - 1
+    classes = pd.Categorical.from_codes(codigos, categories=categorias, ordered=True)
+    if isinstance(freq, pd.Series):
+        return pd.Series(classes, index=freq.index, name=freq.name)
+    return classes
+
+
+def _codigos_agrupamento(serie):
+    """Códigos na ordem de groupby(sort=True) (nulos = -1) e a função que devolve os rótulos."""
+    if isinstance(serie.dtype, pd.CategoricalDtype):
+        return serie.cat.codes.to_numpy(), lambda c: pd.Categorical.from_codes(c, dtype=serie.dtype)
+    rotulos, codigos = _codigos_ordenados(serie)
+
+    def _rotulos(c):
+        valores = rotulos[c]
+        valores[c < 0] = np.nan
+        return pd.array(valores, dtype=serie.dtype)
+
+    return codigos, _rotulos
+
+
+def tabela_frequencia_alunos(df, col_aluno):
+    """
+    Tabela única de frequência por aluno/turma, montada em um só groupby sobre as linhas:
+      - Frequencia / Classificacao_Freq: Frequencia Anual (ou Frequencia) do último registro
+      - Frequencia_Bim1/Bim2 e classificações: média da coluna Frequencia no bimestre
+      - Faltas_1_Bimestre, Faltas_2_Bimestre, Faltas_Total_1e2_Bim (soma da coluna Falta)
+    As colunas com prefixo "_" guardam o necessário para consolidar por aluno
+    (frequencia_por_aluno) sem voltar às linhas. Turma nula fica em linhas próprias,
+    que só entram na visão por aluno.
+    """
+    if not col_aluno or col_aluno not in df.columns or "Turma" not in df.columns:
+        return None
+    col_anual = next((c for c in ("Frequencia Anual", "Frequencia") if c in df.columns), None)
+    tem_bim = "Periodo" in df.columns
+    tem_faltas = tem_bim and "Falta" in df.columns
+    tem_freq_bim = tem_bim and "Frequencia" in df.columns
+
+    codigos_aluno, rotulos_aluno = _codigos_agrupamento(df[col_aluno])
+    codigos_turma, rotulos_turma = _codigos_agrupamento(df["Turma"])
+    dados = {"_a": codigos_aluno, "_t": codigos_turma}
+    agregacoes = {}
+    if col_anual:
+        freq = pd.to_numeric(df[col_anual], errors="coerce").to_numpy(dtype="float64")
+        dados["_pos_anual"] = np.where(np.isnan(freq), -1, np.arange(len(df)))
+        agregacoes["_pos_anual"] = ("_pos_anual", "max")
+    if tem_bim:
+        bimestre = _serie_bimestre(df).to_numpy()
+        freq_linha = df["Frequencia"].to_numpy(dtype="float64") if tem_freq_bim else None
+        # Falta é guardada em int16; soma em int64 para não estourar o tipo compacto
+        falta = (
+            pd.to_numeric(df["Falta"], errors="coerce").fillna(0).to_numpy(dtype="int64")
+            if tem_faltas else None
+        )
+        for b in (1, 2):
+            no_bim = bimestre == b
+            dados[f"_linhas_bim{b}"] = no_bim.astype("int64")
+            agregacoes[f"_linhas_bim{b}"] = (f"_linhas_bim{b}", "sum")
+            if freq_linha is not None:
+                dados[f"_freq_bim{b}"] = np.where(no_bim, freq_linha, np.nan)
+                agregacoes[f"Frequencia_Bim{b}"] = (f"_freq_bim{b}", "mean")
+                agregacoes[f"_soma_bim{b}"] = (f"_freq_bim{b}", "sum")
+                agregacoes[f"_qtd_bim{b}"] = (f"_freq_bim{b}", "count")
+            if falta is not None:
+                dados[f"_falta_bim{b}"] = np.where(no_bim, falta, 0)
+                agregacoes[f"Faltas_{b}_Bimestre"] = (f"_falta_bim{b}", "sum")
+
+    linhas = pd.DataFrame(dados)[codigos_aluno >= 0]
+    if agregacoes:
+        tabela = linhas.groupby(["_a", "_t"], sort=True).agg(**agregacoes).reset_index()
+    else:
+        tabela = linhas.drop_duplicates().sort_values(["_a", "_t"]).reset_index(drop=True)
+    tabela.insert(0, col_aluno, rotulos_aluno(tabela["_a"].to_numpy()))
+    tabela.insert(1, "Turma", rotulos_turma(tabela["_t"].to_numpy()))
+    if col_anual:
+        posicao = tabela["_pos_anual"].to_numpy()
+        tabela.insert(2, "Frequencia", np.where(posicao >= 0, freq[np.maximum(posicao, 0)], np.nan))
+        tabela.insert(3, "Classificacao_Freq", classificar_frequencia_faixa(tabela["Frequencia"]))
+    for b in (1, 2):
+        if f"Frequencia_Bim{b}" in tabela.columns:
+            tabela[f"Classificacao_Freq_Bim{b}"] = classificar_frequencia_faixa(tabela[f"Frequencia_Bim{b}"])
+    if tem_faltas:
+        tabela["Faltas_Total_1e2_Bim"] = tabela["Faltas_1_Bimestre"] + tabela["Faltas_2_Bimestre"]
+    tabela.attrs["coluna_anual"] = col_anual
+    return tabela
+
+
+def frequencia_alunos_turma(tabela, tipo="anual"):
+    """
+    Visão aluno/turma da tabela de frequência: colunas aluno, Turma, Frequencia,
+    Classificacao_Freq e as faltas. tipo: 'anual', 'bim1' ou 'bim2'
+    (no bimestre, só os alunos/turmas com linhas naquele período).
+    """
+    col_aluno = tabela.columns[0]
+    visao = tabela[tabela["Turma"].notna()]
+    if tipo == "anual":
+        if "Frequencia" not in visao.columns:
+            return None
+        freq = visao[[col_aluno, "Turma", "Frequencia", "Classificacao_Freq"]]
+    else:
+        b = 1 if tipo == "bim1" else 2
+        if f"Frequencia_Bim{b}" not in visao.columns or not tabela[f"_linhas_bim{b}"].any():
+            return None
+        visao = visao[visao[f"_linhas_bim{b}"] > 0]
+        freq = visao[[col_aluno, "Turma", f"Frequencia_Bim{b}", f"Classificacao_Freq_Bim{b}"]].rename(
+            columns={f"Frequencia_Bim{b}": "Frequencia", f"Classificacao_Freq_Bim{b}": "Classificacao_Freq"}
+        )
+    faltas = [c for c in ("Faltas_1_Bimestre", "Faltas_2_Bimestre", "Faltas_Total_1e2_Bim") if c in visao.columns]
+    return pd.concat([freq, visao[faltas]], axis=1).reset_index(drop=True)
+
+
+def frequencia_por_aluno(tabela, tipo="anual"):
+    """
+    Frequência consolidada por aluno (todas as turmas): 'anual' = último registro do aluno;
+    'bim1'/'bim2' = média da coluna Frequencia no bimestre. Retorna None sem dados.
+    """
+    col_aluno = tabela.columns[0]
+    if tipo == "anual":
+        if "Frequencia" not in tabela.columns:
+            return None
+        ultima = tabela.groupby(col_aluno, observed=True)["_pos_anual"].idxmax()
+        return pd.Series(
+            tabela.loc[ultima.to_numpy(), "Frequencia"].to_numpy(), index=ultima.index, name="Frequencia"
+        )
+    b = 1 if tipo == "bim1" else 2
+    if f"_soma_bim{b}" not in tabela.columns:
+        return None
+    por_aluno = tabela.groupby(col_aluno, observed=True)[[f"_linhas_bim{b}", f"_soma_bim{b}", f"_qtd_bim{b}"]].sum()
+    por_aluno = por_aluno[por_aluno[f"_linhas_bim{b}"] > 0]
+    if por_aluno.empty:
+        return None
+    media = por_aluno[f"_soma_bim{b}"] / por_aluno[f"_qtd_bim{b}"].where(por_aluno[f"_qtd_bim{b}"] > 0)
+    return media.rename("Frequencia")
+
+
+# -----------------------------
+# Alunos em várias turmas
+# -----------------------------
+def alunos_em_varias_turmas(df, col_aluno, col_id=None):
+    """
+    Alunos que aparecem em mais de uma turma: [aluno, (col_id,) Qtd_Turmas, Turma_1..Turma_k].
+
+    Um único agrupamento sobre códigos inteiros (pares aluno-turma distintos e contagem por aluno);
+    as turmas de cada aluno, em ordem alfabética, vão para as colunas Turma_i de uma vez (None onde faltar).
+    Com `col_id` (ex.: StudentID), o aluno é o ID e o nome exibido é o primeiro em ordem alfabética
+    entre as grafias dele. Ordenado por Qtd_Turmas (decrescente) e aluno.
+    """
+    nomes, cod_nome = _codigos_ordenados(df[col_aluno])
+    if col_id is None:
+        ids, cod_aluno = nomes, cod_nome
+    else:
+        ids, cod_aluno = _codigos_ordenados(df[col_id])
+        cod_aluno = np.where(cod_nome >= 0, cod_aluno, -1)
+    turmas, cod_turma = _codigos_ordenados(df["Turma"])
+    validos = (cod_aluno >= 0) & (cod_turma >= 0)
+    base = max(len(turmas), 1)
+    # Pares distintos já ordenados por aluno e turma (os códigos seguem a ordem alfabética)
+    par_aluno, par_turma = np.divmod(np.unique(cod_aluno[validos] * base + cod_turma[validos]), base)
+    qtd = np.bincount(par_aluno, minlength=len(ids))
+    repetidos = qtd[par_aluno] > 1
+    par_aluno, par_turma = par_aluno[repetidos], par_turma[repetidos]
+    colunas = [col_aluno, "Qtd_Turmas"] if col_id is None else [col_aluno, col_id, "Qtd_Turmas"]
+    if len(par_aluno) == 0:
+        return pd.DataFrame(columns=colunas)
+
+    if col_id is None:
+        nome_do_aluno = np.arange(len(ids))
+    else:
+        nome_do_aluno = np.full(len(ids), len(nomes), dtype=np.int64)
+        np.minimum.at(nome_do_aluno, cod_aluno[validos], cod_nome[validos])
+    duplicados = np.unique(par_aluno)
+    duplicados = duplicados[np.lexsort((duplicados, nome_do_aluno[duplicados], -qtd[duplicados]))]
+    linha = np.empty(len(ids), dtype=np.int64)
+    linha[duplicados] = np.arange(len(duplicados))
+    coluna = np.arange(len(par_aluno)) - np.searchsorted(par_aluno, par_aluno)
+    maximo = int(qtd[duplicados[0]])
+    grade = np.full((len(duplicados), maximo), None, dtype=object)
+    grade[linha[par_aluno], coluna] = turmas[par_turma]
+
+    resultado = pd.DataFrame(grade, columns=[f"Turma_{i}" for i in range(1, maximo + 1)])
+    resultado.insert(0, col_aluno, nomes[nome_do_aluno[duplicados]])
+    if col_id is not None:
+        resultado.insert(1, col_id, ids[duplicados])
+    resultado.insert(len(colunas) - 1, "Qtd_Turmas", qtd[duplicados].astype("int64"))
+    return resultado
+
+
+# -----------------------------
+# Identidade dos estudantes (nomes com variações)
+# -----------------------------
+# Semelhança mínima (difflib, 0-1) entre dois nomes normalizados do mesmo bloco para serem o mesmo estudante;
+# além dela, cada palavra só pode diferir por uma letra e nunca na vogal final (MARIA x MARIO, GABRIEL x GABRIELA)
+LIMIAR_SEMELHANCA_NOME = 0.9
+# Vizinhos (em ordem alfabética, dentro do bloco) com que cada nome é comparado; limita o custo de blocos grandes
+JANELA_NOMES_SEMELHANTES = 8
+# Preposições ignoradas na chave fonética ("JOAO DA SILVA" e "JOAO SILVA" caem no mesmo bloco)
+_PARTICULAS_NOME = r"\b(?:DA|DE|DO|DAS|DOS|E)\b"
+# Reduções fonéticas do português, aplicadas em ordem sobre o nome normalizado; a vogal final de cada
+# palavra (que marca o gênero) fica na chave
+_REGRAS_FONETICAS = [
+    (r"PH", "F"), (r"LH", "L"), (r"NH", "N"), (r"[CS]H", "X"), (r"H", ""),
+    (r"C(?=[EI])", "S"), (r"G(?=[EI])", "J"), (r"QU?|C", "K"), (r"Z", "S"),
+    (r"W", "V"), (r"Y", "I"), (r"N\b", "M"), (r"(?<=[A-Z])[AEIOU](?=[A-Z])", ""), (r"([A-Z])\1+", r"\1"),
+]
+_VOGAIS = frozenset("AEIOU")
+
+
+def _normalizar_nome(serie):
+    """Nome sem acentos, em maiúsculas e com espaços simples (calculado uma vez por nome distinto)."""
+    codigos, valores = pd.factorize(serie)
+    nomes = (
+        pd.Series(valores, dtype=object).astype(str)
+        .str.normalize("NFKD").str.encode("ascii", "ignore").str.decode("ascii")
+        .str.upper().str.replace(r"\s+", " ", regex=True).str.strip()
+    )
+    nomes = nomes.where(~nomes.isin(["", "NAN", "NONE"]))
+    return pd.Series(np.append(nomes.to_numpy(dtype=object), None)[codigos], index=serie.index)
+
+
+def chave_fonetica(nomes):
+    """Chave fonética de nomes já normalizados (uma por nome distinto); nomes parecidos caem na mesma chave."""
+    codigos, valores = pd.factorize(nomes)
+    chaves = pd.Series(valores, dtype=object).str.replace(_PARTICULAS_NOME, " ", regex=True)
+    for padrao, troca in _REGRAS_FONETICAS:
+        chaves = chaves.str.replace(padrao, troca, regex=True)
+    chaves = chaves.str.split().str.join(" ")
+    return pd.Series(np.append(chaves.to_numpy(dtype=object), None)[codigos], index=nomes.index)
+
+
+def _palavras_nome(nome):
+    """Palavras do nome normalizado, sem as preposições."""
+    return re.sub(_PARTICULAS_NOME, " ", nome).split()
+
+
+def _uma_edicao_no_maximo(a, b):
+    """True se `a` vira `b` com no máximo uma inserção, remoção ou troca de letra."""
+    if abs(len(a) - len(b)) > 1:
+        return False
+    if len(a) > len(b):
+        a, b = b, a
+    inicio = 0
+    while inicio < len(a) and a[inicio] == b[inicio]:
+        inicio += 1
+    resto = inicio + 1 if len(a) == len(b) else inicio
+    return a[resto:] == b[inicio + 1:]
+
+
+def _nomes_compativeis(x, y, limiar):
+    """
+    Mesmas palavras (sem preposições), cada uma com no máximo uma letra de diferença e nunca
+    na vogal final, e semelhança difflib de pelo menos `limiar`.
+    """
+    palavras_x, palavras_y = _palavras_nome(x), _palavras_nome(y)
+    if len(palavras_x) != len(palavras_y):
+        return False
+    for a, b in zip(palavras_x, palavras_y):
+        if a == b:
+            continue
+        if a[-1] != b[-1] and (a[-1] in _VOGAIS or b[-1] in _VOGAIS):
+            return False
+        if not _uma_edicao_no_maximo(a, b):
+            return False
+    return SequenceMatcher(None, x, y).ratio() >= limiar
+
+
+def _agrupar_nomes_semelhantes(nomes, contexto=None, limiar=LIMIAR_SEMELHANCA_NOME):
+    """
+    Nome canônico + contexto de cada linha (None sem nome): variações do mesmo nome no mesmo
+    bloco (chave fonética + contexto, ex.: data de nascimento ou escola) viram um grupo só
+    quando compatíveis (_nomes_compativeis). Sem contexto, nada separa homônimos parecidos:
+    só se juntam nomes idênticos depois de tirar acentos, espaços e preposições.
+    Dentro do bloco, em ordem alfabética, cada nome só é comparado aos JANELA_NOMES_SEMELHANTES
+    seguintes (vizinhança ordenada); o canônico é o menor nome do grupo.
+    """
+    normalizados = _normalizar_nome(nomes)
+    contexto = pd.Series("", index=nomes.index) if contexto is None else contexto.astype(str).fillna("")
+    distintos = pd.DataFrame({"nome": normalizados, "contexto": contexto}).dropna().drop_duplicates()
+    exato = "=" + distintos["nome"].str.replace(_PARTICULAS_NOME, "", regex=True).str.replace(" ", "", regex=False)
+    distintos["bloco"] = exato.where(distintos["contexto"] == "", chave_fonetica(distintos["nome"])) + "|" + distintos["contexto"]
+    distintos = distintos.sort_values(["bloco", "nome"], ignore_index=True)
+    nome = distintos["nome"].to_numpy(dtype=object)
+    bloco = distintos["bloco"].to_numpy(dtype=object)
+    sem_contexto = (distintos["contexto"] == "").to_numpy()
+
+    # Pares candidatos: mesmo bloco e até JANELA_NOMES_SEMELHANTES posições de distância
+    origem, destino = [], []
+    for passo in range(1, JANELA_NOMES_SEMELHANTES + 1):
+        a = np.flatnonzero(bloco[:-passo] == bloco[passo:])
+        if len(a) == 0:
+            break
+        b = a + passo
+        # Sem contexto o bloco já é o nome exato; com contexto, os nomes precisam ser compatíveis
+        semelhantes = np.fromiter(
+            (livre or _nomes_compativeis(x, y, limiar) for livre, x, y in zip(sem_contexto[a], nome[a], nome[b])),
+            dtype=bool, count=len(a),
+        )
+        origem.append(a[semelhantes])
+        destino.append(b[semelhantes])
+
+    # Componentes: cada nome fica com o menor índice (= menor nome) do seu grupo
+    grupo = np.arange(len(distintos))
+    if origem:
+        origem, destino = np.concatenate(origem), np.concatenate(destino)
+        while len(origem):
+            menor = np.minimum(grupo[origem], grupo[destino])
+            anterior = grupo.copy()
+            np.minimum.at(grupo, origem, menor)
+            np.minimum.at(grupo, destino, menor)
+            grupo = grupo[grupo]
+            if np.array_equal(grupo, anterior):
+                break
+
+    canonico = pd.Series(nome[grupo], dtype=object) + "|" + distintos["contexto"]
+    indice = pd.MultiIndex.from_frame(distintos[["nome", "contexto"]])
+    posicao = indice.get_indexer(pd.MultiIndex.from_arrays([normalizados, contexto]))
+    return pd.Series(np.append(canonico.to_numpy(dtype=object), None)[posicao], index=nomes.index)
+
+
+def gerar_student_id(chaves):
+    """StudentID estável (mesma chave de identidade -> mesmo ID em qualquer carga ou filtro); None sem chave."""
+    codigos, valores = pd.factorize(chaves)
+    hashes = pd.util.hash_array(np.asarray(valores, dtype=object), categorize=False)
+    ids = np.array([f"EST-{h:016X}" for h in hashes] + [None], dtype=object)
+    return pd.Series(ids[codigos], index=chaves.index, name="StudentID")
+
+
+def identificar_alunos_por_nome(nomes, contexto=None, limiar=LIMIAR_SEMELHANCA_NOME):
+    """
+    StudentID por linha a partir do nome (variações de acento, espaço e grafia) dentro do contexto.
+
+    >>> nomes = pd.Series(["MARIA DA SILVA", "MARIO DA SILVA", "GABRIEL SANTOS", "GABRIELA SANTOS"])
+    >>> identificar_alunos_por_nome(nomes).nunique()
+    4
+    >>> identificar_alunos_por_nome(nomes, pd.Series(["2010-05-01"] * 4)).nunique()
+    4
+    >>> identificar_alunos_por_nome(pd.Series(["João  da Silva", "JOAO SILVA", "JOAO DA SILVVA"])).nunique()
+    2
+    >>> identificar_alunos_por_nome(pd.Series(["JOAO DA SILVA", "JOAO DA SILVVA"]), pd.Series(["2010-05-01"] * 2)).nunique()
+    1
+    """
+    return gerar_student_id(_agrupar_nomes_semelhantes(nomes, contexto, limiar))
+
+
+# -----------------------------
+# Duplicatas do Censo Escolar
+# -----------------------------
+def _normalizar_codigo(serie, digitos=None):
+    """Só os dígitos de CPF/INEP (aceita número lido do Excel); vazio ou só zeros = nulo."""
+    codigos, valores = pd.factorize(serie)
+    texto = pd.Series(valores, dtype=object).astype(str).str.replace(r"\.0$", "", regex=True)
+    texto = texto.str.replace(r"\D", "", regex=True)
+    if digitos:
+        texto = texto.str.zfill(digitos)
+    texto = texto.where(texto.str.strip("0") != "")
+    return pd.Series(np.append(texto.to_numpy(dtype=object), None)[codigos], index=serie.index)
+
+
+def _chave_unica_por_grupo(grupos, chaves):
+    """grupo -> chave, só para os grupos associados a uma única chave (junção por hash sem ambiguidade)."""
+    pares = pd.DataFrame({"grupo": grupos, "chave": chaves}).dropna().drop_duplicates()
+    unicos = pares[~pares["grupo"].duplicated(keep=False)]
+    return pd.Series(unicos["chave"].to_numpy(), index=unicos["grupo"].to_numpy())
+
+
+class IdentidadeEstudantesCenso:
+    """
+    Identidade de cada estudante do censo, resolvida uma vez por dataset.
+
+    A chave é o CPF; sem CPF, o INEP do estudante (ligado ao CPF de outra linha com o mesmo INEP);
+    sem nenhum dos dois, o nome + Data_Nascimento (variações de acento, espaço e grafia agrupadas),
+    ligado por junção ao CPF/INEP das linhas do mesmo grupo quando ele for único. Cada chave vira
+    um StudentID estável. Os recortes por filtro contam escolas e turmas por códigos inteiros e
+    montam as tabelas de detalhe de uma vez.
+    """
+
+    def __init__(self, df):
+        self.df = df
+        vazio = pd.Series(None, index=df.index, dtype=object)
+        cpf = _normalizar_codigo(df["CPF"], digitos=11) if "CPF" in df.columns else vazio
+        inep = _normalizar_codigo(df["Codigo_Estudante"]) if "Codigo_Estudante" in df.columns else vazio
+        nascimento = None
+        if "Data_Nascimento" in df.columns:
+            nascimento = pd.to_datetime(df["Data_Nascimento"], errors="coerce").dt.strftime("%Y-%m-%d").fillna("")
+        bloco = _agrupar_nomes_semelhantes(df["Nome_Estudante"], nascimento) if "Nome_Estudante" in df.columns else vazio
+
+        chave = ("CPF:" + cpf).where(cpf.notna())
+        origem = np.where(cpf.notna(), "CPF", None).astype(object)
+
+        # INEP sem CPF: herda o CPF das outras linhas do mesmo INEP
+        so_inep = chave.isna() & inep.notna()
+        chave[so_inep] = inep[so_inep].map(_chave_unica_por_grupo(inep, chave)).fillna("INEP:" + inep[so_inep])
+        origem[so_inep.to_numpy()] = "INEP"
+
+        # Só nome (+ nascimento): herda a chave das linhas do mesmo bloco, se houver uma só
+        so_nome = chave.isna() & bloco.notna()
+        chave[so_nome] = bloco[so_nome].map(_chave_unica_por_grupo(bloco, chave)).fillna("NOME:" + bloco[so_nome])
+        origem[so_nome.to_numpy()] = "Nome e nascimento" if "Data_Nascimento" in df.columns else "Nome"
+
+        # Sem nenhum identificador: cada linha é um estudante
+        sem_chave = chave.isna().to_numpy()
+        chave[sem_chave] = "LINHA:" + pd.Series(np.flatnonzero(sem_chave), index=chave.index[sem_chave]).astype(str)
+        origem[sem_chave] = "Sem identificação"
+        self.codigos = pd.factorize(chave)[0]
+        self.student_id = gerar_student_id(chave).to_numpy()
+        self.origem = origem
+        self._escolas = _codificar_dimensao(df["Escola"])[1] if "Escola" in df.columns else np.zeros(len(df), dtype=np.int64)
+        # Sem coluna de turma, cada linha conta como uma turma (mesma regra da contagem anterior)
+        self._turmas = _codificar_dimensao(df["Turma"])[1] if "Turma" in df.columns else np.arange(len(df))
+
+    def estudantes(self, linhas=None):
+        """Quantidade de estudantes distintos nas linhas (posições no df; None = todas)."""
+        codigos = self.codigos if linhas is None else self.codigos[linhas]
+        return len(pd.unique(codigos))
+
+    def _detalhe(self, linhas, mascara, grupo):
+        """Linhas marcadas, no formato da tabela da tela, agrupadas por estudante (e escola)."""
+        pos = linhas[mascara]
+        detalhe = pd.DataFrame({
+            "Nome": self.df["Nome_Estudante"].to_numpy()[pos] if "Nome_Estudante" in self.df.columns else "N/A",
+            "Escola": self.df["Escola"].to_numpy()[pos],
+            "Turma": self.df["Turma"].to_numpy()[pos] if "Turma" in self.df.columns else "N/A",
+            "CPF": self.df["CPF"].to_numpy()[pos] if "CPF" in self.df.columns else "N/A",
+            "Situacao": self.df["Situacao"].to_numpy()[pos] if "Situacao" in self.df.columns else "N/A",
+            "StudentID": self.student_id[pos],
+            "Identificado_Por": self.origem[pos],
+        })
+        # Grupos na ordem do nome (da primeira linha de cada grupo); linhas na ordem da planilha
+        grupo = grupo[mascara]
+        nome_grupo = detalhe["Nome"].astype(str).groupby(grupo).transform("first")
+        ordem = np.lexsort((np.arange(len(pos)), grupo, nome_grupo.to_numpy()))
+        return detalhe.iloc[ordem].reset_index(drop=True)
+
+    def duplicatas(self, linhas=None):
+        """
+        Estudantes em várias escolas e em várias turmas da mesma escola, nas linhas do recorte.
+        Devolve as tabelas de detalhe e as quantidades (estudantes / pares estudante-escola).
+        """
+        linhas = np.arange(len(self.df)) if linhas is None else np.asarray(linhas)
+        aluno = self.codigos[linhas]
+        escola = self._escolas[linhas].astype(np.int64)
+        turma = self._turmas[linhas].astype(np.int64)
+        validas_escola = escola >= 0
+
+        # Várias escolas: pares estudante-escola distintos por estudante
+        base_escola = int(self._escolas.max(initial=-1)) + 2
+        chave_escola = aluno * base_escola + escola + 1
+        pares = pd.unique(chave_escola[validas_escola])
+        qtd_escolas = np.bincount(pares // base_escola, minlength=int(self.codigos.max(initial=-1)) + 1)
+        multiplas_escolas = qtd_escolas[aluno] > 1
+
+        # Várias turmas na mesma escola: turmas distintas por par estudante-escola
+        aluno_escola = pd.factorize(chave_escola)[0]
+        base_turma = int(self._turmas.max(initial=-1)) + 1
+        validas_turma = validas_escola & (turma >= 0)
+        ternos = pd.unique(aluno_escola[validas_turma] * base_turma + turma[validas_turma])
+        qtd_turmas = np.bincount(ternos // max(base_turma, 1), minlength=aluno_escola.max(initial=-1) + 1)
+        multiplas_turmas = qtd_turmas[aluno_escola] > 1
+
+        return {
+            "multiplas_escolas": self._detalhe(linhas, multiplas_escolas, aluno),
+            "multiplas_turmas": self._detalhe(linhas, multiplas_turmas, aluno_escola),
+            "qtd_multiplas_escolas": int((qtd_escolas > 1).sum()),
+            "qtd_multiplas_turmas": int((qtd_turmas > 1).sum()),
+            "estudantes": self.estudantes(linhas),
+        }
+
+
+# -----------------------------
+# Filtros da barra lateral
+# -----------------------------
+class MotorFiltros:
+    """
+    Índices invertidos por dimensão (código do valor -> posições das linhas), montados uma
+    vez por dataset. Cada filtro devolve as posições das linhas selecionadas em ordem
+    crescente, sem copiar o DataFrame: parte do menor conjunto indexado e confere as
+    demais dimensões pelo código de cada linha candidata.
+    """
+
+    def __init__(self, df, dimensoes):
+        self.total_linhas = len(df)
+        self._dimensoes = {}
+        for coluna in dimensoes:
+            if coluna not in df.columns:
+                continue
+            rotulos, codigos = _codificar_dimensao(df[coluna])
+            ordem = np.argsort(codigos, kind="stable")
+            # Fatia de `ordem` com as linhas de cada código (nulos, código -1, ficam antes da fatia 0)
+            limites = np.searchsorted(codigos[ordem], np.arange(len(rotulos) + 1))
+            self._dimensoes[coluna] = (rotulos, codigos, ordem, limites)
+
+    def _codigos_selecionados(self, coluna, valores):
+        codigos = self._dimensoes[coluna][0].get_indexer(list(valores))
+        return np.unique(codigos[codigos >= 0])
+
+    def _linhas_do_indice(self, coluna, codigos_sel):
+        _, _, ordem, limites = self._dimensoes[coluna]
+        fatias = [ordem[limites[c]:limites[c + 1]] for c in codigos_sel]
+        if len(fatias) == 1:
+            return fatias[0]
+        return np.sort(np.concatenate(fatias)) if fatias else np.array([], dtype=np.intp)
+
+    def posicoes(self, selecoes):
+        """
+        `selecoes`: {coluna: valores}; None ou lista vazia = sem filtro na coluna.
+        Retorna None quando nenhum filtro se aplica (todas as linhas).
+        """
+        ativos = {
+            coluna: self._codigos_selecionados(coluna, valores)
+            for coluna, valores in selecoes.items()
+            if valores is not None and len(valores) and coluna in self._dimensoes
+        }
+        if not ativos:
+            return None
+        tamanho = lambda coluna: sum(
+            self._dimensoes[coluna][3][c + 1] - self._dimensoes[coluna][3][c] for c in ativos[coluna]
+        )
+        menor = min(ativos, key=tamanho)
+        linhas = self._linhas_do_indice(menor, ativos[menor])
+        for coluna, codigos_sel in ativos.items():
+            if coluna == menor or not len(linhas):
+                continue
+            rotulos, codigos, _, _ = self._dimensoes[coluna]
+            permitido = np.zeros(len(rotulos) + 1, dtype=bool)  # última posição: código -1 (nulo)
+            permitido[codigos_sel] = True
+            linhas = linhas[permitido[codigos[linhas]]]
+        return linhas
+
+    def filtrar(self, df, selecoes):
+        """Linhas de `df` (o mesmo dataset indexado) que atendem às seleções; sem filtro, o próprio df."""
+        linhas = self.posicoes(selecoes)
+        return df if linhas is None else df.iloc[linhas]
+
+
+def _codigos_ordenados(serie):
+    """Rótulos distintos em ordem de exibição (sorted) + posição de cada linha nessa ordem (-1 = nulo)."""
+    rotulos, codigos = _codificar_dimensao(serie)
+    ordenados = sorted(rotulos.tolist())
+    posicao = np.empty(len(rotulos) + 1, dtype=np.int64)
+    posicao[:-1] = pd.Index(ordenados).get_indexer(rotulos)
+    posicao[-1] = -1  # código -1 (nulo) continua nulo
+    return np.array(ordenados, dtype=object), posicao[codigos]
+
+
+class HierarquiaOpcoes:
+    """
+    Listas de opções da barra lateral pré-ordenadas por nó Escola → Status.
+
+    As opções de turma, disciplina e aluno dependem só da escola e dos status escolhidos;
+    cada nó guarda os códigos (já na ordem de exibição) dos valores presentes, e a consulta
+    une os nós selecionados em vez de filtrar e ordenar o DataFrame a cada interação.
+    """
+
+    def __init__(self, df, coluna_aluno):
+        self.niveis = [c for c in ("Turma", "Disciplina", coluna_aluno) if c and c in df.columns]
+        self._escolas, escola = self._codigos(df, "Escola")
+        self._status, status = self._codigos(df, "Status")
+        # Opções de escola e status: só os valores presentes (categorias podem sobrar)
+        self.escolas = [self._escolas[c] for c in np.unique(escola[escola >= 0])]
+        self.status = [self._status[c] for c in np.unique(status[status >= 0])]
+        self._rotulos = {}
+        self._por_no = {}       # (escola, status) -> {nível: códigos}
+        self._por_escola = {}   # escola -> {nível: códigos}
+        self._todos = {}        # {nível: códigos}
+        for nivel in self.niveis:
+            self._rotulos[nivel], codigos = _codigos_ordenados(df[nivel])
+            presentes = pd.DataFrame({"escola": escola, "status": status, "codigo": codigos})
+            presentes = presentes[presentes["codigo"] >= 0].drop_duplicates()
+            self._todos[nivel] = np.unique(presentes["codigo"].to_numpy())
+            for e, grupo in presentes.groupby("escola"):
+                self._por_escola.setdefault(e, {})[nivel] = np.unique(grupo["codigo"].to_numpy())
+            for (e, s), grupo in presentes.groupby(["escola", "status"]):
+                self._por_no.setdefault((e, s), {})[nivel] = np.sort(grupo["codigo"].to_numpy())
+
+    @staticmethod
+    def _codigos(df, coluna):
+        if coluna not in df.columns:
+            return [], np.full(len(df), -1, dtype=np.int64)
+        rotulos, codigos = _codigos_ordenados(df[coluna])
+        return rotulos.tolist(), codigos
+
+    def opcoes(self, escola_sel="Todas", status_sel=None):
+        """{nível: lista ordenada} para a escola ("Todas" = todas) e os status escolhidos (vazio = todos)."""
+        if escola_sel == "Todas":
+            escolas = None
+        else:
+            escolas = {self._escolas.index(escola_sel)} if escola_sel in self._escolas else set()
+        if not status_sel:
+            if escolas is None:
+                nos = [self._todos]
+            else:
+                nos = [self._por_escola.get(e, {}) for e in escolas]
+        else:
+            status = {self._status.index(s) for s in status_sel if s in self._status}
+            nos = [no for (e, s), no in self._por_no.items()
+                   if s in status and (escolas is None or e in escolas)]
+        resultado = {}
+        for nivel in self.niveis:
+            partes = [no[nivel] for no in nos if nivel in no]
+            codigos = partes[0] if len(partes) == 1 else np.unique(np.concatenate(partes)) if partes else []
+            resultado[nivel] = self._rotulos[nivel][codigos].tolist()
+        return resultado
+
+
+# -----------------------------
+# Várias planilhas (Superintendência / Regional)
+# -----------------------------
+COLUNAS_ALUNO = ["Aluno", "Nome_Estudante", "Estudante"]
+
+
+def _processar_conteudo_planilha(conteudo, sheet=None):
+    """
+    Processa uma planilha (bytes), ou uma aba dela, passando pelo cache em disco.
+    Roda dentro dos processos do pool: recebe e devolve apenas objetos serializáveis.
+    """
+    chave = chave_conteudo_planilha(conteudo, sheet)
+    df = ler_cache_planilha(chave)
+    if df is None:
+        df = processar_planilha(BytesIO(conteudo), sheet, tamanho_mb=len(conteudo) / (1024 * 1024))
+        gravar_cache_planilha(chave, df)
+    return df
+
+
+def processar_conteudos_em_paralelo(conteudos, max_processos=None, abas=None):
+    """
+    Processa várias planilhas (ou abas: abas[i] é a aba lida de conteudos[i]) em um
+    pool de processos, até um por núcleo, e devolve os DataFrames na mesma ordem.
+    Com uma tarefa só, ou se o servidor não permitir criar processos, processa tudo
+    no processo atual.
+    """
+    if abas is None:
+        abas = [None] * len(conteudos)
+    if max_processos is None:
+        max_processos = os.cpu_count() or 1
+    max_processos = min(max_processos, len(conteudos))
+    if max_processos > 1:
+        try:
+            # spawn: o servidor do Streamlit roda várias threads, e fork com threads ativas pode travar
+            contexto = multiprocessing.get_context("spawn")
+            with ProcessPoolExecutor(max_workers=max_processos, mp_context=contexto) as pool:
+                return list(pool.map(_processar_conteudo_planilha, conteudos, abas))
+        except (OSError, BrokenProcessPool):
+            pass
+    return [_processar_conteudo_planilha(conteudo, aba) for conteudo, aba in zip(conteudos, abas)]
+
+
+def _unificar_categorias(partes):
+    """Dá às colunas category de todas as partes o mesmo dicionário (ordem alfabética)."""
+    for col in COLUNAS_CATEGORICAS_NOTAS:
+        series = [p[col] for p in partes if col in p.columns]
+        if not series:
+            continue
+        categorias = set()
+        for serie in series:
+            if isinstance(serie.dtype, pd.CategoricalDtype):
+                categorias.update(serie.cat.categories)
+            else:
+                categorias.update(serie.dropna().unique())
+        tipo = pd.CategoricalDtype(sorted(categorias))
+        partes = [p.assign(**{col: p[col].astype(tipo)}) if col in p.columns else p for p in partes]
+    return partes
+
+
+def unir_planilhas_notas(partes):
+    """
+    Concatena DataFrames de notas/frequência já processados (um por arquivo).
+    As categorias são unificadas antes do concat, então o resultado continua category.
+    Linhas idênticas que reaparecem em outro arquivo (exportações sobrepostas) são
+    descartadas pelo hash da linha; repetições dentro do mesmo arquivo são mantidas.
+    """
+    # Arquivos de modelos diferentes podem nomear a coluna de aluno de outra forma
+    coluna_aluno = next((c for c in COLUNAS_ALUNO if any(c in p.columns for p in partes)), None)
+    padronizadas = []
+    for parte in partes:
+        if coluna_aluno and coluna_aluno not in parte.columns:
+            outra = next((c for c in COLUNAS_ALUNO if c in parte.columns), None)
+            if outra:
+                parte = parte.rename(columns={outra: coluna_aluno})
+        padronizadas.append(parte)
+    partes = _unificar_categorias(padronizadas)
+
+    df = pd.concat(partes, ignore_index=True)
+    if len(partes) > 1 and len(df):
+        origem = np.repeat(np.arange(len(partes)), [len(p) for p in partes])
+        chave_linha = pd.util.hash_pandas_object(df, index=False).to_numpy()
+        primeiro_arquivo = pd.Series(origem).groupby(chave_linha).transform("min").to_numpy()
+        manter = origem == primeiro_arquivo
+        removidas = int((~manter).sum())
+        df = df[manter].reset_index(drop=True)
+    else:
+        removidas = 0
+
+    df.attrs = {
+        'tipo_planilha': 'notas_frequencia',
+        'arquivos_combinados': len(partes),
+        'linhas_duplicadas_removidas': removidas,
+        'qualidade': somar_qualidade(p.attrs.get('qualidade') for p in partes),
+    }
+    return aplicar_esquema_notas_frequencia(df)
+
+
+def _erro_tipo_na_uniao(indice):
+    return PlanilhaNaoReconhecida(
+        "Vários arquivos só podem ser combinados quando todos são planilhas de "
+        f"notas/frequência (o arquivo {indice + 1} é de outro tipo)."
+    )
+
+
+def carregar_varias_planilhas(conteudos, max_processos=None):
+    """
+    Junta várias exportações de notas/frequência (ex.: todas as escolas de uma
+    Superintendência) em um único DataFrame. Arquivos fora do cache são processados
+    em paralelo; o resultado combinado também vai para o cache em disco.
+    """
+    chaves = [chave_conteudo_planilha(conteudo) for conteudo in conteudos]
+    chave_uniao = hashlib.sha256("|".join(sorted(chaves)).encode("utf-8")).hexdigest()
+    df = ler_cache_planilha(chave_uniao)
+    if df is None:
+        partes = [ler_cache_planilha(chave) for chave in chaves]
+        pendentes = [i for i, parte in enumerate(partes) if parte is None]
+        # Confere só o cabeçalho antes de abrir o pool, para recusar cedo arquivos de outro tipo
+        for i in pendentes:
+            cabecalhos = ler_cabecalhos_planilha(BytesIO(conteudos[i]))
+            if identificar_planilha(next(iter(cabecalhos.values()), [])) != 'notas_frequencia':
+                raise _erro_tipo_na_uniao(i)
+        processados = processar_conteudos_em_paralelo([conteudos[i] for i in pendentes], max_processos)
+        for i, parte in zip(pendentes, processados):
+            partes[i] = parte
+        for i, parte in enumerate(partes):
+            if parte.attrs.get('tipo_planilha') != 'notas_frequencia':
+                raise _erro_tipo_na_uniao(i)
+        df = unir_planilhas_notas(partes)
+        gravar_cache_planilha(chave_uniao, df)
+    df.attrs['chave_dataset'] = chave_uniao
+    return df
+
+
+# -----------------------------
+# Todas as abas de uma pasta de trabalho
+# -----------------------------
+# Valor de `sheet` que pede a leitura de todas as abas (uma por turma/escola, por exemplo)
+TODAS_AS_ABAS = "__todas_as_abas__"
+COLUNA_ABA = "Aba"
+
+
+def carregar_todas_abas(conteudo, max_processos=None):
+    """
+    Lê todas as abas de uma pasta de trabalho do SGE. Cada aba é identificada pelo
+    cabeçalho; as do mesmo tipo da primeira aba reconhecida são processadas em
+    paralelo e combinadas, com a coluna Aba indicando de onde veio cada linha.
+    Abas vazias ou de outro tipo ficam de fora (listadas em attrs['abas_ignoradas']).
+    """
+    chave = chave_conteudo_planilha(conteudo, TODAS_AS_ABAS)
+    df = ler_cache_planilha(chave)
+    if df is None:
+        cabecalhos = ler_cabecalhos_planilha(BytesIO(conteudo))
+        tipos = {}
+        for aba, colunas in cabecalhos.items():
+            try:
+                tipos[aba] = identificar_planilha(colunas)
+            except PlanilhaNaoReconhecida:
+                continue
+        if not tipos:
+            raise PlanilhaNaoReconhecida("Nenhuma aba da planilha foi reconhecida como relatório do SGE.")
+        tipo_planilha = next(iter(tipos.values()))
+        abas = [aba for aba, tipo in tipos.items() if tipo == tipo_planilha]
+
+        partes = processar_conteudos_em_paralelo([conteudo] * len(abas), max_processos, abas=abas)
+        partes = [parte.assign(**{COLUNA_ABA: aba}) for parte, aba in zip(partes, abas)]
+        if tipo_planilha == 'notas_frequencia':
+            df = unir_planilhas_notas(partes)
+        else:
+            df = pd.concat(partes, ignore_index=True)
+            df.attrs = {'tipo_planilha': tipo_planilha}
+        df.attrs['abas_combinadas'] = abas
+        df.attrs['abas_ignoradas'] = [aba for aba in cabecalhos if aba not in abas]
+        gravar_cache_planilha(chave, df)
+    df.attrs['chave_dataset'] = chave
+    return df
+
+
+# -----------------------------
+# Base incremental (reenvio da exportação do ano a cada bimestre)
+# -----------------------------
+# Fora da área com descarte LRU: a base só é substituída por um novo envio
+PASTA_BASES_INCREMENTAIS = os.path.join(PASTA_CACHE_PLANILHAS, "bases")
+_COLUNAS_CONTROLE_BASE = ["_chave_linha", "_hash_linha"]
+
+
+def _hash_linhas(df, colunas):
+    return pd.util.hash_pandas_object(df[colunas], index=False).to_numpy()
+
+
+def _chaves_linhas(df, colunas_chave):
+    """
+    Hash de (Escola, Turma, aluno, Disciplina, Periodo) mais o número da ocorrência,
+    para que linhas repetidas com a mesma chave também sejam casadas uma a uma.
+    """
+    chave = _hash_linhas(df, colunas_chave)
+    ocorrencia = pd.Series(chave).groupby(chave).cumcount().to_numpy()
+    return pd.util.hash_pandas_object(
+        pd.DataFrame({"chave": chave, "ocorrencia": ocorrencia}), index=False
+    ).to_numpy()
+
+
+def _ordenar_indicadores(indic, colunas_grupo):
+    """Mesma ordem de linhas e colunas que o pivot completo teria."""
+    notas = [f"N{b}" for b in (1, 2, 3, 4) if f"N{b}" in indic.columns]
+    demais = [c for c in indic.columns if c not in colunas_grupo and c not in notas]
+    return indic.sort_values(colunas_grupo).reset_index(drop=True)[colunas_grupo + notas + demais]
+
+
+def escopo_base_incremental(df):
+    """Escolas cobertas pela exportação: exportações de outras escolas ficam em outra base do mesmo usuário."""
+    if "Escola" not in df.columns:
+        return ""
+    return "|".join(sorted(df["Escola"].dropna().astype(str).unique()))
+
+
+def atualizar_base_incremental(nome_base, df_novo, calcular_indicadores):
+    """
+    Atualiza a base guardada com o nome dado e o escopo (escolas) da exportação com uma nova
+    exportação de notas/frequência, que traz o estado completo do ano.
+    As linhas são casadas por (Escola, Turma, aluno, Disciplina, Periodo) e comparadas
+    por hash: novas entram na base, alteradas são trocadas no lugar e as que não vieram na
+    exportação saem (aluno que mudou de turma, por exemplo). Só os grupos aluno/disciplina
+    tocados são recalculados na tabela de indicadores guardada junto com a base.
+    calcular_indicadores: DataFrame -> pivot do painel.
+    Retorna (base, indicadores, resumo).
+    """
+    coluna_aluno = next((c for c in COLUNAS_ALUNO if c in df_novo.columns), None)
+    colunas_grupo = ["Escola", "Turma", coluna_aluno, "Disciplina"]
+    colunas_dados = [c for c in df_novo.columns if c != "Bimestre"]  # Bimestre deriva de Periodo
+
+    novo = df_novo.assign(
+        _chave_linha=_chaves_linhas(df_novo, colunas_grupo + ["Periodo"]),
+        _hash_linha=_hash_linhas(df_novo, colunas_dados),
+    )
+    escopo = escopo_base_incremental(df_novo)
+    chave_base = hashlib.sha256(f"{nome_base}|{escopo}|v{VERSAO_CACHE_PLANILHAS}".encode("utf-8")).hexdigest()
+    base = ler_cache_planilha(chave_base, PASTA_BASES_INCREMENTAIS)
+    indic = ler_cache_planilha(f"{chave_base}_indicadores", PASTA_BASES_INCREMENTAIS)
+
+    if base is None or indic is None or list(base.columns) != list(novo.columns):
+        # Primeiro envio (ou modelo de planilha diferente): a base é a própria exportação
+        base = novo
+        indic = calcular_indicadores(df_novo)
+        resumo = {
+            "linhas_novas": len(novo),
+            "linhas_alteradas": 0,
+            "linhas_removidas": 0,
+            "grupos_recalculados": len(indic),
+            "base_recriada": True,
+        }
+    else:
+        posicoes = pd.Index(base["_chave_linha"]).get_indexer(novo["_chave_linha"])
+        novas = posicoes < 0
+        hash_anterior = base["_hash_linha"].to_numpy()[np.where(novas, 0, posicoes)]
+        alteradas = ~novas & (hash_anterior != novo["_hash_linha"].to_numpy())
+        # Linhas da base ausentes na exportação (que traz o ano inteiro) deixaram de existir
+        removidas = ~np.isin(base["_chave_linha"].to_numpy(), novo["_chave_linha"].to_numpy())
+        resumo = {
+            "linhas_novas": int(novas.sum()),
+            "linhas_alteradas": int(alteradas.sum()),
+            "linhas_removidas": int(removidas.sum()),
+            "grupos_recalculados": 0,
+            "base_recriada": False,
+        }
+        if novas.any() or alteradas.any() or removidas.any():
+            grupos_removidos = _hash_linhas(base[removidas], colunas_grupo)
+            base, delta = _unificar_categorias([base, novo[novas | alteradas]])
+            alteradas_no_delta = alteradas[novas | alteradas]
+
+            # Alteradas: troca no lugar (mantém a ordem das linhas); novas: vão para o final
+            if alteradas_no_delta.any():
+                alvo = posicoes[alteradas]
+                substitutas = delta[alteradas_no_delta]
+                base = base.copy()
+                for col in base.columns:
+                    coluna = base[col].copy()
+                    coluna.iloc[alvo] = substitutas[col].to_numpy()
+                    base[col] = coluna
+            base = pd.concat([base[~removidas], delta[~alteradas_no_delta]], ignore_index=True)
+
+            # Indicadores: recalcula só os grupos (escola, turma, aluno, disciplina) tocados;
+            # grupos que ficaram sem linhas somem da tabela
+            grupos = np.unique(np.concatenate([_hash_linhas(delta, colunas_grupo), grupos_removidos]))
+            afetadas = base[np.isin(_hash_linhas(base, colunas_grupo), grupos)].drop(columns=_COLUNAS_CONTROLE_BASE)
+            # Sem as categorias não usadas, o pivot do recorte não percorre o dicionário inteiro
+            afetadas = afetadas.assign(**{
+                col: afetadas[col].cat.remove_unused_categories()
+                for col in afetadas.columns if isinstance(afetadas[col].dtype, pd.CategoricalDtype)
+            })
+            parcial = calcular_indicadores(afetadas) if len(afetadas) else indic.iloc[:0]
+            mantidos = indic[~np.isin(_hash_linhas(indic, colunas_grupo), grupos)]
+            indic = pd.concat(_unificar_categorias([mantidos, parcial]), ignore_index=True)
+            indic = _ordenar_indicadores(indic, colunas_grupo)
+            resumo["grupos_recalculados"] = len(parcial)
+
+    if resumo["base_recriada"] or resumo["linhas_novas"] or resumo["linhas_alteradas"] or resumo["linhas_removidas"]:
+        base.attrs = {'tipo_planilha': 'notas_frequencia'}
+        gravar_cache_planilha(chave_base, base, PASTA_BASES_INCREMENTAIS)
+        gravar_cache_planilha(f"{chave_base}_indicadores", indic, PASTA_BASES_INCREMENTAIS)
+
+    conteudo = hashlib.sha256(chave_base.encode("utf-8"))
+    conteudo.update(np.ascontiguousarray(base["_hash_linha"].to_numpy()).tobytes())
+    base = base.drop(columns=_COLUNAS_CONTROLE_BASE)
+    base.attrs = {
+        'tipo_planilha': 'notas_frequencia',
+        'chave_dataset': conteudo.hexdigest(),
+        'qualidade': df_novo.attrs.get('qualidade', {}),  # relatório da exportação enviada
+    }
+    return base, indic, resumo
+
+
+# -----------------------------
+# Exportação para Excel (escrita em fluxo)
+# -----------------------------
+# Linhas por aba no Excel (cabeçalho incluído); acima disso a tabela continua em outra aba
+LIMITE_LINHAS_EXCEL = 1_048_576
+LARGURA_MAXIMA_COLUNA_EXCEL = 50
+# Linhas convertidas para valores Python de cada vez (a memória não cresce com o tamanho da exportação)
+TAMANHO_BLOCO_ESCRITA = 50_000
+COR_CABECALHO_EXCEL = "366092"
+
+
+def larguras_colunas_excel(df, maximo=LARGURA_MAXIMA_COLUNA_EXCEL):
+    """
+    Largura de cada coluna: maior texto entre cabeçalho e valores + 2, até `maximo`.
+    Calculada por coluna inteira; nas categóricas, só pelo texto das categorias usadas.
+    """
+    larguras = []
+    for coluna in df.columns:
+        serie = df[coluna]
+        if isinstance(serie.dtype, pd.CategoricalDtype):
+            usadas = np.unique(serie.cat.codes.to_numpy())
+            usadas = usadas[usadas >= 0]
+            tamanhos = serie.cat.categories.astype(str).str.len().to_numpy()[usadas]
+        else:
+            tamanhos = serie.dropna().astype(str).str.len().to_numpy()
+        maior = max(len(str(coluna)), int(tamanhos.max()) if len(tamanhos) else 0)
+        larguras.append(min(maior + 2, maximo))
+    return larguras
+
+
+def _linhas_excel(bloco):
+    """Linhas do bloco como tuplas de valores Python; ausentes viram None (célula vazia, como no to_excel)."""
+    colunas = []
+    for coluna in bloco.columns:
+        serie = bloco[coluna]
+        valores = serie.astype(object)
+        ausentes = serie.isna()
+        if ausentes.any():
+            valores = valores.where(~ausentes, None)
+        colunas.append(valores.tolist())
+    return zip(*colunas)
+
+
+def _nomes_partes_aba(nome, partes):
+    """Nome de cada parte de uma aba dividida: "Nome", "Nome (2)", ... (até 31 caracteres, limite do Excel)."""
+    nomes = []
+    for parte in range(1, partes + 1):
+        sufixo = "" if parte == 1 else f" ({parte})"
+        nomes.append(str(nome)[:31 - len(sufixo)] + sufixo)
+    return nomes
+
+
+# Nomes de cor usados nos estilos CSS do painel
+CORES_CSS_NOMEADAS = {"white": "FFFFFF", "black": "000000"}
+
+
+def _cor_excel(cor):
+    """"#10b981" ou "white" -> "FF10B981" / "FFFFFFFF" (ARGB do openpyxl)."""
+    cor = cor.strip().lower()
+    return "FF" + CORES_CSS_NOMEADAS.get(cor, cor.lstrip("#")).upper()
+
+
+def regra_estilo_css_excel(valor, css):
+    """
+    Regra de formatação condicional "célula igual a `valor`" com o estilo CSS do painel
+    (background-color, color, font-weight: bold). None se o estilo não tiver cor nem negrito.
+    """
+    from openpyxl.formatting.rule import CellIsRule
+    from openpyxl.styles import Font, PatternFill
+
+    propriedades = {}
+    for declaracao in css.split(";"):
+        chave, _, conteudo = declaracao.partition(":")
+        if conteudo.strip():
+            propriedades[chave.strip().lower()] = conteudo.strip()
+    fundo = propriedades.get("background-color")
+    cor = propriedades.get("color")
+    negrito = propriedades.get("font-weight") == "bold"
+    if not (fundo or cor or negrito):
+        return None
+    texto = str(valor).replace('"', '""')
+    return CellIsRule(
+        operator="equal",
+        formula=[f'"{texto}"'],
+        fill=PatternFill(bgColor=_cor_excel(fundo), fill_type="solid") if fundo else None,
+        font=Font(color=_cor_excel(cor) if cor else None, bold=negrito or None),
+    )
+
+
+def escrever_excel(abas, destino=None, titulos=None, progresso=None, formatos=None,
+                   limite_linhas=LIMITE_LINHAS_EXCEL, tamanho_bloco=TAMANHO_BLOCO_ESCRITA):
+    """
+    Grava {nome_aba: DataFrame} em .xlsx com o openpyxl em modo write-only: as linhas vão para o
+    arquivo em blocos, sem montar a pasta de trabalho na memória. Cabeçalho destacado e larguras
+    ajustadas ao conteúdo; uma tabela maior que o limite do Excel continua em "Nome (2)", "Nome (3)"...
+
+    titulos: {nome_aba: [linhas]} escritas acima do cabeçalho (a primeira em destaque).
+    formatos: {coluna: {valor: estilo CSS}}; em toda aba com essa coluna, cada valor vira uma regra de
+    formatação condicional sobre a coluna inteira (algumas regras por aba, em vez de estilo célula a célula).
+    progresso(aba, total_abas, nome) é chamado antes de cada aba.
+    Sem `destino` (caminho ou arquivo aberto), devolve os bytes do arquivo.
+    """
+    from openpyxl.cell import WriteOnlyCell
+    from openpyxl.styles import Alignment, Font, PatternFill
+    from openpyxl.utils import get_column_letter
+
+    titulos = titulos or {}
+    formatos = formatos or {}
+    wb = openpyxl.Workbook(write_only=True)
+    preenchimento = PatternFill(start_color=COR_CABECALHO_EXCEL, end_color=COR_CABECALHO_EXCEL, fill_type="solid")
+    fonte = Font(color="FFFFFF", bold=True)
+    alinhamento = Alignment(horizontal="center", vertical="center")
+
+    for posicao, (nome, df) in enumerate(abas.items()):
+        if progresso is not None:
+            progresso(posicao, len(abas), nome)
+        linhas_titulo = list(titulos.get(nome, []))
+        por_aba = limite_linhas - 1 - len(linhas_titulo)
+        partes = max(1, -(-len(df) // por_aba))
+        larguras = larguras_colunas_excel(df)
+        for parte, nome_parte in enumerate(_nomes_partes_aba(nome, partes)):
+            ws = wb.create_sheet(nome_parte)
+            for indice, largura in enumerate(larguras, start=1):
+                ws.column_dimensions[get_column_letter(indice)].width = largura
+            for k, texto in enumerate(linhas_titulo):
+                celula = WriteOnlyCell(ws, value=texto)
+                celula.font = Font(bold=k == 0, size=16 if k == 0 else 12)
+                ws.append([celula])
+            cabecalho = []
+            for coluna in df.columns:
+                celula = WriteOnlyCell(ws, value=str(coluna))
+                celula.fill, celula.font, celula.alignment = preenchimento, fonte, alinhamento
+                cabecalho.append(celula)
+            ws.append(cabecalho)
+            fim_parte = min((parte + 1) * por_aba, len(df))
+            primeira = len(linhas_titulo) + 2
+            ultima = primeira + fim_parte - parte * por_aba - 1
+            for indice, coluna in enumerate(df.columns, start=1):
+                if coluna not in formatos or ultima < primeira:
+                    continue
+                letra = get_column_letter(indice)
+                for valor, css in formatos[coluna].items():
+                    regra = regra_estilo_css_excel(valor, css)
+                    if regra is not None:
+                        ws.conditional_formatting.add(f"{letra}{primeira}:{letra}{ultima}", regra)
+            for inicio in range(parte * por_aba, fim_parte, tamanho_bloco):
+                for linha in _linhas_excel(df.iloc[inicio:min(inicio + tamanho_bloco, fim_parte)]):
+                    ws.append(linha)
+    if not abas:
+        wb.create_sheet("Dados")
+
+    if destino is not None:
+        wb.save(destino)
+        return None
+    saida = BytesIO()
+    wb.save(saida)
+    return saida.getvalue()
+
+
+# -----------------------------
+# Exportação em CSV, Parquet e Arrow (escrita em fluxo)
+# -----------------------------
+# Formatos além do Excel: extensão e tipo MIME do arquivo baixado
+FORMATOS_EXPORTACAO = {
+    "CSV": (".csv", "text/csv"),
+    "Parquet": (".parquet", "application/vnd.apache.parquet"),
+    "Arrow": (".arrow", "application/vnd.apache.arrow.file"),
+}
+
+
+def _abrir_destino(destino):
+    """(arquivo binário, fechar_ao_final): caminho é aberto aqui; sem destino, um BytesIO."""
+    if destino is None:
+        return BytesIO(), False
+    if isinstance(destino, (str, os.PathLike)):
+        return open(destino, "wb"), True
+    return destino, False
+
+
+def _finalizar_destino(destino, arquivo, fechar):
+    if fechar:
+        arquivo.close()
+    return arquivo.getvalue() if destino is None else None
+
+
+def escrever_csv(df, destino=None, tamanho_bloco=TAMANHO_BLOCO_ESCRITA):
+    """
+    CSV em UTF-8 com BOM (acentos corretos ao abrir no Excel), gravado em blocos de linhas.
+    Sem `destino` (caminho ou arquivo binário aberto), devolve os bytes do arquivo.
+    """
+    arquivo, fechar = _abrir_destino(destino)
+    texto = TextIOWrapper(arquivo, encoding="utf-8-sig", newline="")
+    for inicio in range(0, max(len(df), 1), tamanho_bloco):
+        df.iloc[inicio:inicio + tamanho_bloco].to_csv(texto, header=inicio == 0, index=False)
+    texto.flush()
+    texto.detach()
+    return _finalizar_destino(destino, arquivo, fechar)
+
+
+def _esquema_arrow(df):
+    """Esquema Arrow da tabela, sem converter os dados; colunas de objetos viram texto."""
+    import pyarrow as pa
+
+    esquema = pa.Schema.from_pandas(df.iloc[:0], preserve_index=False)
+    for posicao, campo in enumerate(esquema):
+        if pa.types.is_null(campo.type):
+            esquema = esquema.set(posicao, campo.with_type(pa.string()))
+    return esquema
+
+
+def _tabelas_arrow(df, esquema, tamanho_bloco):
+    """Blocos da tabela já convertidos para Arrow; valores não textuais em colunas de objetos viram texto."""
+    import pyarrow as pa
+
+    colunas_objeto = [c for c in df.columns if df[c].dtype == object]
+    for inicio in range(0, max(len(df), 1), tamanho_bloco):
+        bloco = df.iloc[inicio:inicio + tamanho_bloco]
+        mistas = [
+            c for c in colunas_objeto
+            if pd.api.types.infer_dtype(bloco[c], skipna=True) not in ("string", "empty")
+        ]
+        if mistas:
+            bloco = bloco.assign(**{c: bloco[c].where(bloco[c].isna(), bloco[c].astype(str)) for c in mistas})
+        yield pa.Table.from_pandas(bloco, schema=esquema, preserve_index=False)
+
+
+def escrever_parquet(df, destino=None, tamanho_bloco=TAMANHO_BLOCO_ESCRITA):
+    """Parquet gravado bloco a bloco (um row group por bloco). Requer pyarrow. Sem `destino`, devolve os bytes."""
+    import pyarrow.parquet as pq
+
+    esquema = _esquema_arrow(df)
+    arquivo, fechar = _abrir_destino(destino)
+    with pq.ParquetWriter(arquivo, esquema) as escritor:
+        for tabela in _tabelas_arrow(df, esquema, tamanho_bloco):
+            escritor.write_table(tabela)
+    return _finalizar_destino(destino, arquivo, fechar)
+
+
+def escrever_arrow(df, destino=None, tamanho_bloco=TAMANHO_BLOCO_ESCRITA):
+    """Arquivo Arrow IPC (Feather v2) gravado bloco a bloco. Requer pyarrow. Sem `destino`, devolve os bytes."""
+    import pyarrow as pa
+
+    esquema = _esquema_arrow(df)
+    arquivo, fechar = _abrir_destino(destino)
+    with pa.ipc.new_file(arquivo, esquema) as escritor:
+        for tabela in _tabelas_arrow(df, esquema, tamanho_bloco):
+            escritor.write_table(tabela)
+    return _finalizar_destino(destino, arquivo, fechar)